@@ -37,6 +37,13 @@ def start_channel(channel_name: str):
             threading.Thread(target=linkai_client.start, args=(channel,)).start()
         except Exception as e:
             pass
+    from common.metrics import start_metrics_server
+    from common.tmp_dir import start_tmp_sweeper
+    from voice.tts_cache import start_prewarm
+
+    start_tmp_sweeper()
+    start_prewarm()
+    start_metrics_server()
     channel.startup()
 
 
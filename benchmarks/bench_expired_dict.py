@@ -0,0 +1,89 @@
+"""
+ExpiredDict基准测试：对比旧实现(dict+datetime，keys()逐个检查)与新实现的读写、keys()耗时，
+以及消息去重场景下只写不读时的内存占用(条目数)。
+
+python -m benchmarks.bench_expired_dict
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common.expired_dict import ExpiredDict
+
+SIZES = [1000, 10000, 100000]
+
+
+class OldExpiredDict(dict):
+    """替换前的实现"""
+
+    def __init__(self, expires_in_seconds):
+        super().__init__()
+        self.expires_in_seconds = expires_in_seconds if expires_in_seconds else 3600
+
+    def __getitem__(self, key):
+        value, expiry_time = super().__getitem__(key)
+        if datetime.now() > expiry_time:
+            del self[key]
+            raise KeyError("expired {}".format(key))
+        self.__setitem__(key, value)
+        return value
+
+    def __setitem__(self, key, value):
+        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
+        super().__setitem__(key, (value, expiry_time))
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def keys(self):
+        keys = list(super().keys())
+        return [key for key in keys if key in self]
+
+
+def bench_ops(cls, n):
+    d = cls(3600)
+    start = time.perf_counter()
+    for i in range(n):
+        d[i] = True
+    write = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(n):
+        _ = i in d
+    read = time.perf_counter() - start
+    start = time.perf_counter()
+    d.keys()
+    keys = time.perf_counter() - start
+    return write / n * 1e6, read / n * 1e6, keys * 1e3
+
+
+def bench_dedup(cls, n, ttl):
+    """模拟消息去重：每条消息只写一次，之后不再读取"""
+    d = cls(ttl)
+    for i in range(n):
+        d["msg_{}".format(i)] = True
+        if i % (n // 10) == 0:
+            time.sleep(ttl / 5)
+    return dict.__len__(d) if isinstance(d, dict) else len(d._data)
+
+
+def main():
+    print("{:>8} {:>6} {:>10} {:>10} {:>10}".format("size", "impl", "set(us)", "in(us)", "keys(ms)"))
+    for n in SIZES:
+        for name, cls in (("old", OldExpiredDict), ("new", ExpiredDict)):
+            write, read, keys = bench_ops(cls, n)
+            print("{:>8} {:>6} {:>10.2f} {:>10.2f} {:>10.2f}".format(n, name, write, read, keys))
+    print()
+    n, ttl = 50000, 0.1
+    print("dedup {} msgs, ttl={}s, entries kept: old={}, new={}".format(
+        n, ttl, bench_dedup(OldExpiredDict, n, ttl), bench_dedup(ExpiredDict, n, ttl)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+itchat 联系人存储查询基准测试：1k个群 × 500个成员，
+对比 search_chatrooms + 成员查找 与原先逐个扫描并 deepcopy 的耗时。
+
+python -m benchmarks.bench_itchat_storage
+"""
+import copy
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib import itchat
+from lib.itchat import utils
+from lib.itchat.storage import Storage
+
+CHATROOM_COUNT = 1000
+MEMBER_COUNT = 500
+LOOKUPS = 10000
+
+
+def build_storage():
+    storage = Storage(itchat.instance)
+    for c in range(CHATROOM_COUNT):
+        storage.chatroomList.append({
+            "UserName": "@@room{}".format(c),
+            "NickName": "room{}".format(c),
+            "MemberList": [{"UserName": "@user{}_{}".format(c, m), "NickName": "user{}".format(m)} for m in range(MEMBER_COUNT)],
+        })
+    return storage
+
+
+def bench_indexed(storage):
+    start = time.perf_counter()
+    for i in range(LOOKUPS):
+        c = i % CHATROOM_COUNT
+        chatroom = storage.search_chatrooms(userName="@@room{}".format(c))
+        chatroom["MemberList"].find("@user{}_{}".format(c, MEMBER_COUNT // 2))
+    return (time.perf_counter() - start) / LOOKUPS
+
+
+def bench_deepcopy(storage, lookups=200):
+    start = time.perf_counter()
+    for i in range(lookups):
+        c = i % CHATROOM_COUNT
+        chatroom = copy.deepcopy(utils.search_dict_list(storage.chatroomList, "UserName", "@@room{}".format(c)))
+        utils.search_dict_list(chatroom["MemberList"], "UserName", "@user{}_{}".format(c, MEMBER_COUNT // 2))
+    return (time.perf_counter() - start) / lookups
+
+
+if __name__ == "__main__":
+    storage = build_storage()
+    bench_indexed(storage)  # 首次查询时建立索引
+    print("chatrooms: {}, members per chatroom: {}".format(CHATROOM_COUNT, MEMBER_COUNT))
+    print("indexed view lookup: {:.2f}us".format(bench_indexed(storage) * 1e6))
+    print("scan + deepcopy lookup: {:.2f}us".format(bench_deepcopy(storage) * 1e6))
@@ -0,0 +1,478 @@
+"""
+消息处理全链路压测：在进程内驱动一个ChatChannel子类(BenchChannel)，bot使用ChatGPTBot，open_ai_api_base指向
+本地模拟的OpenAI兼容接口(benchmarks/mock_openai.py)，完整经过 _compose_context、produce/consume、插件链、Bridge、bot和send。
+场景：
+- single_burst: N个用户同时各发一条私聊文字消息
+- group_fanin: N条@机器人的群消息集中在少数几个群(--groups)，每个群共用一个会话
+- voice: N个用户同时各发一条私聊语音，先经语音识别再对话
+- plugins: 开启banwords、keyword、godcmd、role，消息中混有关键词、管理指令、角色设定和敏感词
+模拟接口在主进程中运行，每个场景在单独的子进程中运行(单例、线程池和内存互不影响)，
+输出吞吐(msgs/s)、收到消息到回复发送完成的延迟p50/p99、线程数峰值、RSS峰值和各阶段的平均耗时，
+--json 输出机器可读的结果，便于回归对比
+会话的token数用tiktoken计算，离线环境需要预先缓存编码文件，否则每次请求都会尝试下载，结果偏慢
+
+python -m benchmarks.bench_pipeline [--scenarios single_burst,voice] [--messages 500] [--latency 0.2] [--tokens 100]
+                                    [--error-rate 0] [--handler-mode thread|asyncio] [--workers 8] [--json result.json]
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import wave
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+SCENARIOS = ("single_burst", "group_fanin", "voice", "plugins")
+BOT_ID = "bench_bot"
+BOT_NAME = "bot"
+PLUGINS = ("godcmd", "banwords", "keyword", "role")
+KEYWORDS = {"价格": "本店商品一律九折", "营业时间": "每天9点到21点", "地址": "人民路1号"}
+BANWORDS = ["违禁词{}".format(i) for i in range(2000)]
+PLUGIN_CONFIG = {
+    "godcmd": {"password": "", "admin_users": []},
+    "banwords": {"action": "replace", "reply_filter": True, "reply_action": "ignore", "cache": False},
+}
+# 插件只从自身目录读取的文件，不存在时临时创建，结束后删除
+PLUGIN_FILES = {
+    os.path.join("keyword", "config.json"): json.dumps({"keyword": KEYWORDS}, ensure_ascii=False),
+    os.path.join("banwords", "banwords.txt"): "\n".join(BANWORDS),
+}
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def process_status():
+    """返回 (RSS字节数, 线程数)，非Linux时RSS取历史峰值、线程数只统计Python线程"""
+    try:
+        rss = threads = None
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("Threads:"):
+                    threads = int(line.split()[1])
+        if rss is not None and threads is not None:
+            return rss, threads
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == "darwin" else maxrss * 1024, threading.active_count()
+
+
+class ResourceSampler(object):
+    """后台定时采样RSS和线程数，记录峰值"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.rss_start, self.threads_start = process_status()
+        self.rss_peak, self.threads_peak = self.rss_start, self.threads_start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="bench_sampler", daemon=True)
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss, threads = process_status()
+        self.rss_peak = max(self.rss_peak, rss)
+        self.threads_peak = max(self.threads_peak, threads)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+
+def build_messages(scenario, count, groups, workdir):
+    """返回 [(ContextType名, 内容, 用户id, 群id)]"""
+    messages = []
+    if scenario == "voice":
+        voice_dir = os.path.join(workdir, "voice")
+        os.makedirs(voice_dir, exist_ok=True)
+        sample = os.path.join(voice_dir, "sample.wav")
+        write_wav(sample)
+        for i in range(count):
+            # 处理完后语音文件会被删除，每条消息一份
+            path = os.path.join(voice_dir, "msg_{}.wav".format(i))
+            shutil.copyfile(sample, path)
+            messages.append(("VOICE", path, "user{}".format(i), None))
+        return messages
+    for i in range(count):
+        user_id = "user{}".format(i)
+        content = "问题{}：介绍一下你自己".format(i)
+        if scenario == "group_fanin":
+            messages.append(("TEXT", "@{} {}".format(BOT_NAME, content), user_id, "group{}".format(i % groups)))
+            continue
+        if scenario == "plugins":
+            kind = i % 10
+            if kind == 0:
+                content = "#help"
+            elif kind == 1:
+                content = "价格"
+            elif kind == 2:
+                content = "$角色 猫娘"
+            elif kind == 3:
+                user_id = "user{}".format(i - 1)  # 上一个用户设定角色后接着提问
+            elif kind == 4:
+                content = "这句话里有{}".format(BANWORDS[i % len(BANWORDS)])
+        messages.append(("TEXT", content, user_id, None))
+    return messages
+
+
+def write_wav(path, seconds=2, rate=16000):
+    import math
+
+    frames = bytearray()
+    for i in range(int(seconds * rate)):
+        value = int(8000 * math.sin(2 * math.pi * 440 * i / rate))
+        frames += value.to_bytes(2, "little", signed=True)
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(bytes(frames))
+
+
+def bench_config(args, workdir):
+    config = {
+        "model": "gpt-3.5-turbo",
+        "open_ai_api_key": "sk-bench",
+        "open_ai_api_base": args.api_base,
+        "single_chat_prefix": [""],
+        "single_chat_reply_prefix": "",
+        "group_chat_prefix": ["@" + BOT_NAME],
+        "group_name_white_list": ["ALL_GROUP"],
+        "group_chat_in_one_session": ["ALL_GROUP"],
+        "voice_to_text": "openai",
+        "voice_reply_voice": False,
+        "always_reply_voice": False,
+        "handler_mode": args.handler_mode,
+        "appdata_dir": workdir,
+        "plugin_trigger_prefix": "$",
+        "metrics": True,
+    }
+    if args.workers:
+        config["handler_pool_max_workers"] = args.workers
+    return config
+
+
+def run_scenario(args):
+    """子进程中运行一个场景，结果写入args.result"""
+    from config import Config, publish_config, write_plugin_config
+
+    workdir = os.getcwd()
+    publish_config(Config(bench_config(args, workdir)))
+
+    from common.log import logger
+
+    logger.setLevel(args.log_level)
+
+    from bridge.context import ContextType
+    from channel.chat_channel import ChatChannel
+    from channel.chat_message import ChatMessage
+    from common import metrics
+
+    class BenchMessage(ChatMessage):
+        def __init__(self, msg_id, ctype, content, user_id, group_id=None):
+            super().__init__(None)
+            self.msg_id = msg_id
+            self.create_time = int(time.time())
+            self.ctype = ctype
+            self.content = content
+            self.from_user_id = self.from_user_nickname = user_id
+            self.to_user_id = BOT_ID
+            self.to_user_nickname = BOT_NAME
+            if group_id:
+                self.is_group = True
+                self.is_at = True
+                self.other_user_id = self.other_user_nickname = group_id
+                self.actual_user_id = self.actual_user_nickname = user_id
+            else:
+                self.other_user_id = self.other_user_nickname = user_id
+
+    class BenchChannel(ChatChannel):
+        channel_type = "bench"
+
+        def __init__(self, total, send_latency):
+            super().__init__()
+            self.name = BOT_NAME
+            self.user_id = BOT_ID
+            self.total = total
+            self.send_latency = send_latency
+            self.mutex = threading.Lock()
+            self.latencies = {}  # msg_id -> 收到消息到第一条回复发送完成的秒数
+            self.reply_types = Counter()
+            self.finished = 0
+            self.finished_at = None
+            self.done = threading.Event()
+
+        def send(self, reply, context):
+            if self.send_latency:
+                time.sleep(self.send_latency)
+            msg = context["msg"]
+            with self.mutex:
+                if msg.msg_id not in self.latencies:
+                    self.latencies[msg.msg_id] = time.monotonic() - msg.received_at
+                self.reply_types[reply.type.name] += 1
+
+        def _handle(self, context):
+            try:
+                super()._handle(context)
+            finally:
+                self.finish_one()
+
+        async def _handle_async(self, context):
+            try:
+                await super()._handle_async(context)
+            finally:
+                self.finish_one()
+
+        def finish_one(self):
+            with self.mutex:
+                self.finished += 1
+                if self.finished >= self.total:
+                    self.finished_at = time.monotonic()
+                    self.done.set()
+
+    created = []
+    if args.child == "plugins":
+        created = load_plugins(write_plugin_config)
+    try:
+        messages = build_messages(args.child, args.messages, args.groups, workdir)
+        channel = BenchChannel(len(messages), args.send_latency)
+        sampler = ResourceSampler()
+        sampler.start()
+        cpu_start = time.process_time()
+        start = time.monotonic()
+        dropped = 0
+        for i, (ctype, content, user_id, group_id) in enumerate(messages):
+            if args.rate:
+                delay = start + i / args.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            cmsg = BenchMessage(i, ContextType[ctype], content, user_id, group_id)
+            context = channel._compose_context(cmsg.ctype, cmsg.content, isgroup=cmsg.is_group, msg=cmsg)
+            if context:
+                channel.produce(context)
+            else:
+                dropped += 1
+                channel.finish_one()
+        timed_out = not channel.done.wait(args.timeout)
+        end = channel.finished_at or time.monotonic()
+        cpu = time.process_time() - cpu_start
+        sampler.stop()
+    finally:
+        for path in created:
+            os.remove(path)
+
+    elapsed = end - start
+    latencies = list(channel.latencies.values())
+    result = {
+        "scenario": args.child,
+        "messages": len(messages),
+        "finished": channel.finished,
+        "replied": len(latencies),
+        "dropped": dropped,
+        "timed_out": timed_out,
+        "elapsed_s": round(elapsed, 3),
+        "msgs_per_s": round(channel.finished / elapsed, 2) if elapsed > 0 else 0,
+        "latency_p50_ms": round(percentile(latencies, 0.5) * 1000, 1),
+        "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "latency_max_ms": round(max(latencies) * 1000, 1) if latencies else 0,
+        "reply_types": dict(channel.reply_types),
+        "threads_start": sampler.threads_start,
+        "threads_peak": sampler.threads_peak,
+        "rss_start_mb": round(sampler.rss_start / 1048576, 1),
+        "rss_peak_mb": round(sampler.rss_peak / 1048576, 1),
+        "cpu_s": round(cpu, 3),
+        "stage_mean_ms": stage_means(metrics.registry),
+    }
+    with open(args.result, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def load_plugins(write_plugin_config):
+    """只加载PLUGINS中的插件，不扫描plugins目录、不写plugins.json，返回临时创建的文件"""
+    created = []
+    for name, content in PLUGIN_FILES.items():
+        path = os.path.join(ROOT, "plugins", name)
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(content)
+            created.append(path)
+    write_plugin_config(PLUGIN_CONFIG)
+    from plugins import PluginManager
+
+    manager = PluginManager()
+    try:
+        for name in PLUGINS:
+            manager.current_plugin_path = os.path.join(ROOT, "plugins", name)
+            importlib.import_module("plugins." + name)
+        manager.current_plugin_path = None
+        for name in manager.plugins:
+            instance = manager.plugins[name]()
+            manager.instances[name] = instance
+            for event in instance.handlers:
+                manager.listening_plugins.setdefault(event, []).append(name)
+        manager.refresh_order()
+    except BaseException:
+        for path in created:
+            os.remove(path)
+        raise
+    return created
+
+
+def stage_means(registry):
+    """各阶段和整条消息的平均耗时(毫秒)"""
+    totals = {}
+    with registry.lock:
+        for name, series in registry.histograms.items():
+            if name not in ("stage_seconds", "message_seconds"):
+                continue
+            for key, histogram in series.items():
+                stage = dict(key).get("stage", "message")
+                total, count = totals.get(stage, (0.0, 0))
+                totals[stage] = (total + histogram.sum, count + histogram.count)
+    return {stage: round(total / count * 1000, 2) for stage, (total, count) in sorted(totals.items()) if count}
+
+
+def run_child(args, scenario, api_base):
+    workdir = tempfile.mkdtemp(prefix="bench_pipeline_")
+    result_path = os.path.join(workdir, "result.json")
+    cmd = [
+        sys.executable, os.path.abspath(__file__), "--child", scenario, "--api-base", api_base, "--result", result_path,
+        "--messages", str(args.messages), "--groups", str(args.groups), "--handler-mode", args.handler_mode,
+        "--rate", str(args.rate), "--send-latency", str(args.send_latency), "--timeout", str(args.timeout),
+        "--log-level", args.log_level,
+    ]
+    if args.workers:
+        cmd += ["--workers", str(args.workers)]
+    try:
+        # 子进程的日志输出到stderr，stdout留给 --json -
+        proc = subprocess.run(cmd, cwd=workdir, stdout=sys.stderr, timeout=args.timeout + 60)
+        if proc.returncode != 0 or not os.path.exists(result_path):
+            return {"scenario": scenario, "error": "exit code {}".format(proc.returncode)}
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"scenario": scenario, "error": "timeout"}
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="消息处理全链路压测")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="逗号分隔，可选 " + ",".join(SCENARIOS))
+    parser.add_argument("--messages", type=int, default=500, help="每个场景的消息数")
+    parser.add_argument("--groups", type=int, default=5, help="group_fanin场景的群数量")
+    parser.add_argument("--rate", type=float, default=0, help="每秒发送的消息数，0为一次性全部发送")
+    parser.add_argument("--latency", type=float, default=0.2, help="模拟接口的平均响应时间(秒)")
+    parser.add_argument("--jitter", type=float, default=0.05, help="模拟接口响应时间的随机波动(秒)")
+    parser.add_argument("--tokens", type=int, default=100, help="每条回复的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟接口返回500的比例，bot会按原有逻辑等待后重试")
+    parser.add_argument("--send-latency", type=float, default=0.0, help="每次发送回复的耗时(秒)，模拟调用平台接口")
+    parser.add_argument("--handler-mode", default="thread", choices=("thread", "asyncio"))
+    parser.add_argument("--workers", type=int, default=0, help="handler_pool_max_workers，0为使用默认值")
+    parser.add_argument("--timeout", type=float, default=300, help="每个场景的最长等待时间(秒)")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="结果写入的文件，- 为输出到标准输出")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--api-base", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.child:
+        code = 0
+        try:
+            run_scenario(args)
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        audio_convert = sys.modules.get("voice.audio_convert")
+        if audio_convert and audio_convert._convert_pool:
+            audio_convert._convert_pool.shutdown()  # 语音转换的子进程不会随os._exit退出
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(code)  # 不等待线程池等非守护线程
+
+    from benchmarks.mock_openai import MockOpenAI
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        sys.exit("unknown scenarios: {}".format(", ".join(unknown)))
+    mock = MockOpenAI(latency=args.latency, jitter=args.jitter, tokens=args.tokens, error_rate=args.error_rate, seed=1)
+    api_base = mock.start()
+    results = []
+    try:
+        for scenario in scenarios:
+            mock.reset_stats()
+            result = run_child(args, scenario, api_base)
+            result["backend"] = mock.get_stats()
+            results.append(result)
+    finally:
+        mock.stop()
+
+    out = sys.stderr if args.json == "-" else sys.stdout
+    print("{} messages per scenario, handler_mode={}, backend latency={}s±{}s, tokens={}, error_rate={}".format(
+        args.messages, args.handler_mode, args.latency, args.jitter, args.tokens, args.error_rate), file=out)
+    print("{:>13} {:>9} {:>9} {:>9} {:>10} {:>10} {:>8} {:>9} {:>7}".format(
+        "scenario", "finished", "replied", "msgs/s", "p50(ms)", "p99(ms)", "threads", "rss(MB)", "cpu(s)"), file=out)
+    for r in results:
+        if "error" in r:
+            print("{:>13} failed: {}".format(r["scenario"], r["error"]), file=out)
+            continue
+        print("{:>13} {:>9} {:>9} {:>9.1f} {:>10.1f} {:>10.1f} {:>8} {:>9.1f} {:>7.2f}{}".format(
+            r["scenario"], r["finished"], r["replied"], r["msgs_per_s"], r["latency_p50_ms"], r["latency_p99_ms"],
+            r["threads_peak"], r["rss_peak_mb"], r["cpu_s"], "  (timed out)" if r["timed_out"] else ""), file=out)
+
+    if args.json:
+        report = {
+            "timestamp": int(time.time()),
+            "revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "options": {k: v for k, v in vars(args).items() if k not in ("child", "api_base", "result", "json")},
+            "results": results,
+        }
+        if args.json == "-":
+            json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+            print()
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+ChatChannel 会话调度基准测试：
+模拟10k个并发session，统计 produce -> _handle 的调度延迟，以及空闲时消费者线程的CPU占用。
+
+python -m benchmarks.bench_session_scheduler [session数量]
+"""
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bridge.context import Context, ContextType
+from channel.chat_channel import ChatChannel
+
+
+class BenchChannel(ChatChannel):
+    def __init__(self, total):
+        super().__init__()
+        self.total = total
+        self.latencies = []
+        self.done = threading.Event()
+        self.mutex = threading.Lock()
+
+    def _handle(self, context: Context):
+        latency = time.perf_counter() - context["produce_at"]
+        with self.mutex:
+            self.latencies.append(latency)
+            if len(self.latencies) >= self.total:
+                self.done.set()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def main(session_count=10000):
+    channel = BenchChannel(session_count)
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for i in range(session_count):
+        context = Context(ContextType.TEXT, "hello", kwargs={"session_id": "session_{}".format(i)})
+        context["produce_at"] = time.perf_counter()
+        channel.produce(context)
+    channel.done.wait()
+    elapsed = time.perf_counter() - start
+    busy_cpu = time.process_time() - cpu_start
+
+    idle_cpu_start = time.process_time()
+    time.sleep(2)
+    idle_cpu = time.process_time() - idle_cpu_start
+
+    print("sessions: {}".format(session_count))
+    print("total: {:.3f}s, throughput: {:.0f} msg/s".format(elapsed, session_count / elapsed))
+    print("dispatch latency p50: {:.2f}ms, p99: {:.2f}ms".format(percentile(channel.latencies, 0.5) * 1000, percentile(channel.latencies, 0.99) * 1000))
+    print("cpu busy: {:.3f}s, cpu idle(2s): {:.3f}s".format(busy_cpu, idle_cpu))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
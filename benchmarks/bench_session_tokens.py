@@ -0,0 +1,53 @@
+"""
+会话token裁剪基准测试：50~500轮的会话，对比增量token计数与每次pop后重新编码整个会话的耗时。
+
+python -m benchmarks.bench_session_tokens [model]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bot.chatgpt.chat_gpt_session import ChatGPTSession, num_tokens_from_messages
+
+TURNS = [50, 100, 200, 500]
+QUERY = "请帮我总结一下这篇文章的主要观点，并给出三条可以落地的建议。" * 3
+REPLY = "好的，这篇文章主要讨论了以下几个方面的问题，第一是背景，第二是方法，第三是结论。" * 5
+
+
+def build_session(turns, model):
+    session = ChatGPTSession("bench", system_prompt="You are a helpful assistant.", model=model)
+    for _ in range(turns):
+        session.add_query(QUERY)
+        session.add_reply(REPLY)
+    return session
+
+
+def discard_by_recount(session, max_tokens):
+    """裁剪前的实现：每pop一条消息就重新计算整个会话的token数"""
+    cur_tokens = num_tokens_from_messages(session.messages, session.model)
+    while cur_tokens > max_tokens and len(session.messages) > 2:
+        session.messages.pop(1)
+        cur_tokens = num_tokens_from_messages(session.messages, session.model)
+    return cur_tokens
+
+
+def main(model="gpt-3.5-turbo"):
+    print("model: {}".format(model))
+    for turns in TURNS:
+        session = build_session(turns, model)
+        max_tokens = session.calc_tokens() // 10  # 裁剪掉约90%的历史
+        start = time.perf_counter()
+        discard_by_recount(session, max_tokens)
+        recount = time.perf_counter() - start
+
+        session = build_session(turns, model)
+        start = time.perf_counter()
+        session.discard_exceeding(max_tokens)
+        incremental = time.perf_counter() - start
+        print("turns: {:4d}, recount: {:8.2f}ms, incremental: {:6.2f}ms".format(turns, recount * 1000, incremental * 1000))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1] if len(sys.argv) > 1 else "gpt-3.5-turbo")
@@ -0,0 +1,95 @@
+"""
+TriggerMatcher基准测试：模拟_compose_context中的群消息匹配过程，
+对比旧实现(列表查找、逐个前缀和关键词匹配、每次构造@昵称正则)与预编译的TriggerMatcher的单条消息耗时
+
+python -m benchmarks.bench_trigger_matcher
+"""
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(os.path.dirname(__file__))))
+
+from channel.chat_channel import check_contain, check_prefix
+from channel.trigger_matcher import TriggerMatcher
+from config import Config
+
+ROUNDS = 20000
+
+
+def make_config(groups, keywords):
+    return Config({
+        "group_name_white_list": ["群聊{}".format(i) for i in range(groups)],
+        "group_name_keyword_white_list": ["关键词{}".format(i) for i in range(keywords)],
+        "group_chat_in_one_session": ["群聊{}".format(i) for i in range(0, groups, 2)],
+        "nick_name_black_list": ["黑名单{}".format(i) for i in range(groups)],
+        "group_chat_prefix": ["@bot", "bot"] + ["前缀{}".format(i) for i in range(keywords)],
+        "group_chat_keyword": ["触发{}".format(i) for i in range(keywords)],
+        "image_create_prefix": ["画", "看", "找"],
+    })
+
+
+def old_match(config, group_name, content, nick_name, at_list):
+    group_name_white_list = config.get("group_name_white_list", [])
+    if not any([
+        group_name in group_name_white_list,
+        "ALL_GROUP" in group_name_white_list,
+        check_contain(group_name, config.get("group_name_keyword_white_list", [])),
+    ]):
+        return None
+    group_chat_in_one_session = config.get("group_chat_in_one_session", [])
+    any([group_name in group_chat_in_one_session, "ALL_GROUP" in group_chat_in_one_session])
+    match_prefix = check_prefix(content, config.get("group_chat_prefix"))
+    check_contain(content, config.get("group_chat_keyword"))
+    if match_prefix:
+        content = content.replace(match_prefix, "", 1).strip()
+    if nick_name in config.get("nick_name_black_list", []):
+        return None
+    subtract_res = re.sub(f"@{re.escape('bot')}(\u2005|\u0020)", r"", content)
+    for at in at_list:
+        subtract_res = re.sub(f"@{re.escape(at)}(\u2005|\u0020)", r"", subtract_res)
+    return check_prefix(subtract_res.strip(), config.get("image_create_prefix", [""]))
+
+
+def new_match(matcher, group_name, content, nick_name, at_list):
+    if not matcher.is_group_allowed(group_name):
+        return None
+    matcher.is_group_in_one_session(group_name)
+    match_prefix = matcher.match_prefix(matcher.group_chat_prefix, content)
+    matcher.match_contain(matcher.group_chat_keyword, content)
+    if match_prefix:
+        content = content.replace(match_prefix, "", 1).strip()
+    if matcher.is_blacklisted(nick_name):
+        return None
+    subtract_res = matcher.strip_mentions(content, ["bot"] + at_list)
+    return matcher.match_prefix(matcher.image_create_prefix, subtract_res.strip())
+
+
+def bench(fn, target, messages):
+    start = time.perf_counter()
+    for i in range(ROUNDS):
+        fn(target, *messages[i % len(messages)])
+    return (time.perf_counter() - start) / ROUNDS * 1e6
+
+
+def main():
+    messages = [
+        ("群聊1", "@bot 你好", "张三", []),  # 白名单群@机器人
+        ("不相关的群", "今天天气不错", "李四", []),  # 不回复的群
+        ("群聊998", "大家好 触发199 一下", "王五", ["张三"]),  # 关键词触发
+        ("群聊关键词42", "bot 画一只猫", "赵六", ["李四", "王五"]),  # 群名关键词+前缀
+    ]
+    print("{:>8} {:>8} {:>12} {:>12} {:>8}".format("groups", "keywords", "old(us)", "new(us)", "speedup"))
+    for groups, keywords in ((10, 10), (200, 50), (1000, 200)):
+        config = make_config(groups, keywords)
+        matcher = TriggerMatcher(config)
+        for message in messages:
+            assert old_match(config, *message) == new_match(matcher, *message)
+        old = bench(old_match, config, messages)
+        new = bench(new_match, matcher, messages)
+        print("{:>8} {:>8} {:>12.2f} {:>12.2f} {:>7.1f}x".format(groups, keywords, old, new, old / new))
+
+
+if __name__ == "__main__":
+    main()
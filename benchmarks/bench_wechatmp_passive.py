@@ -0,0 +1,117 @@
+"""
+公众号被动回复等待的压测：模拟N个关注者同时发消息，每个请求占用一个服务线程等待回复(最多4秒)，
+回复由handler线程池在0.2~1秒后生成。对比替换前的0.1秒轮询与按用户Event唤醒：
+回复生成到请求返回的延迟、请求占用服务线程的总时长、同时占用的线程数峰值、进程CPU时间
+
+python -m benchmarks.bench_wechatmp_passive [关注者数量]
+"""
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from channel.wechatmp.passive_state import PassiveReplyState
+
+WAIT_SECONDS = 4
+HANDLER_WORKERS = 256
+
+
+class LegacyState:
+    """替换前的实现：running集合 + cache_dict，请求线程每0.1秒检查一次"""
+
+    def __init__(self):
+        self.running = set()
+        self.cache_dict = {}
+
+    def start(self, user_id):
+        self.running.add(user_id)
+
+    def finish(self, user_id):
+        self.running.discard(user_id)
+
+    def add_reply(self, user_id, reply_type, content):
+        self.cache_dict.setdefault(user_id, []).append((reply_type, content))
+
+    def wait(self, user_id, timeout):
+        waiting_until = time.time() + timeout
+        while time.time() < waiting_until:
+            if user_id in self.running:
+                time.sleep(0.1)
+            else:
+                return True
+        return False
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def run(state, followers):
+    random.seed(1)
+    delays = [random.uniform(0.2, 1.0) for _ in range(followers)]
+    ready_at = {}
+    latencies = []
+    held = []
+    active = [0, 0]  # 当前等待中的请求数, 峰值
+    lock = threading.Lock()
+    pool = ThreadPoolExecutor(max_workers=HANDLER_WORKERS)
+
+    def handle(user_id, delay):
+        time.sleep(delay)
+        state.add_reply(user_id, "text", "reply")
+        ready_at[user_id] = time.perf_counter()
+        state.finish(user_id)
+
+    def request(user_id):
+        start = time.perf_counter()
+        with lock:
+            active[0] += 1
+            active[1] = max(active[1], active[0])
+        ready = state.wait(user_id, WAIT_SECONDS)
+        end = time.perf_counter()
+        with lock:
+            active[0] -= 1
+            held.append(end - start)
+            if ready:
+                latencies.append(end - ready_at[user_id])
+
+    cpu = time.process_time()
+    threads = []
+    for i in range(followers):
+        user_id = "user{}".format(i)
+        state.start(user_id)
+        pool.submit(handle, user_id, delays[i])
+        thread = threading.Thread(target=request, args=(user_id,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    pool.shutdown()
+    return {
+        "answered": len(latencies),
+        "p50": percentile(latencies, 0.5) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "held": sum(held),
+        "peak": active[1],
+        "cpu": time.process_time() - cpu,
+    }
+
+
+def main():
+    followers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print("{} followers, {} handler threads".format(followers, HANDLER_WORKERS))
+    print("{:>8} {:>9} {:>13} {:>13} {:>16} {:>12} {:>8}".format(
+        "impl", "answered", "wake p50(ms)", "wake p99(ms)", "thread-seconds", "peak threads", "cpu(s)"))
+    for name, state in (("polling", LegacyState()), ("event", PassiveReplyState())):
+        r = run(state, followers)
+        print("{:>8} {:>9} {:>13.1f} {:>13.1f} {:>16.1f} {:>12} {:>8.2f}".format(
+            name, r["answered"], r["p50"], r["p99"], r["held"], r["peak"], r["cpu"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+敏感词匹配基准测试：对比替换前的对象节点实现与双数组AC自动机的构建耗时、内存占用、扫描吞吐，
+以及从序列化文件加载的耗时
+
+python -m benchmarks.bench_words_search [词数]
+"""
+import gc
+import importlib.util
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.legacy_words_search import WordsSearch as OldWordsSearch
+
+
+def load_new():
+    # 直接按文件加载，避免导入plugins.banwords时注册插件
+    path = os.path.join(ROOT, "plugins", "banwords", "lib", "WordsSearch.py")
+    spec = importlib.util.spec_from_file_location("words_search", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.WordsSearch
+
+
+NewWordsSearch = load_new()
+# 常用汉字范围内随机取字，模拟中文词库
+CHARS = [chr(c) for c in range(0x4E00, 0x4E00 + 3000)]
+
+
+def make_words(n):
+    random.seed(42)
+    return list({"".join(random.choice(CHARS) for _ in range(random.randint(2, 6))) for _ in range(n)})
+
+
+def make_texts(words, count=2000):
+    random.seed(7)
+    texts = []
+    for i in range(count):
+        text = "".join(random.choice(CHARS) for _ in range(200))
+        if i % 10 == 0:  # 一成消息包含敏感词
+            pos = random.randint(0, 190)
+            text = text[:pos] + random.choice(words) + text[pos:]
+        texts.append(text)
+    return texts
+
+
+def build(cls, words):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    searcher = cls()
+    searcher.SetKeywords(words)
+    cost = time.perf_counter() - start
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return searcher, cost, memory
+
+
+def scan(searcher, texts):
+    chars = sum(len(text) for text in texts)
+    result = {}
+    for name in ("ContainsAny", "FindFirst", "Replace"):
+        fn = getattr(searcher, name)
+        start = time.perf_counter()
+        for text in texts:
+            fn(text)
+        result[name] = chars / (time.perf_counter() - start) / 1e6
+    return result
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    words = make_words(n)
+    texts = make_texts(words)
+    print("{} words, {} texts x 200 chars".format(len(words), len(texts)))
+    print("{:>6} {:>10} {:>12} {:>14} {:>14} {:>14}".format(
+        "impl", "build(s)", "memory(MB)", "contains(Mc/s)", "first(Mc/s)", "replace(Mc/s)"))
+    searchers = {}
+    for name, cls in (("old", OldWordsSearch), ("new", NewWordsSearch)):
+        searcher, cost, memory = build(cls, words)
+        searchers[name] = searcher
+        rates = scan(searcher, texts)
+        print("{:>6} {:>10.2f} {:>12.1f} {:>14.2f} {:>14.2f} {:>14.2f}".format(
+            name, cost, memory / 1024 / 1024, rates["ContainsAny"], rates["FindFirst"], rates["Replace"]))
+    for text in texts[:200]:
+        assert searchers["old"].Replace(text) == searchers["new"].Replace(text)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "banwords.cache")
+        searchers["new"].Save(path, "bench")
+        start = time.perf_counter()
+        loaded = NewWordsSearch()
+        assert loaded.Load(path, "bench")
+        print("load from cache: {:.3f}s, file size {:.1f}MB".format(
+            time.perf_counter() - start, os.path.getsize(path) / 1024 / 1024))
+
+
+if __name__ == "__main__":
+    main()
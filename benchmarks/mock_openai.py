@@ -0,0 +1,169 @@
+"""
+本地模拟的OpenAI兼容接口，供全链路压测使用，不依赖外部网络：
+- POST /v1/chat/completions: 等待 latency±jitter 秒后返回tokens个token的回复，支持stream
+- POST /v1/audio/transcriptions: 等待 latency/2 秒后返回固定的识别文字
+按error_rate的比例返回500错误。每个连接一个线程，等待期间不占用其它请求
+
+python -m benchmarks.mock_openai [--port 8000] [--latency 0.2] [--jitter 0.1] [--tokens 100] [--error-rate 0]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRANSCRIPTION_TEXT = "今天天气怎么样"
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # 保持连接，与真实接口一样复用连接池
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        mock = self.server.mock
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        path = self.path.split("?", 1)[0]
+        if path.endswith("/chat/completions"):
+            kind = "chat"
+        elif path.endswith("/audio/transcriptions"):
+            kind = "transcriptions"
+        else:
+            mock.count("not_found")
+            return self._json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+        mock.count(kind)
+        delay = mock.delay()
+        if kind == "transcriptions":
+            time.sleep(delay / 2)
+            return self._json(200, {"text": TRANSCRIPTION_TEXT})
+        time.sleep(delay)
+        if mock.fail():
+            mock.count("errors")
+            return self._json(500, {"error": {"message": "mock server error", "type": "server_error"}})
+        try:
+            request = json.loads(body or b"{}")
+        except ValueError:
+            return self._json(400, {"error": {"message": "invalid json", "type": "invalid_request_error"}})
+        prompt_tokens = max(1, len(json.dumps(request.get("messages", []), ensure_ascii=False)) // 2)
+        if request.get("stream"):
+            return self._stream(request, mock.tokens)
+        self._json(200, {
+            "id": "chatcmpl-" + uuid.uuid4().hex,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-3.5-turbo"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": mock.content()}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": mock.tokens, "total_tokens": prompt_tokens + mock.tokens},
+        })
+
+    def _json(self, status, data):
+        payload = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, request, tokens):
+        """按SSE逐个token返回，不写Content-Length，发完后关闭连接"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        chunk_id = "chatcmpl-" + uuid.uuid4().hex
+        for i in range(tokens):
+            delta = {"role": "assistant", "content": "测"} if i == 0 else {"content": "。" if i % 20 == 19 else "测"}
+            self._event({"id": chunk_id, "object": "chat.completion.chunk", "model": request.get("model"),
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+        self._event({"id": chunk_id, "object": "chat.completion.chunk", "model": request.get("model"),
+                     "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _event(self, data):
+        self.wfile.write("data: {}\n\n".format(json.dumps(data, ensure_ascii=False)).encode("utf-8"))
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # 突发的并发连接不被拒绝
+
+
+class MockOpenAI(object):
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, jitter=0.1, tokens=100, error_rate=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.tokens = max(1, tokens)
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.server = MockServer((host, port), MockHandler)
+        self.server.mock = self
+        self.thread = None
+
+    @property
+    def api_base(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}/v1".format(host, port)
+
+    def delay(self):
+        with self.lock:
+            return max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+
+    def fail(self):
+        if not self.error_rate:
+            return False
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def content(self):
+        # 中文按约1个字1个token，每20个字断一句
+        return "".join("。" if i % 20 == 19 else "测" for i in range(self.tokens))
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock_openai", daemon=True)
+        self.thread.start()
+        return self.api_base
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的OpenAI兼容接口")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0.2, help="平均响应时间(秒)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="响应时间的随机波动(秒)")
+    parser.add_argument("--tokens", type=int, default=100, help="每条回复的token数")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回500错误的比例")
+    args = parser.parse_args()
+    mock = MockOpenAI(args.host, args.port, args.latency, args.jitter, args.tokens, args.error_rate)
+    print("mock openai api on {}".format(mock.api_base))
+    try:
+        mock.server.serve_forever()
+    except KeyboardInterrupt:
+        mock.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
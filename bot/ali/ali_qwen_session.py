@@ -28,11 +28,11 @@ class AliQwenSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= self.message_tokens(popped)
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -43,20 +43,13 @@ class AliQwenSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= self.message_tokens(popped)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
-
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
-    # 官方token计算规则："对于中文文本来说，1个token通常对应一个汉字；对于英文文本来说，1个token通常对应3至4个字母或1个单词"
-    # 详情请产看文档：https://help.aliyun.com/document_detail/2586397.html
-    # 目前根据字符串长度粗略估计token数，不影响正常使用
-    tokens = 0
-    for msg in messages:
-        tokens += len(msg["content"])
-    return tokens
+    def num_message_tokens(self, message):
+        # 官方token计算规则："对于中文文本来说，1个token通常对应一个汉字；对于英文文本来说，1个token通常对应3至4个字母或1个单词"
+        # 详情请产看文档：https://help.aliyun.com/document_detail/2586397.html
+        # 目前根据字符串长度粗略估计token数，不影响正常使用
+        return len(message["content"])
@@ -1,16 +1,18 @@
 # encoding:utf-8
 
-import requests
+from common import http_client
+from common.token_cache import get_token_cache
 
 from bot.bot import Bot
 from bridge.reply import Reply, ReplyType
 
+# access_token无效或已过期的错误码
+TOKEN_ERROR_CODES = (110, 111)
+
 
 # Baidu Unit对话接口 (可用, 但能力较弱)
 class BaiduUnitBot(Bot):
     def reply(self, query, context=None):
-        token = self.get_token()
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + token
         post_data = (
             '{"version":"3.0","service_id":"S73177","session_id":"","log_id":"7758521","skill_ids":["1221886"],"request":{"terminal_id":"88888","query":"'
             + query
@@ -18,7 +20,13 @@ class BaiduUnitBot(Bot):
         )
         print(post_data)
         headers = {"content-type": "application/x-www-form-urlencoded"}
-        response = requests.post(url, data=post_data.encode(), headers=headers)
+
+        def request(token):
+            url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + str(token)
+            return http_client.post(url, data=post_data.encode(), headers=headers)
+
+        # token被提前吊销时刷新后重试一次
+        response = self.get_token_cache().request(request, lambda res: bool(res) and res.json().get("error_code") in TOKEN_ERROR_CODES)
         if response:
             reply = Reply(
                 ReplyType.TEXT,
@@ -27,10 +35,18 @@ class BaiduUnitBot(Bot):
             return reply
 
     def get_token(self):
+        return self.get_token_cache().get()
+
+    def get_token_cache(self):
         access_key = "YOUR_ACCESS_KEY"
         secret_key = "YOUR_SECRET_KEY"
-        host = "https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id=" + access_key + "&client_secret=" + secret_key
-        response = requests.get(host)
-        if response:
-            print(response.json())
-            return response.json()["access_token"]
+
+        def fetch():
+            host = "https://aip.baidubce.com/oauth/2.0/token?grant_type=client_credentials&client_id=" + access_key + "&client_secret=" + secret_key
+            response = http_client.get(host)
+            if response:
+                print(response.json())
+                return response.json()["access_token"], response.json().get("expires_in")
+            return None, 0
+
+        return get_token_cache("baidu_unit:" + access_key, fetch)
@@ -1,6 +1,5 @@
 # encoding:utf-8
 
-import requests
 import json
 from common import const
 from bot.bot import Bot
@@ -8,11 +7,15 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
+from common.token_cache import get_token_cache
 from config import conf
 from bot.baidu.baidu_wenxin_session import BaiduWenxinSession
 
 BAIDU_API_KEY = conf().get("baidu_wenxin_api_key")
 BAIDU_SECRET_KEY = conf().get("baidu_wenxin_secret_key")
+# access_token无效或已过期的错误码
+TOKEN_ERROR_CODES = (110, 111)
 
 class BaiduWenxinBot(Bot):
 
@@ -28,6 +31,7 @@ class BaiduWenxinBot(Bot):
                 wenxin_model = "completions_pro"
 
         self.sessions = SessionManager(BaiduWenxinSession, model=wenxin_model)
+        self.token_cache = get_token_cache("baidu_wenxin:{}".format(BAIDU_API_KEY), self._request_access_token)
 
     def reply(self, query, context=None):
         # acquire reply content
@@ -80,13 +84,18 @@ class BaiduWenxinBot(Bot):
                     "completion_tokens": 0,
                     "content": 0,
                     }
-            url = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/" + session.model + "?access_token=" + access_token
             headers = {
                 'Content-Type': 'application/json'
             }
             payload = {'messages': session.messages}
-            response = requests.request("POST", url, headers=headers, data=json.dumps(payload))
-            response_text = json.loads(response.text)
+
+            def request(access_token):
+                url = "https://aip.baidubce.com/rpc/2.0/ai_custom/v1/wenxinworkshop/chat/" + session.model + "?access_token=" + str(access_token)
+                response = http_client.request("POST", url, headers=headers, data=json.dumps(payload))
+                return json.loads(response.text)
+
+            # token被提前吊销时刷新后重试一次
+            response_text = self.token_cache.request(request, lambda res: res.get("error_code") in TOKEN_ERROR_CODES)
             logger.info(f"[BAIDU] response text={response_text}")
             res_content = response_text["result"]
             total_tokens = response_text["usage"]["total_tokens"]
@@ -106,10 +115,18 @@ class BaiduWenxinBot(Bot):
             return result
 
     def get_access_token(self):
+        """
+        获取缓存的鉴权签名（Access Token），临近过期时自动刷新
+        :return: access_token，或是'None'(如果错误)
+        """
+        return str(self.token_cache.get())
+
+    def _request_access_token(self):
         """
         使用 AK，SK 生成鉴权签名（Access Token）
-        :return: access_token，或是None(如果错误)
+        :return: (access_token, expires_in)
         """
         url = "https://aip.baidubce.com/oauth/2.0/token"
         params = {"grant_type": "client_credentials", "client_id": BAIDU_API_KEY, "client_secret": BAIDU_SECRET_KEY}
-        return str(requests.post(url, params=params).json().get("access_token"))
+        res = http_client.post(url, params=params).json()
+        return res.get("access_token"), res.get("expires_in")
@@ -28,26 +28,17 @@ class BaiduWenxinSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) >= 2:
-                self.messages.pop(0)
-                self.messages.pop(0)
+                popped = [self.messages.pop(0), self.messages.pop(0)]
             else:
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= sum(self.message_tokens(msg) for msg in popped)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
-
-
-def num_tokens_from_messages(messages, model):
-    """Returns the number of tokens used by a list of messages."""
-    tokens = 0
-    for msg in messages:
+    def num_message_tokens(self, message):
         # 官方token计算规则暂不明确： "大约为 token数为 "中文字 + 其他语种单词数 x 1.3"
         # 这里先直接根据字数粗略估算吧，暂不影响正常使用，仅在判断是否丢弃历史会话的时候会有偏差
-        tokens += len(msg["content"])
-    return tokens
+        return len(message["content"])
@@ -5,6 +5,7 @@ Auto-replay chat robot abstract class
 
 from bridge.context import Context
 from bridge.reply import Reply
+from common.event_loop import run_sync
 
 
 class Bot(object):
@@ -15,3 +16,9 @@ class Bot(object):
         :return: reply content
         """
         raise NotImplementedError
+
+    async def reply_async(self, query, context: Context = None) -> Reply:
+        """
+        asyncio模式下调用，默认在线程池中执行同步的reply，基于HTTP接口的bot可以重写为原生协程
+        """
+        return await run_sync(self.reply, query, context)
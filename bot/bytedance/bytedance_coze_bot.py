@@ -3,7 +3,6 @@
 import time
 from typing import List, Tuple
 
-import requests
 from requests import Response
 
 from bot.bot import Bot
@@ -12,6 +11,7 @@ from bot.session_manager import SessionManager
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
 from config import conf
 
 class ByteDanceCozeBot(Bot):
@@ -67,7 +67,7 @@ class ByteDanceCozeBot(Bot):
             chat_url = f'{base_url}/chat'
             headers = self._get_headers()
             payload = self._get_payload(session.session_id, query, chat_history)
-            response = requests.post(chat_url, headers=headers, json=payload)
+            response = http_client.post(chat_url, headers=headers, json=payload)
             if response.status_code != 200:
                 error_info = f"[COZE] response text={response.text} status_code={response.status_code}"
                 logger.warn(error_info)
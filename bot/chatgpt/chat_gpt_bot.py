@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import asyncio
 import base64
 import time
 
@@ -13,10 +14,12 @@ from bot.openai.open_ai_image import OpenAIImage
 from bot.openai.open_ai_vision import OpenAIVision
 from bot.session_manager import SessionManager
 from bridge.context import ContextType
-from bridge.reply import Reply, ReplyType
+from bridge.reply import Reply, ReplyType, StreamReply
+from common.event_loop import run_sync
 from common.log import logger
 from common.token_bucket import TokenBucket
-from common import memory, utils, const
+from common import memory, metrics, utils, const
+from common import http_client
 from config import conf, load_config
 
 
@@ -69,33 +72,13 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             logger.debug("[CHATGPT] session query={}".format(session.messages))
 
             api_key = context.get("openai_api_key")
-            model = context.get("gpt_model")
-            new_args = None
-            if model:
-                new_args = self.args.copy()
-                new_args["model"] = model
-            # if context.get('stream'):
-            #     # reply in stream
-            #     return self.reply_text_stream(query, new_query, session_id)
+            new_args = self._context_args(context)
+            if context.get("stream"):
+                # 流式回复
+                return self.reply_text_stream(session_id, session, api_key, args=new_args)
 
             reply_content = self.reply_text(session_id, session, api_key, args=new_args)
-            logger.debug(
-                "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
-                    session.messages,
-                    session_id,
-                    reply_content["content"],
-                    reply_content["completion_tokens"],
-                )
-            )
-            if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-            elif reply_content["completion_tokens"] > 0:
-                self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
-                reply = Reply(ReplyType.TEXT, reply_content["content"])
-            else:
-                reply = Reply(ReplyType.ERROR, reply_content["content"])
-                logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
-            return reply
+            return self._build_reply(session_id, session, reply_content)
 
         elif context.type == ContextType.IMAGE_CREATE:
             ok, retstring = self.create_img(query, 0, context=context)
@@ -109,6 +92,47 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
             return reply
 
+    async def reply_async(self, query, context=None):
+        # 普通文本对话使用原生协程请求，不占用线程；指令、画图、识图、流式和限流仍在线程池中执行同步的reply
+        if context.type != ContextType.TEXT or context.get("stream") or query.startswith("#") \
+                or query in conf().get("clear_memory_commands", ["#清除记忆"]) or conf().get("rate_limit_chatgpt") \
+                or (conf().get("image_recognition") and memory.USER_IMAGE_CACHE.get(context["session_id"])):
+            return await super().reply_async(query, context)
+        logger.info("[CHATGPT] query={}".format(query))
+        session_id = context["session_id"]
+        # 会话的读写可能访问sqlite/redis存储，与token计算一起放到线程池中，不阻塞事件循环
+        session = await run_sync(self.sessions.session_query, query, session_id)
+        reply_content = await self.reply_text_async(session_id, session, context.get("openai_api_key"),
+                                                    args=self._context_args(context))
+        return await run_sync(self._build_reply, session_id, session, reply_content)
+
+    def _context_args(self, context):
+        model = context.get("gpt_model")
+        if not model:
+            return None
+        new_args = self.args.copy()
+        new_args["model"] = model
+        return new_args
+
+    def _build_reply(self, session_id, session, reply_content) -> Reply:
+        logger.debug(
+            "[CHATGPT] new_query={}, session_id={}, reply_cont={}, completion_tokens={}".format(
+                session.messages,
+                session_id,
+                reply_content["content"],
+                reply_content["completion_tokens"],
+            )
+        )
+        if reply_content["completion_tokens"] == 0 and len(reply_content["content"]) > 0:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+        elif reply_content["completion_tokens"] > 0:
+            self.sessions.session_reply(reply_content["content"], session_id, reply_content["total_tokens"])
+            reply = Reply(ReplyType.TEXT, reply_content["content"])
+        else:
+            reply = Reply(ReplyType.ERROR, reply_content["content"])
+            logger.debug("[CHATGPT] reply {} used 0 tokens.".format(reply_content))
+        return reply
+
     def reply_text(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
         """
         call openai's ChatCompletion to get the answer
@@ -129,87 +153,159 @@ class ChatGPTBot(Bot, OpenAIImage, OpenAIVision):
             response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, **args)
             # logger.debug("[CHATGPT] response={}".format(response))
             # logger.info("[ChatGPT] reply={}, total_tokens={}".format(response.choices[0]['message']['content'], response["usage"]["total_tokens"]))
-            content = response.choices[0]["message"]["content"]
-            # fastgpt工具调用格式处理
-            if isinstance(content, list):
-                # {
-                #     "id": "",
-                #     "model": "",
-                #     "usage": {},
-                #     "choices": [
-                #         {
-                #             "message": {
-                #                 "role": "assistant",
-                #                 "content": [
-                #                     {
-                #                         "type": "tool",
-                #                         "tools": [
-                #                             {
-                #                                 "id": "xx",
-                #                                 "toolName": "HTTP请求",
-                #                                 "toolAvatar": "xx",
-                #                                 "functionName": "xx",
-                #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
-                #                                 "response": "xxx"
-                #                             }
-                #                         ]
-                #                     },
-                #                     {
-                #                         "type": "text",
-                #                         "text": {
-                #                             "content": "xxx"
-                #                         }
-                #                     }
-                #                 ]
-                #             },
-                #             "finish_reason": "stop",
-                #             "index": 0
-                #         }
-                #     ]
-                # }
-                for item in content:
-                    if item["type"] == "text":
-                        content = item["text"]["content"]
-                        break
-            return {
-                "total_tokens": response["usage"]["total_tokens"],
-                "completion_tokens": response["usage"]["completion_tokens"],
-                "content": content,
-            }
+            return self._parse_response(response)
         except Exception as e:
-            need_retry = retry_count < 2
-            result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
-            if isinstance(e, openai.error.RateLimitError):
-                logger.warn("[CHATGPT] RateLimitError: {}".format(e))
-                result["content"] = "提问太快啦，请休息一下再问我吧"
-                if need_retry:
-                    time.sleep(20)
-            elif isinstance(e, openai.error.Timeout):
-                logger.warn("[CHATGPT] Timeout: {}".format(e))
-                result["content"] = "我没有收到你的消息"
-                if need_retry:
-                    time.sleep(5)
-            elif isinstance(e, openai.error.APIError):
-                logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
-                result["content"] = "请再问我一次"
-                if need_retry:
-                    time.sleep(10)
-            elif isinstance(e, openai.error.APIConnectionError):
-                logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
-                result["content"] = "我连接不到你的网络"
-                if need_retry:
-                    time.sleep(5)
+            need_retry, result, delay = self._handle_reply_error(e, session, retry_count)
+            if need_retry:
+                time.sleep(delay)
+                logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
+                return self.reply_text(session_id, session, api_key, args, retry_count + 1)
             else:
-                logger.exception("[CHATGPT] Exception: {}".format(e))
-                need_retry = False
-                self.sessions.clear_session(session.session_id)
+                return result
 
+    async def reply_text_async(self, session_id: str, session: ChatGPTSession, api_key=None, args=None, retry_count=0) -> dict:
+        """
+        reply_text的协程版本，使用openai的异步接口请求，重试等待不占用线程
+        """
+        try:
+            if args is None:
+                args = self.args
+            response = await openai.ChatCompletion.acreate(api_key=api_key, messages=session.messages, **args)
+            return self._parse_response(response)
+        except Exception as e:
+            need_retry, result, delay = await run_sync(self._handle_reply_error, e, session, retry_count)
             if need_retry:
+                await asyncio.sleep(delay)
                 logger.warn("[CHATGPT] 第{}次重试".format(retry_count + 1))
-                return self.reply_text(session_id, session, api_key, args, retry_count + 1)
+                return await self.reply_text_async(session_id, session, api_key, args, retry_count + 1)
             else:
                 return result
 
+    def _parse_response(self, response) -> dict:
+        content = response.choices[0]["message"]["content"]
+        # fastgpt工具调用格式处理
+        if isinstance(content, list):
+            # {
+            #     "id": "",
+            #     "model": "",
+            #     "usage": {},
+            #     "choices": [
+            #         {
+            #             "message": {
+            #                 "role": "assistant",
+            #                 "content": [
+            #                     {
+            #                         "type": "tool",
+            #                         "tools": [
+            #                             {
+            #                                 "id": "xx",
+            #                                 "toolName": "HTTP请求",
+            #                                 "toolAvatar": "xx",
+            #                                 "functionName": "xx",
+            #                                 "params": "{\"key1\":\"xx\",\"key2\":\"xxx"}",
+            #                                 "response": "xxx"
+            #                             }
+            #                         ]
+            #                     },
+            #                     {
+            #                         "type": "text",
+            #                         "text": {
+            #                             "content": "xxx"
+            #                         }
+            #                     }
+            #                 ]
+            #             },
+            #             "finish_reason": "stop",
+            #             "index": 0
+            #         }
+            #     ]
+            # }
+            for item in content:
+                if item["type"] == "text":
+                    content = item["text"]["content"]
+                    break
+        return {
+            "total_tokens": response["usage"]["total_tokens"],
+            "completion_tokens": response["usage"]["completion_tokens"],
+            "content": content,
+        }
+
+    def _handle_reply_error(self, e, session: ChatGPTSession, retry_count):
+        """
+        :return: (是否重试, 不再重试时的返回结果, 重试前等待的秒数)
+        """
+        need_retry = retry_count < 2
+        delay = 0
+        result = {"completion_tokens": 0, "content": "我现在有点累了，等会再来吧"}
+        if isinstance(e, openai.error.RateLimitError):
+            logger.warn("[CHATGPT] RateLimitError: {}".format(e))
+            result["content"] = "提问太快啦，请休息一下再问我吧"
+            delay = 20
+        elif isinstance(e, openai.error.Timeout):
+            logger.warn("[CHATGPT] Timeout: {}".format(e))
+            result["content"] = "我没有收到你的消息"
+            delay = 5
+        elif isinstance(e, openai.error.APIError):
+            logger.warn("[CHATGPT] Bad Gateway: {}".format(e))
+            result["content"] = "请再问我一次"
+            delay = 10
+        elif isinstance(e, openai.error.APIConnectionError):
+            logger.warn("[CHATGPT] APIConnectionError: {}".format(e))
+            result["content"] = "我连接不到你的网络"
+            delay = 5
+        else:
+            logger.exception("[CHATGPT] Exception: {}".format(e))
+            need_retry = False
+            self.sessions.clear_session(session.session_id)
+        if need_retry:
+            metrics.inc("retries_total", component="bot", bot="chatgpt")
+        return need_retry, result, delay
+
+    def reply_text_stream(self, session_id: str, session: ChatGPTSession, api_key=None, args=None) -> Reply:
+        """
+        call openai's ChatCompletion in stream mode
+        :return: StreamReply, the answer is saved to the session after the stream ends
+        """
+        if args is None:
+            args = self.args
+        res = self.do_vision_completion_if_need(session_id, session.messages[-1]['content'])
+        if res:
+            if res["completion_tokens"] > 0:
+                self.sessions.session_reply(res["content"], session_id, res["total_tokens"])
+                return Reply(ReplyType.TEXT, res["content"])
+            return Reply(ReplyType.ERROR, res["content"])
+
+        def generate():
+            if conf().get("rate_limit_chatgpt") and not self.tb4chatgpt.get_token():
+                reply.failed = True
+                yield "提问太快啦，请休息一下再问我吧"
+                return
+            try:
+                response = openai.ChatCompletion.create(api_key=api_key, messages=session.messages, stream=True, **args)
+            except Exception as e:
+                # 请求未建立时回退到非流式调用，沿用其重试和错误提示
+                logger.warn("[CHATGPT] stream request error, fallback to non-stream: {}".format(e))
+                result = self.reply_text(session_id, session, api_key, args)
+                if result["completion_tokens"] > 0:
+                    self.sessions.session_reply(result["content"], session_id, result["total_tokens"])
+                else:
+                    reply.failed = True  # 重试后仍失败，content为错误提示
+                yield result["content"]
+                return
+            parts = []
+            for chunk in response:
+                if not chunk.get("choices"):
+                    continue
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    parts.append(delta)
+                    yield delta
+            if parts:
+                self.sessions.session_reply("".join(parts), session_id)
+
+        reply = StreamReply(generate())
+        return reply
+
 
 class AzureChatGPTBot(ChatGPTBot):
     def __init__(self):
@@ -231,13 +327,13 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "256x256"),"n": 1}
-                submission = requests.post(url, headers=headers, json=body)
+                submission = http_client.post(url, headers=headers, json=body)
                 operation_location = submission.headers['operation-location']
                 status = ""
                 while (status != "succeeded"):
                     if retry_count > 3:
                         return False, "图片生成失败"
-                    response = requests.get(operation_location, headers=headers)
+                    response = http_client.get(operation_location, headers=headers)
                     status = response.json()['status']
                     retry_count += 1
                 image_url = response.json()['result']['data'][0]['url']
@@ -256,7 +352,7 @@ class AzureChatGPTBot(ChatGPTBot):
             headers = {"api-key": api_key, "Content-Type": "application/json"}
             try:
                 body = {"prompt": query, "size": conf().get("image_create_size", "1024x1024"), "quality": conf().get("dalle3_image_quality", "standard")}
-                response = requests.post(url, headers=headers, json=body)
+                response = http_client.post(url, headers=headers, json=body)
                 response.raise_for_status()  # 检查请求是否成功
                 data = response.json()
 
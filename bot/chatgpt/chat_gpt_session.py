@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from bot.session_manager import Session
 from common.log import logger
 from common import const
@@ -29,11 +31,11 @@ class ChatGPTSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= self.message_tokens(popped)
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -44,33 +46,60 @@ class ChatGPTSession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(messages)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= self.message_tokens(popped)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_messages(self.messages, self.model)
+        return super().calc_tokens() + num_reply_priming_tokens(self.model)
+
+    def num_message_tokens(self, message):
+        return num_tokens_from_message(message, self.model)
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_messages(messages, model):
     """Returns the number of tokens used by a list of messages."""
+    return sum(num_tokens_from_message(message, model) for message in messages) + num_reply_priming_tokens(model)
+
+
+def num_tokens_from_message(message, model):
+    """Returns the number of tokens used by a single message, excluding reply priming."""
+    if model in ["wenxin", "xunfei", const.GEMINI]:
+        return len(message["content"])
+    encoding, tokens_per_message, tokens_per_name = get_encoding(model)
+    num_tokens = tokens_per_message
+    for key, value in message.items():
+        num_tokens += len(encoding.encode(value))
+        if key == "name":
+            num_tokens += tokens_per_name
+    return num_tokens
 
+
+def num_reply_priming_tokens(model):
     if model in ["wenxin", "xunfei", const.GEMINI]:
-        return num_tokens_by_character(messages)
+        return 0
+    return 3  # every reply is primed with <|start|>assistant<|message|>
+
 
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """
+    Returns (encoding, tokens_per_message, tokens_per_name) for a model.
+    Cached per model, resolving the tiktoken encoding is much slower than encoding a message.
+    """
     import tiktoken
 
     if model in ["gpt-3.5-turbo-0301", "gpt-35-turbo", "gpt-3.5-turbo-1106", "moonshot", const.LINKAI_35]:
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return get_encoding("gpt-3.5-turbo")
     elif model in ["gpt-4-0314", "gpt-4-0613", "gpt-4-32k", "gpt-4-32k-0613", "gpt-3.5-turbo-0613",
                    "gpt-3.5-turbo-16k", "gpt-3.5-turbo-16k-0613", "gpt-35-turbo-16k", "gpt-4-turbo-preview",
                    "gpt-4-1106-preview", const.GPT4_TURBO_PREVIEW, const.GPT4_VISION_PREVIEW, const.GPT4_TURBO_01_25,
                    const.GPT_4o, const.GPT_4o_MINI, const.LINKAI_4o, const.LINKAI_4_TURBO]:
-        return num_tokens_from_messages(messages, model="gpt-4")
+        return get_encoding("gpt-4")
     elif model.startswith("claude-3"):
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
+        return get_encoding("gpt-3.5-turbo")
     try:
         encoding = tiktoken.encoding_for_model(model)
     except KeyError:
@@ -84,21 +113,5 @@ def num_tokens_from_messages(messages, model):
         tokens_per_name = 1
     else:
         logger.warn(f"num_tokens_from_messages() is not implemented for model {model}. Returning num tokens assuming gpt-3.5-turbo.")
-        return num_tokens_from_messages(messages, model="gpt-3.5-turbo")
-    num_tokens = 0
-    for message in messages:
-        num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
-    num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
-    return num_tokens
-
-
-def num_tokens_by_character(messages):
-    """Returns the number of tokens used by a list of messages."""
-    tokens = 0
-    for msg in messages:
-        tokens += len(msg["content"])
-    return tokens
+        return get_encoding("gpt-3.5-turbo")
+    return encoding, tokens_per_message, tokens_per_name
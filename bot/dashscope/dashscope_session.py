@@ -18,11 +18,11 @@ class DashscopeSession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 2:
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
             elif len(self.messages) == 2 and self.messages[1]["role"] == "assistant":
-                self.messages.pop(1)
+                popped = self.messages.pop(1)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= self.message_tokens(popped)
                 else:
                     cur_tokens = cur_tokens - max_tokens
                 break
@@ -34,18 +34,11 @@ class DashscopeSession(Session):
                                                                                        len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= self.message_tokens(popped)
             else:
                 cur_tokens = cur_tokens - max_tokens
         return cur_tokens
 
-    def calc_tokens(self):
-        return num_tokens_from_messages(self.messages)
-
-
-def num_tokens_from_messages(messages):
-    # 只是大概，具体计算规则：https://help.aliyun.com/zh/dashscope/developer-reference/token-api?spm=a2c4g.11186623.0.0.4d8b12b0BkP3K9
-    tokens = 0
-    for msg in messages:
-        tokens += len(msg["content"])
-    return tokens
+    def num_message_tokens(self, message):
+        # 只是大概，具体计算规则：https://help.aliyun.com/zh/dashscope/developer-reference/token-api?spm=a2c4g.11186623.0.0.4d8b12b0BkP3K9
+        return len(message["content"])
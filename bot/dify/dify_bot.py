@@ -13,11 +13,13 @@ from bot.bot import Bot
 from lib.dify.dify_client import DifyClient, ChatClient
 from bot.dify.dify_session import DifySession, DifySessionManager
 from bridge.context import ContextType, Context
-from bridge.reply import Reply, ReplyType
+from bridge.reply import Reply, ReplyType, StreamReply
 from common.log import logger
 from common import const, memory
 from common.utils import parse_markdown_text
 from common.tmp_dir import TmpDir
+from common import http_client
+from common import media_fetcher
 from config import conf
 
 class DifyBot(Bot):
@@ -47,9 +49,10 @@ class DifyBot(Bot):
             logger.debug(f"[DIFY] session={session} query={query}")
 
             reply, err = self._reply(query, session, context)
+            self.sessions.save_session(session)
             if err != None:
                 error_msg = conf().get("error_reply", "我暂时遇到了一些问题，请您稍后重试~")
-                reply = Reply(ReplyType.TEXT, error_msg)
+                reply = Reply(ReplyType.TEXT, error_msg, failed=True)
             return reply
         else:
             reply = Reply(ReplyType.ERROR, "Bot不支持处理{}类型的消息".format(context.type))
@@ -87,7 +90,7 @@ class DifyBot(Bot):
         api_key = conf().get('dify_api_key', '')
         api_base = conf().get("dify_api_base", "https://api.dify.ai/v1")
         chat_client = ChatClient(api_key, api_base)
-        response_mode = 'blocking'
+        response_mode = 'streaming' if context.get("stream") else 'blocking'
         payload = self._get_payload(query, session, response_mode)
         files = self._get_upload_files(session)
         response = chat_client.create_chat_message(
@@ -104,6 +107,9 @@ class DifyBot(Bot):
             logger.warn(error_info)
             return None, error_info
 
+        if response_mode == 'streaming':
+            return StreamReply(self._stream_chatbot_answer(response, session)), None
+
         # response: 
         # {
         #     "event": "message",
@@ -184,17 +190,16 @@ class DifyBot(Bot):
 
     def _download_file(self, url):
         try:
-            response = requests.get(url)
-            response.raise_for_status()
+            content = media_fetcher.fetch(url, "file")
             parsed_url = urlparse(url)
             logger.debug(f"Downloading file from {url}")
             url_path = unquote(parsed_url.path)
             # 从路径中提取文件名
             file_name = url_path.split('/')[-1]
             logger.debug(f"Saving file as {file_name}")
-            file_path = os.path.join(TmpDir().path(), file_name)
+            file_path = TmpDir().new_file(name=file_name)
             with open(file_path, 'wb') as file:
-                file.write(response.content)
+                file.write(content)
             return file_path
         except Exception as e:
             logger.error(f"Error downloading {url}: {e}")
@@ -202,15 +207,8 @@ class DifyBot(Bot):
 
     def _download_image(self, url):
         try:
-            pic_res = requests.get(url, stream=True)
-            pic_res.raise_for_status()
-            image_storage = io.BytesIO()
-            size = 0
-            for block in pic_res.iter_content(1024):
-                size += len(block)
-                image_storage.write(block)
-            logger.debug(f"[WX] download image success, size={size}, img_url={url}")
-            image_storage.seek(0)
+            image_storage = media_fetcher.fetch_io(url, "image")
+            logger.debug(f"[WX] download image success, size={len(image_storage.getvalue())}, img_url={url}")
             return image_storage
         except Exception as e:
             logger.error(f"Error downloading {url}: {e}")
@@ -439,6 +437,33 @@ class DifyBot(Bot):
         
         return merged_message, conversation_id
 
+    def _stream_chatbot_answer(self, response: requests.Response, session: DifySession):
+        """逐段产出chatbot的回答，结束后保存conversation_id；流式回复中的图片和文件链接按markdown文本发送"""
+        conversation_id = None
+        # 提前结束(message_end、出错或调用方不再迭代)时关闭响应，连接才能归还连接池
+        with response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                event = self._parse_sse_event(line.decode('utf-8'))
+                if not event:
+                    continue
+                event_name = event['event']
+                if not conversation_id and event.get('conversation_id'):
+                    conversation_id = event['conversation_id']
+                if event_name == 'message' or event_name == 'agent_message':
+                    yield event['answer']
+                elif event_name == 'error':
+                    logger.error("[DIFY] error: {}".format(event))
+                    raise Exception(event)
+                elif event_name == 'message_end':
+                    logger.debug("[DIFY] message_end usage: {}".format(event.get('metadata', {}).get('usage')))
+                    break
+        # 设置dify conversation_id, 依靠dify管理上下文
+        if conversation_id and session.get_conversation_id() == '':
+            session.set_conversation_id(conversation_id)
+            self.sessions.save_session(session)
+
     def _append_agent_message(self, accumulated_agent_message,  merged_message):
         if accumulated_agent_message:
             merged_message.append({
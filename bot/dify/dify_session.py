@@ -1,4 +1,6 @@
+from bot.session_store import get_session_store
 from common.expired_dict import ExpiredDict
+from common.log import logger
 from config import conf
 
 
@@ -21,6 +23,19 @@ class DifySession(object):
     def set_conversation_id(self, conversation_id):
         self.__conversation_id = conversation_id
 
+    def get_user_message_counter(self):
+        return self.__user_message_counter
+
+    def set_user_message_counter(self, counter):
+        self.__user_message_counter = counter
+
+    def to_meta(self):
+        return {
+            "user": self.__user,
+            "conversation_id": self.__conversation_id,
+            "user_message_counter": self.__user_message_counter,
+        }
+
     def count_user_message(self):
         if conf().get("dify_conversation_max_messages", 5) <= 0:
             # 当设置的最大消息数小于等于0，则不限制
@@ -34,13 +49,19 @@ class DifySession(object):
 
 class DifySessionManager(object):
     def __init__(self, sessioncls, **session_kwargs):
+        self.store = get_session_store()
+        self.namespace = sessioncls.__name__
+        max_size = conf().get("session_cache_max_size", 1000) if self.store.persistent else None
         if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
+            sessions = ExpiredDict(conf().get("expires_in_seconds"), max_size=max_size)
+        elif max_size:
+            sessions = ExpiredDict(365 * 24 * 3600, max_size=max_size)
         else:
             sessions = dict()
         self.sessions = sessions
         self.sessioncls = sessioncls
         self.session_kwargs = session_kwargs
+        self.saved_meta = ExpiredDict(conf().get("expires_in_seconds") or 3600, max_size=max_size)  # session_id -> 上次写入的元数据
 
     def _build_session(self, session_id: str, user: str):
         """
@@ -50,7 +71,10 @@ class DifySessionManager(object):
             return self.sessioncls(session_id, user)
 
         if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, user)
+            session = self._load_session(session_id, user)
+            if session is None:
+                session = self.sessioncls(session_id, user)
+            self.sessions[session_id] = session
         session = self.sessions[session_id]
         return session
 
@@ -58,9 +82,42 @@ class DifySessionManager(object):
         session = self._build_session(session_id, user)
         return session
 
+    def save_session(self, session: DifySession):
+        """conversation_id或消息计数变化后写入存储"""
+        if not self.store.persistent or session.get_session_id() is None:
+            return
+        meta = session.to_meta()
+        if self.saved_meta.get(session.get_session_id()) == meta:
+            return
+        try:
+            self.store.save_meta(self.namespace, session.get_session_id(), meta)
+            self.saved_meta[session.get_session_id()] = meta
+        except Exception as e:
+            logger.warning("[DifySessionManager] save session {} failed: {}".format(session.get_session_id(), e))
+
     def clear_session(self, session_id):
         if session_id in self.sessions:
             del self.sessions[session_id]
+        self.saved_meta.pop(session_id, None)
+        self.store.delete(self.namespace, session_id)
 
     def clear_all_session(self):
         self.sessions.clear()
+        self.saved_meta.clear()
+        self.store.clear(self.namespace)
+
+    def _load_session(self, session_id, user):
+        if not self.store.persistent:
+            return None
+        try:
+            data = self.store.load(self.namespace, session_id)
+        except Exception as e:
+            logger.warning("[DifySessionManager] load session {} failed: {}".format(session_id, e))
+            return None
+        if data is None:
+            return None
+        meta = data[0]
+        session = self.sessioncls(session_id, meta.get("user") or user, meta.get("conversation_id", ""))
+        session.set_user_message_counter(meta.get("user_message_counter", 0))
+        self.saved_meta[session_id] = meta
+        return session
@@ -3,7 +3,6 @@
 
 import re
 import time
-import requests
 import config
 from bot.bot import Bot
 from bot.chatgpt.chat_gpt_session import ChatGPTSession
@@ -13,7 +12,8 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf, pconf
 import threading
-from common import memory, utils
+from common import memory, metrics, utils
+from common import http_client
 import base64
 import os
 
@@ -55,7 +55,7 @@ class LinkAIBot(Bot):
         if retry_count > 2:
             # exit from retry 2 times
             logger.warn("[LINKAI] failed after maximum number of retry times")
-            return Reply(ReplyType.TEXT, "请再问我一次吧")
+            return Reply(ReplyType.TEXT, "请再问我一次吧", failed=True)
 
         try:
             # load config
@@ -123,8 +123,8 @@ class LinkAIBot(Bot):
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = http_client.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
+                                   timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -150,7 +150,8 @@ class LinkAIBot(Bot):
                     if response["choices"][0].get("text_content"):
                         reply_content = response["choices"][0].get("text_content")
                 reply_content = self._process_url(reply_content)
-                return Reply(ReplyType.TEXT, reply_content)
+                # 超出限流配置时reply_content是平台返回的限流提示
+                return Reply(ReplyType.TEXT, reply_content, failed=res_code == 429)
 
             else:
                 response = res.json()
@@ -161,18 +162,20 @@ class LinkAIBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     time.sleep(2)
+                    metrics.inc("retries_total", component="bot", bot="linkai")
                     logger.warn(f"[LINKAI] do retry, times={retry_count}")
                     return self._chat(query, context, retry_count + 1)
 
                 error_reply = "提问太快啦，请休息一下再问我吧"
                 if res.status_code == 409:
                     error_reply = "这个问题我还没有学会，请问我其它问题吧"
-                return Reply(ReplyType.TEXT, error_reply)
+                return Reply(ReplyType.TEXT, error_reply, failed=True)
 
         except Exception as e:
             logger.exception(e)
             # retry
             time.sleep(2)
+            metrics.inc("retries_total", component="bot", bot="linkai")
             logger.warn(f"[LINKAI] do retry, times={retry_count}")
             return self._chat(query, context, retry_count + 1)
 
@@ -262,8 +265,8 @@ class LinkAIBot(Bot):
 
             # do http request
             base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
-            res = requests.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
-                                timeout=conf().get("request_timeout", 180))
+            res = http_client.post(url=base_url + "/v1/chat/completions", json=body, headers=headers,
+                                   timeout=conf().get("request_timeout", 180))
             if res.status_code == 200:
                 # execute success
                 response = res.json()
@@ -285,6 +288,7 @@ class LinkAIBot(Bot):
                 if res.status_code >= 500:
                     # server error, need retry
                     time.sleep(2)
+                    metrics.inc("retries_total", component="bot", bot="linkai")
                     logger.warn(f"[LINKAI] do retry, times={retry_count}")
                     return self.reply_text(session, app_code, retry_count + 1)
 
@@ -298,6 +302,7 @@ class LinkAIBot(Bot):
             logger.exception(e)
             # retry
             time.sleep(2)
+            metrics.inc("retries_total", component="bot", bot="linkai")
             logger.warn(f"[LINKAI] do retry, times={retry_count}")
             return self.reply_text(session, app_code, retry_count + 1)
 
@@ -306,7 +311,7 @@ class LinkAIBot(Bot):
         # do http request
         base_url = conf().get("linkai_api_base", "https://api.link-ai.tech")
         params = {"app_code": app_code}
-        res = requests.get(url=base_url + "/v1/app/info", params=params, headers=headers, timeout=(5, 10))
+        res = http_client.get(url=base_url + "/v1/app/info", params=params, headers=headers, timeout=(5, 10))
         if res.status_code == 200:
             return res.json()
         else:
@@ -327,7 +332,7 @@ class LinkAIBot(Bot):
                 "img_proxy": conf().get("image_proxy")
             }
             url = conf().get("linkai_api_base", "https://api.link-ai.tech") + "/v1/images/generations"
-            res = requests.post(url, headers=headers, json=data, timeout=(5, 90))
+            res = http_client.post(url, headers=headers, json=data, timeout=(5, 90))
             t2 = time.time()
             image_url = res.json()["data"][0]["url"]
             logger.info("[OPEN_AI] image_url={}".format(image_url))
@@ -430,7 +435,7 @@ def _download_file(url: str):
             os.makedirs(file_path)
         file_name = url.split("/")[-1]  # 获取文件名
         file_path = os.path.join(file_path, file_name)
-        response = requests.get(url)
+        response = http_client.get(url)
         with open(file_path, "wb") as f:
             f.write(response.content)
         return file_path
@@ -455,6 +460,7 @@ class LinkAISessionManager(SessionManager):
             logger.debug(f"[LinkAI] chat history, before tokens={total_tokens}, now tokens={tokens_cnt}")
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.save_session(session)
         return session
 
 
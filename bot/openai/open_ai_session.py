@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 from bot.session_manager import Session
 from common.log import logger
 
@@ -15,15 +17,7 @@ class OpenAISession(Session):
               A: xxx
               Q: xxx
         """
-        prompt = ""
-        for item in self.messages:
-            if item["role"] == "system":
-                prompt += item["content"] + "<|endoftext|>\n\n\n"
-            elif item["role"] == "user":
-                prompt += "Q: " + item["content"] + "\n"
-            elif item["role"] == "assistant":
-                prompt += "\n\nA: " + item["content"] + "<|endoftext|>\n"
-
+        prompt = "".join(prompt_of_message(item) for item in self.messages)
         if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
             prompt += "A: "
         return prompt
@@ -39,11 +33,11 @@ class OpenAISession(Session):
             logger.debug("Exception when counting tokens precisely for query: {}".format(e))
         while cur_tokens > max_tokens:
             if len(self.messages) > 1:
-                self.messages.pop(0)
+                popped = self.messages.pop(0)
             elif len(self.messages) == 1 and self.messages[0]["role"] == "assistant":
-                self.messages.pop(0)
+                popped = self.messages.pop(0)
                 if precise:
-                    cur_tokens = self.calc_tokens()
+                    cur_tokens -= self.message_tokens(popped)
                 else:
                     cur_tokens = len(str(self))
                 break
@@ -54,20 +48,41 @@ class OpenAISession(Session):
                 logger.debug("max_tokens={}, total_tokens={}, len(conversation)={}".format(max_tokens, cur_tokens, len(self.messages)))
                 break
             if precise:
-                cur_tokens = self.calc_tokens()
+                cur_tokens -= self.message_tokens(popped)
             else:
                 cur_tokens = len(str(self))
         return cur_tokens
 
     def calc_tokens(self):
-        return num_tokens_from_string(str(self), self.model)
+        # 按消息分段编码并缓存，与整体编码str(self)相比只在分段边界处有细微差别
+        tokens = super().calc_tokens()
+        if len(self.messages) > 0 and self.messages[-1]["role"] == "user":
+            tokens += num_tokens_from_string("A: ", self.model)
+        return tokens
+
+    def num_message_tokens(self, message):
+        return num_tokens_from_string(prompt_of_message(message), self.model)
+
+
+def prompt_of_message(item):
+    if item["role"] == "system":
+        return item["content"] + "<|endoftext|>\n\n\n"
+    elif item["role"] == "user":
+        return "Q: " + item["content"] + "\n"
+    elif item["role"] == "assistant":
+        return "\n\nA: " + item["content"] + "<|endoftext|>\n"
+    return ""
 
 
 # refer to https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
 def num_tokens_from_string(string: str, model: str) -> int:
     """Returns the number of tokens in a text string."""
+    num_tokens = len(get_encoding(model).encode(string, disallowed_special=()))
+    return num_tokens
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
     import tiktoken
 
-    encoding = tiktoken.encoding_for_model(model)
-    num_tokens = len(encoding.encode(string, disallowed_special=()))
-    return num_tokens
+    return tiktoken.encoding_for_model(model)
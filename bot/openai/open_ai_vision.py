@@ -1,9 +1,9 @@
 import base64
 
-import requests
 
 from common.log import logger
 from common import const, utils, memory
+from common import http_client
 from config import conf
 
 # OPENAI提供的图像识别接口
@@ -38,8 +38,8 @@ class OpenAIVision(object):
         headers = {"Authorization": "Bearer " + conf().get("open_ai_api_key", "")}
         # do http request
         base_url = conf().get("open_ai_api_base", "https://api.openai.com/v1")
-        res = requests.post(url=base_url + "/chat/completions", json=payload, headers=headers,
-                            timeout=conf().get("request_timeout", 180))
+        res = http_client.post(url=base_url + "/chat/completions", json=payload, headers=headers,
+                               timeout=conf().get("request_timeout", 180))
         if res.status_code == 200:
             return res.json(), None
         else:
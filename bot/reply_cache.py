@@ -0,0 +1,355 @@
+"""
+LLM回复缓存
+群里反复出现的常见问题不必每次都请求模型：对无上下文的提问(默认只有会话的第一轮)，
+以 规范化后的问题 + 人设(system_prompt) + 模型 + bot类型 为key缓存回复，
+支持TTL和LRU容量上限，可选用SimHash匹配近似问题，按群开启，后端为内存或SQLite
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from bot.session_manager import SessionManager
+from bridge.context import ContextType
+from bridge.reply import Reply, ReplyType, StreamReply
+from common import memory
+from common.expired_dict import ExpiredDict
+from common.log import logger
+from config import conf, get_appdata_dir
+
+SIMHASH_BITS = 64
+SIMHASH_BANDS = 8  # 分为8段，汉明距离不超过7时至少有一段完全相同，只需比较这些候选
+SIMHASH_MIN_LENGTH = 6  # 过短的问题SimHash不可靠，只做精确匹配
+_PUNCTUATION = " \t\r\n.,!?;:~，。！？；：～、…\"'“”‘’"
+
+
+def normalize_query(query: str) -> str:
+    query = unicodedata.normalize("NFKC", query).lower()
+    query = re.sub(r"\s+", " ", query)
+    return query.strip(_PUNCTUATION)
+
+
+def simhash(text: str) -> int:
+    """以单个字符和相邻两个字符为特征计算64位SimHash"""
+    text = text.replace(" ", "")
+    features = list(text) + [text[i:i + 2] for i in range(len(text) - 1)]
+    weights = [0] * SIMHASH_BITS
+    for feature in features:
+        h = int.from_bytes(hashlib.md5(feature.encode("utf-8")).digest()[:8], "big")
+        for bit in range(SIMHASH_BITS):
+            weights[bit] += 1 if h >> bit & 1 else -1
+    value = 0
+    for bit in range(SIMHASH_BITS):
+        if weights[bit] > 0:
+            value |= 1 << bit
+    return value
+
+
+def simhash_bands(value: int):
+    width = SIMHASH_BITS // SIMHASH_BANDS
+    mask = (1 << width) - 1
+    return [value >> (i * width) & mask for i in range(SIMHASH_BANDS)]
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class CacheKey(object):
+    def __init__(self, scope, query):
+        self.scope = scope  # 人设、模型、bot类型的摘要，近似匹配只在同一scope内进行
+        self.query = query
+        self.key = hashlib.sha1((scope + "\x00" + query).encode("utf-8")).hexdigest()
+        self.simhash = simhash(query) if len(query) >= SIMHASH_MIN_LENGTH else None
+
+
+class MemoryReplyCacheBackend(object):
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.entries = ExpiredDict(ttl, max_size=max_size)  # key -> (scope, simhash, content, 写入时间)
+        self.bands = {}  # (scope, 段序号, 段值) -> {key}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry[3] > self.ttl:  # 按写入时间过期，读取不会延长有效期
+            self.entries.pop(key, None)
+            return None
+        return entry[2]
+
+    def find_similar(self, scope, value, max_distance):
+        with self.lock:
+            for i, band in enumerate(simhash_bands(value)):
+                keys = self.bands.get((scope, i, band))
+                if not keys:
+                    continue
+                for key in list(keys):
+                    entry = self.entries.get(key)
+                    if entry is None:  # 已被淘汰
+                        keys.discard(key)
+                        continue
+                    if entry[1] is not None and hamming_distance(entry[1], value) <= max_distance:
+                        content = self.get(key)
+                        if content is not None:
+                            return content
+        return None
+
+    def set(self, cache_key: CacheKey, content):
+        self.entries[cache_key.key] = (cache_key.scope, cache_key.simhash, content, time.time())
+        if cache_key.simhash is None:
+            return
+        with self.lock:
+            for i, band in enumerate(simhash_bands(cache_key.simhash)):
+                self.bands.setdefault((cache_key.scope, i, band), set()).add(cache_key.key)
+            if len(self.bands) > 4 * SIMHASH_BANDS * max(len(self.entries), 1):
+                self._rebuild_bands()
+
+    # 需在持有self.lock时调用
+    def _rebuild_bands(self):
+        bands = {}
+        for key, (scope, value, _, _) in self.entries.items():
+            if value is not None:
+                for i, band in enumerate(simhash_bands(value)):
+                    bands.setdefault((scope, i, band), set()).add(key)
+        self.bands = bands
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bands = {}
+
+    def size(self):
+        return len(self.entries)
+
+
+class SqliteReplyCacheBackend(object):
+    """
+    SQLite存储，重启后缓存仍然有效；超出容量时按最近访问时间淘汰
+    """
+
+    def __init__(self, path, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS reply_cache (key TEXT PRIMARY KEY, scope TEXT, simhash INTEGER, {}, "
+            "content TEXT, created_at REAL, accessed_at REAL)".format(
+                ", ".join("b{} INTEGER".format(i) for i in range(SIMHASH_BANDS)))
+        )
+        for i in range(SIMHASH_BANDS):
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reply_cache_b{0} ON reply_cache (scope, b{0})".format(i))
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_reply_cache_accessed ON reply_cache (accessed_at)")
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT content, created_at FROM reply_cache WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            if time.time() - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM reply_cache WHERE key=?", (key,))
+                return None
+            self.conn.execute("UPDATE reply_cache SET accessed_at=? WHERE key=?", (time.time(), key))
+            return row[0]
+
+    def find_similar(self, scope, value, max_distance):
+        bands = simhash_bands(value)
+        where = " OR ".join("b{}=?".format(i) for i in range(SIMHASH_BANDS))
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT key, simhash FROM reply_cache WHERE scope=? AND ({}) AND created_at>=?".format(where),
+                [scope] + bands + [time.time() - self.ttl],
+            ).fetchall()
+        for key, other in rows:
+            if other is not None and hamming_distance(other & ((1 << SIMHASH_BITS) - 1), value) <= max_distance:
+                content = self.get(key)
+                if content is not None:
+                    return content
+        return None
+
+    def set(self, cache_key: CacheKey, content):
+        value = cache_key.simhash
+        bands = simhash_bands(value) if value is not None else [None] * SIMHASH_BANDS
+        # SQLite整数是有符号64位，超出部分转为负数保存
+        signed = value - (1 << SIMHASH_BITS) if value is not None and value >> (SIMHASH_BITS - 1) else value
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO reply_cache VALUES ({})".format(", ".join(["?"] * (SIMHASH_BANDS + 6))),
+                [cache_key.key, cache_key.scope, signed] + bands + [content, now, now],
+            )
+            self.writes += 1
+            if self.writes % 100 == 0:
+                self._evict(now)
+
+    # 需在持有self.lock时调用
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM reply_cache WHERE created_at<?", (now - self.ttl,))
+        if self.max_size:
+            count = self.conn.execute("SELECT COUNT(*) FROM reply_cache").fetchone()[0]
+            if count > self.max_size:
+                self.conn.execute(
+                    "DELETE FROM reply_cache WHERE key IN (SELECT key FROM reply_cache ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_size,),
+                )
+
+    def clear(self):
+        with self.lock:
+            self.conn.execute("DELETE FROM reply_cache")
+
+    def size(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM reply_cache").fetchone()[0]
+
+
+class ReplyCache(object):
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def make_key(self, bot, bot_type, query, context):
+        """
+        返回CacheKey，本次提问不适合使用缓存时返回None
+        """
+        if context.type != ContextType.TEXT or not query or query.startswith("#"):
+            return None
+        if not self._enabled_for(context):
+            return None
+        session_id = context.get("session_id")
+        if memory.USER_IMAGE_CACHE.get(session_id):  # 带图片的提问依赖会话状态
+            return None
+        system_prompt = conf().get("character_desc", "")
+        sessions = getattr(bot, "sessions", None)
+        if isinstance(sessions, SessionManager) and session_id is not None:
+            session = sessions.build_session(session_id)
+            system_prompt = session.system_prompt
+            if conf().get("reply_cache_scope", "first_turn") == "first_turn" and _has_user_message(session):
+                return None
+        elif conf().get("reply_cache_scope", "first_turn") == "first_turn":
+            # 无法判断是否为会话的第一轮，只在scope为always时缓存
+            return None
+        query = normalize_query(query)
+        if not query:
+            return None
+        model = context.get("gpt_model") or conf().get("model") or ""
+        scope = hashlib.sha1("\x00".join([str(bot_type), model, system_prompt or ""]).encode("utf-8")).hexdigest()
+        return CacheKey(scope, query)
+
+    def get(self, cache_key: CacheKey):
+        content = self.backend.get(cache_key.key)
+        if content is None and cache_key.simhash is not None:
+            max_distance = min(conf().get("reply_cache_simhash_distance", 0), SIMHASH_BANDS - 1)
+            if max_distance:
+                content = self.backend.find_similar(cache_key.scope, cache_key.simhash, max_distance)
+                if content is not None:
+                    self.near_hits += 1
+        if content is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Reply(ReplyType.TEXT, content)
+
+    def put(self, cache_key: CacheKey, reply: Reply):
+        """
+        缓存文本回复；流式回复在全部生成完成后缓存，返回需交给通道的回复
+        只缓存成功的回答：ERROR等非文本回复、被bot标记为failed的回复和中途出错的流式回复都不缓存
+        """
+        if reply is None or reply.type != ReplyType.TEXT or reply.failed:
+            return reply
+        if isinstance(reply, StreamReply):
+            reply.stream = self._store_after_stream(cache_key, reply, reply.stream)
+            return reply
+        if reply.content:
+            self._store(cache_key, reply.content)
+        return reply
+
+    def remember(self, bot, query, context, reply: Reply):
+        """命中缓存时仍把这一轮问答写入会话，后续追问能带上上下文"""
+        sessions = getattr(bot, "sessions", None)
+        session_id = context.get("session_id")
+        if isinstance(sessions, SessionManager) and session_id is not None:
+            sessions.session_query(query, session_id)
+            sessions.session_reply(reply.content, session_id)
+
+    def _store_after_stream(self, cache_key, reply, stream):
+        yield from stream  # 流中途抛出异常时不会执行到下面的缓存
+        if reply.content and not reply.failed:
+            self._store(cache_key, reply.content)
+
+    def _store(self, cache_key, content):
+        try:
+            self.backend.set(cache_key, content)
+            self.stores += 1
+        except Exception as e:
+            logger.warning("[ReplyCache] store reply failed: {}".format(e))
+
+    def _enabled_for(self, context):
+        if context.get("isgroup", False):
+            groups = conf().get("reply_cache_groups", [])
+            msg = context.get("msg")
+            group_name = msg.other_user_nickname if msg else None
+            return "ALL_GROUP" in groups or group_name in groups
+        return conf().get("reply_cache_single_chat", False)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": self.backend.size(),
+        }
+
+    def reset_stats(self):
+        self.hits = self.near_hits = self.misses = self.stores = 0
+
+    def clear(self):
+        self.backend.clear()
+
+
+def _has_user_message(session):
+    return any(isinstance(message, dict) and message.get("role") == "user" for message in session.messages)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def create_reply_cache() -> ReplyCache:
+    ttl = conf().get("reply_cache_ttl", 86400)
+    max_size = conf().get("reply_cache_max_size", 10000)
+    if conf().get("reply_cache_backend", "memory") == "sqlite":
+        path = conf().get("reply_cache_path") or os.path.join(get_appdata_dir(), "reply_cache.db")
+        logger.info("[ReplyCache] use sqlite reply cache: {}".format(path))
+        return ReplyCache(SqliteReplyCacheBackend(path, ttl, max_size))
+    return ReplyCache(MemoryReplyCacheBackend(ttl, max_size))
+
+
+def get_reply_cache():
+    """未开启reply_cache时返回None"""
+    global _cache
+    if not conf().get("reply_cache", False):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = create_reply_cache()
+                except Exception as e:
+                    logger.exception("[ReplyCache] init reply cache failed, fallback to memory: {}".format(e))
+                    _cache = ReplyCache(MemoryReplyCacheBackend(conf().get("reply_cache_ttl", 86400),
+                                                                conf().get("reply_cache_max_size", 10000)))
+    return _cache
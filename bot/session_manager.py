@@ -1,4 +1,6 @@
+from bot.session_store import get_session_store
 from common.expired_dict import ExpiredDict
+from common import metrics
 from common.log import logger
 from config import conf
 
@@ -7,6 +9,8 @@ class Session(object):
     def __init__(self, session_id, system_prompt=None):
         self.session_id = session_id
         self.messages = []
+        self.token_cache = {}  # id(message) -> (message, tokens)，缓存每条消息的token数，避免每次裁剪都重新编码整个会话
+        self.persisted = None  # 已写入SessionStore的状态，由SessionManager维护
         if system_prompt is None:
             self.system_prompt = conf().get("character_desc", "")
         else:
@@ -33,13 +37,35 @@ class Session(object):
         raise NotImplementedError
 
     def calc_tokens(self):
+        tokens = sum(self.message_tokens(message) for message in self.messages)
+        if len(self.token_cache) > 2 * len(self.messages) + 16:  # 清理已被丢弃消息的缓存
+            self.token_cache = {id(message): self.token_cache[id(message)] for message in self.messages}
+        return tokens
+
+    def message_tokens(self, message):
+        """
+        单条消息的token数，首次计算后缓存
+        """
+        cached = self.token_cache.get(id(message))
+        if cached is None or cached[0] is not message:
+            cached = (message, self.num_message_tokens(message))
+            self.token_cache[id(message)] = cached
+        return cached[1]
+
+    def num_message_tokens(self, message):
         raise NotImplementedError
 
 
 class SessionManager(object):
     def __init__(self, sessioncls, **session_args):
+        self.store = get_session_store()
+        self.namespace = sessioncls.__name__
+        # 使用持久化存储时，进程内只按LRU缓存部分活跃会话，其余会话在下次访问时从存储中加载
+        max_size = conf().get("session_cache_max_size", 1000) if self.store.persistent else None
         if conf().get("expires_in_seconds"):
-            sessions = ExpiredDict(conf().get("expires_in_seconds"))
+            sessions = ExpiredDict(conf().get("expires_in_seconds"), max_size=max_size)
+        elif max_size:
+            sessions = ExpiredDict(365 * 24 * 3600, max_size=max_size)
         else:
             sessions = dict()
         self.sessions = sessions
@@ -55,9 +81,16 @@ class SessionManager(object):
             return self.sessioncls(session_id, system_prompt, **self.session_args)
 
         if session_id not in self.sessions:
-            self.sessions[session_id] = self.sessioncls(session_id, system_prompt, **self.session_args)
+            session = self._load_session(session_id)
+            if session is None:
+                session = self.sessioncls(session_id, system_prompt, **self.session_args)
+            elif system_prompt is not None:
+                session.set_system_prompt(system_prompt)
+            self.sessions[session_id] = session
+            self.save_session(session)
         elif system_prompt is not None:  # 如果有新的system_prompt，更新并重置session
             self.sessions[session_id].set_system_prompt(system_prompt)
+            self.save_session(self.sessions[session_id])
         session = self.sessions[session_id]
         return session
 
@@ -70,22 +103,86 @@ class SessionManager(object):
             logger.debug("prompt tokens used={}".format(total_tokens))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for prompt: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def session_reply(self, reply, session_id, total_tokens=None):
         session = self.build_session(session_id)
         session.add_reply(reply)
+        if total_tokens:
+            metrics.inc("tokens_total", total_tokens, model=getattr(session, "model", None) or self.namespace)
         try:
             max_tokens = conf().get("conversation_max_tokens", 1000)
             tokens_cnt = session.discard_exceeding(max_tokens, total_tokens)
             logger.debug("raw total_tokens={}, savesession tokens={}".format(total_tokens, tokens_cnt))
         except Exception as e:
             logger.warning("Exception when counting tokens precisely for session: {}".format(str(e)))
+        self.save_session(session)
         return session
 
     def clear_session(self, session_id):
         if session_id in self.sessions:
             del self.sessions[session_id]
+        self.store.delete(self.namespace, session_id)
 
     def clear_all_session(self):
         self.sessions.clear()
+        self.store.clear(self.namespace)
+
+    def _load_session(self, session_id):
+        if not self.store.persistent:
+            return None
+        try:
+            data = self.store.load(self.namespace, session_id)
+        except Exception as e:
+            logger.warning("[SessionManager] load session {} failed: {}".format(session_id, e))
+            return None
+        if data is None:
+            return None
+        meta, items = data
+        session = self.sessioncls(session_id, meta.get("system_prompt"), **self.session_args)
+        session.messages = [message for _, message in items]
+        session.persisted = {"system_prompt": session.system_prompt, "items": items,
+                             "next_seq": items[-1][0] + 1 if items else 0}
+        logger.debug("[SessionManager] load session {} with {} messages".format(session_id, len(items)))
+        return session
+
+    def save_session(self, session):
+        """
+        把会话的变化增量写入存储：只追加新消息、删除已被丢弃的消息，system_prompt变化时更新元数据
+        bot直接修改session.messages后也可以调用此方法同步
+        """
+        if not self.store.persistent or session.session_id is None:
+            return
+        try:
+            self._save_session(session)
+        except Exception as e:
+            logger.warning("[SessionManager] save session {} failed: {}".format(session.session_id, e))
+
+    def _save_session(self, session):
+        persisted = session.persisted
+        if persisted is None:
+            persisted = {"system_prompt": None, "items": [], "next_seq": 0}
+            session.persisted = persisted
+        if persisted["system_prompt"] != session.system_prompt:
+            self.store.save_meta(self.namespace, session.session_id, {"system_prompt": session.system_prompt})
+            persisted["system_prompt"] = session.system_prompt
+        messages = session.messages
+        current = {id(message) for message in messages}
+        kept = [(seq, message) for seq, message in persisted["items"] if id(message) in current]
+        removed = [seq for seq, message in persisted["items"] if id(message) not in current]
+        # 已持久化的消息应当是当前消息的前缀，否则说明消息被插入或重排，整体重写
+        if any(message is not messages[i] for i, (_, message) in enumerate(kept)):
+            removed += [seq for seq, _ in kept]
+            kept = []
+        next_seq = persisted["next_seq"]
+        added = []
+        for message in messages[len(kept):]:
+            added.append((next_seq, message))
+            next_seq += 1
+        if removed:
+            self.store.remove(self.namespace, session.session_id, removed)
+        if added:
+            self.store.append(self.namespace, session.session_id, added)
+        persisted["items"] = kept + added
+        persisted["next_seq"] = next_seq
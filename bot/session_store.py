@@ -0,0 +1,304 @@
+"""
+会话持久化存储
+SessionManager只在进程内缓存活跃会话，会话的元数据(system_prompt、dify的conversation_id等)和消息通过SessionStore增量持久化，
+缓存未命中时再从存储中加载，重启或重载配置后上下文不会丢失
+每条消息带有会话内递增的seq，写入时只追加新消息、删除被裁剪的消息，不会重写整个会话
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from common.log import logger
+from config import conf, get_appdata_dir
+
+
+class SessionStore(object):
+    persistent = True
+
+    def load(self, namespace, session_id):
+        """
+        返回 (meta, [(seq, message), ...])，会话不存在或已过期时返回None
+        """
+        raise NotImplementedError
+
+    def save_meta(self, namespace, session_id, meta: dict):
+        raise NotImplementedError
+
+    def append(self, namespace, session_id, items):
+        """追加消息，items为[(seq, message), ...]"""
+        raise NotImplementedError
+
+    def remove(self, namespace, session_id, seqs):
+        """删除指定seq的消息"""
+        raise NotImplementedError
+
+    def delete(self, namespace, session_id):
+        raise NotImplementedError
+
+    def clear(self, namespace):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    只保存在进程内，会话对象本身就存放在SessionManager的缓存中，无需额外写入
+    """
+
+    persistent = False
+
+    def load(self, namespace, session_id):
+        return None
+
+    def save_meta(self, namespace, session_id, meta):
+        pass
+
+    def append(self, namespace, session_id, items):
+        pass
+
+    def remove(self, namespace, session_id, seqs):
+        pass
+
+    def delete(self, namespace, session_id):
+        pass
+
+    def clear(self, namespace):
+        pass
+
+
+class SqliteSessionStore(SessionStore):
+    """
+    SQLite存储，开启WAL，写操作先进入缓冲区，由后台线程每flush_interval秒合并为一个事务提交
+    """
+
+    def __init__(self, path, expires_in_seconds=None, flush_interval=1):
+        self.path = path
+        self.expires_in_seconds = expires_in_seconds
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.pending = []  # (sql, params)
+        self.last_cleanup = 0
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (namespace TEXT, session_id TEXT, meta TEXT, updated_at REAL, "
+            "PRIMARY KEY (namespace, session_id))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages (namespace TEXT, session_id TEXT, seq INTEGER, message TEXT, "
+            "PRIMARY KEY (namespace, session_id, seq))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_updated ON sessions (updated_at)")
+        thread = threading.Thread(target=self._flush_loop, name="session_store_flush", daemon=True)
+        thread.start()
+
+    def load(self, namespace, session_id):
+        with self.lock:
+            self._flush()  # 先提交缓冲区，保证读到最新数据
+            row = self.conn.execute(
+                "SELECT meta, updated_at FROM sessions WHERE namespace=? AND session_id=?", (namespace, session_id)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._expired(row[1]):
+                self._delete(namespace, session_id)
+                return None
+            rows = self.conn.execute(
+                "SELECT seq, message FROM messages WHERE namespace=? AND session_id=? ORDER BY seq", (namespace, session_id)
+            ).fetchall()
+        return json.loads(row[0]), [(seq, json.loads(message)) for seq, message in rows]
+
+    def save_meta(self, namespace, session_id, meta):
+        self._write(
+            "INSERT OR REPLACE INTO sessions (namespace, session_id, meta, updated_at) VALUES (?, ?, ?, ?)",
+            [(namespace, session_id, json.dumps(meta, ensure_ascii=False), time.time())],
+        )
+
+    def append(self, namespace, session_id, items):
+        self._write(
+            "INSERT OR REPLACE INTO messages (namespace, session_id, seq, message) VALUES (?, ?, ?, ?)",
+            [(namespace, session_id, seq, json.dumps(message, ensure_ascii=False)) for seq, message in items],
+        )
+        self._touch(namespace, session_id)
+
+    def remove(self, namespace, session_id, seqs):
+        self._write(
+            "DELETE FROM messages WHERE namespace=? AND session_id=? AND seq=?",
+            [(namespace, session_id, seq) for seq in seqs],
+        )
+        self._touch(namespace, session_id)
+
+    def delete(self, namespace, session_id):
+        with self.lock:
+            self.pending.append(("DELETE FROM sessions WHERE namespace=? AND session_id=?", [(namespace, session_id)]))
+            self.pending.append(("DELETE FROM messages WHERE namespace=? AND session_id=?", [(namespace, session_id)]))
+
+    def clear(self, namespace):
+        with self.lock:
+            self.pending.append(("DELETE FROM sessions WHERE namespace=?", [(namespace,)]))
+            self.pending.append(("DELETE FROM messages WHERE namespace=?", [(namespace,)]))
+            self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _write(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+
+    def _touch(self, namespace, session_id):
+        self._write(
+            "UPDATE sessions SET updated_at=? WHERE namespace=? AND session_id=?", [(time.time(), namespace, session_id)]
+        )
+
+    def _expired(self, updated_at):
+        return self.expires_in_seconds and time.time() - updated_at > self.expires_in_seconds
+
+    # 需在持有self.lock时调用
+    def _delete(self, namespace, session_id):
+        self.conn.execute("DELETE FROM sessions WHERE namespace=? AND session_id=?", (namespace, session_id))
+        self.conn.execute("DELETE FROM messages WHERE namespace=? AND session_id=?", (namespace, session_id))
+
+    # 需在持有self.lock时调用
+    def _flush(self):
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            self.conn.execute("BEGIN")
+            for sql, params in pending:
+                self.conn.executemany(sql, params)
+            self.conn.execute("COMMIT")
+        except Exception as e:
+            try:
+                self.conn.execute("ROLLBACK")
+            except Exception:
+                pass
+            # 放回缓冲区等下次重试，SessionManager已认为这些写入成功，丢弃会导致存储与内存中的会话不一致
+            self.pending = pending + self.pending
+            logger.exception("[SessionStore] sqlite flush error, {} writes will be retried: {}".format(len(pending), e))
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                with self.lock:
+                    self._flush()
+                    if self.expires_in_seconds and time.time() - self.last_cleanup > 600:
+                        self._cleanup()
+            except Exception as e:
+                logger.exception("[SessionStore] sqlite flush loop error: {}".format(e))
+
+    # 需在持有self.lock时调用
+    def _cleanup(self):
+        """删除过期会话"""
+        self.last_cleanup = time.time()
+        deadline = time.time() - self.expires_in_seconds
+        self.conn.execute("BEGIN")
+        self.conn.execute(
+            "DELETE FROM messages WHERE (namespace, session_id) IN "
+            "(SELECT namespace, session_id FROM sessions WHERE updated_at < ?)", (deadline,)
+        )
+        self.conn.execute("DELETE FROM sessions WHERE updated_at < ?", (deadline,))
+        self.conn.execute("COMMIT")
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Redis存储，兼容任何实现了Redis协议的服务
+    每个会话对应两个key: {prefix}{namespace}:{session_id}:meta 保存元数据，:msgs 为 seq->消息 的hash，过期交给Redis的EXPIRE
+    """
+
+    def __init__(self, url, expires_in_seconds=None, prefix="cow:session:"):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.expires_in_seconds = int(expires_in_seconds) if expires_in_seconds else None
+        self.prefix = prefix
+
+    def _key(self, namespace, session_id):
+        return "{}{}:{}".format(self.prefix, namespace, session_id)
+
+    def load(self, namespace, session_id):
+        key = self._key(namespace, session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(key + ":meta")
+        pipe.hgetall(key + ":msgs")
+        meta, messages = pipe.execute()
+        if meta is None:
+            return None
+        items = sorted((int(seq), json.loads(message)) for seq, message in messages.items())
+        return json.loads(meta), items
+
+    def save_meta(self, namespace, session_id, meta):
+        key = self._key(namespace, session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(key + ":meta", json.dumps(meta, ensure_ascii=False), ex=self.expires_in_seconds)
+        self._expire(pipe, key)
+        pipe.execute()
+
+    def append(self, namespace, session_id, items):
+        key = self._key(namespace, session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hset(key + ":msgs", mapping={seq: json.dumps(message, ensure_ascii=False) for seq, message in items})
+        self._expire(pipe, key)
+        pipe.execute()
+
+    def remove(self, namespace, session_id, seqs):
+        key = self._key(namespace, session_id)
+        pipe = self.client.pipeline(transaction=False)
+        pipe.hdel(key + ":msgs", *seqs)
+        self._expire(pipe, key)
+        pipe.execute()
+
+    def delete(self, namespace, session_id):
+        key = self._key(namespace, session_id)
+        self.client.delete(key + ":meta", key + ":msgs")
+
+    def clear(self, namespace):
+        keys = list(self.client.scan_iter(match="{}{}:*".format(self.prefix, namespace), count=500))
+        for i in range(0, len(keys), 500):
+            self.client.delete(*keys[i:i + 500])
+
+    def _expire(self, pipe, key):
+        if self.expires_in_seconds:
+            pipe.expire(key + ":meta", self.expires_in_seconds)
+            pipe.expire(key + ":msgs", self.expires_in_seconds)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def create_session_store() -> SessionStore:
+    store_type = conf().get("session_store", "memory")
+    expires_in_seconds = conf().get("expires_in_seconds")
+    if store_type == "sqlite":
+        path = conf().get("session_store_path") or os.path.join(get_appdata_dir(), "sessions.db")
+        logger.info("[SessionStore] use sqlite session store: {}".format(path))
+        return SqliteSessionStore(path, expires_in_seconds, conf().get("session_store_flush_interval", 1))
+    if store_type == "redis":
+        url = conf().get("session_store_redis_url", "redis://localhost:6379/0")
+        logger.info("[SessionStore] use redis session store: {}".format(url))
+        return RedisSessionStore(url, expires_in_seconds)
+    return MemorySessionStore()
+
+
+def get_session_store() -> SessionStore:
+    """所有SessionManager共享同一个存储，不同的会话类型用namespace区分"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = create_session_store()
+                except Exception as e:
+                    logger.exception("[SessionStore] init session store failed, fallback to memory: {}".format(e))
+                    _store = MemorySessionStore()
+    return _store
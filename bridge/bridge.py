@@ -1,12 +1,15 @@
 from bot.bot_factory import create_bot
+from bot.reply_cache import get_reply_cache
 from bridge.context import Context
-from bridge.reply import Reply
+from bridge.reply import Reply, ReplyType
 from common import const
+from common import event_loop, metrics, tracing
 from common.log import logger
 from common.singleton import singleton
 from config import conf
 from translate.factory import create_translator
 from voice.factory import create_voice
+from voice.tts_cache import get_tts_cache
 
 
 @singleton
@@ -85,13 +88,78 @@ class Bridge(object):
         return self.btype[typename]
 
     def fetch_reply_content(self, query, context: Context) -> Reply:
-        return self.get_bot("chat").reply(query, context)
+        bot = self.get_bot("chat")
+        cache = get_reply_cache()
+        cache_key = cache.make_key(bot, self.btype["chat"], query, context) if cache else None
+        if cache_key:
+            reply = cache.get(cache_key)
+            if reply:
+                logger.info("[Bridge] reply cache hit, query={}".format(query))
+                cache.remember(bot, query, context, reply)
+                return reply
+        with metrics.timer("bot_seconds", kind="chat", bot=self.btype["chat"]), tracing.span("bot.chat", bot=self.btype["chat"]):
+            reply = bot.reply(query, context)
+        self._count_error(reply, "chat")
+        if cache_key:
+            reply = cache.put(cache_key, reply)
+        return reply
 
     def fetch_voice_to_text(self, voiceFile) -> Reply:
-        return self.get_bot("voice_to_text").voiceToText(voiceFile)
+        with metrics.timer("bot_seconds", kind="voice_to_text", bot=self.btype["voice_to_text"]), \
+                tracing.span("bot.voice_to_text", bot=self.btype["voice_to_text"]):
+            reply = self.get_bot("voice_to_text").voiceToText(voiceFile)
+        return self._count_error(reply, "voice_to_text")
 
     def fetch_text_to_voice(self, text) -> Reply:
-        return self.get_bot("text_to_voice").textToVoice(text)
+        voice = self.get_bot("text_to_voice")
+        cache = get_tts_cache()
+        with metrics.timer("bot_seconds", kind="text_to_voice", bot=self.btype["text_to_voice"]), \
+                tracing.span("bot.text_to_voice", bot=self.btype["text_to_voice"]):
+            if cache:
+                reply = cache.synthesize(voice, self.btype["text_to_voice"], text)
+            else:
+                reply = voice.textToVoice(text)
+        return self._count_error(reply, "text_to_voice")
+
+    async def fetch_reply_content_async(self, query, context: Context) -> Reply:
+        bot = self.get_bot("chat")
+        cache = get_reply_cache()
+        # 缓存查询可能读写会话存储和SQLite，放到线程池中执行
+        cache_key = await event_loop.run_sync(cache.make_key, bot, self.btype["chat"], query, context) if cache else None
+        if cache_key:
+            reply = await event_loop.run_sync(cache.get, cache_key)
+            if reply:
+                logger.info("[Bridge] reply cache hit, query={}".format(query))
+                await event_loop.run_sync(cache.remember, bot, query, context, reply)
+                return reply
+        with metrics.timer("bot_seconds", kind="chat", bot=self.btype["chat"]), tracing.span("bot.chat", bot=self.btype["chat"]):
+            reply = await bot.reply_async(query, context)
+        self._count_error(reply, "chat")
+        if cache_key:
+            reply = await event_loop.run_sync(cache.put, cache_key, reply)
+        return reply
+
+    async def fetch_voice_to_text_async(self, voiceFile) -> Reply:
+        with metrics.timer("bot_seconds", kind="voice_to_text", bot=self.btype["voice_to_text"]), \
+                tracing.span("bot.voice_to_text", bot=self.btype["voice_to_text"]):
+            reply = await self.get_bot("voice_to_text").voiceToText_async(voiceFile)
+        return self._count_error(reply, "voice_to_text")
+
+    async def fetch_text_to_voice_async(self, text) -> Reply:
+        voice = self.get_bot("text_to_voice")
+        cache = get_tts_cache()
+        with metrics.timer("bot_seconds", kind="text_to_voice", bot=self.btype["text_to_voice"]), \
+                tracing.span("bot.text_to_voice", bot=self.btype["text_to_voice"]):
+            if cache:
+                reply = await cache.synthesize_async(voice, self.btype["text_to_voice"], text)
+            else:
+                reply = await voice.textToVoice_async(text)
+        return self._count_error(reply, "text_to_voice")
+
+    def _count_error(self, reply, kind):
+        if reply is not None and reply.type == ReplyType.ERROR:
+            metrics.inc("errors_total", stage=kind, bot=self.btype[kind])
+        return reply
 
     def fetch_translate(self, text, from_lang="", to_lang="en") -> Reply:
         return self.get_bot("translate").translate(text, from_lang, to_lang)
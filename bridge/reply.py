@@ -24,9 +24,51 @@ class ReplyType(Enum):
 
 
 class Reply:
-    def __init__(self, type: ReplyType = None, content=None):
+    """
+    failed: 回复内容是限流、请求失败等提示而非bot的回答，这样的回复照常发送，但不会被缓存
+    """
+
+    def __init__(self, type: ReplyType = None, content=None, failed=False):
         self.type = type
         self.content = content
+        self.failed = failed
 
     def __str__(self):
         return "Reply(type={}, content={})".format(self.type, self.content)
+
+
+class StreamReply(Reply):
+    """
+    流式回复，bot返回一个逐段产出文本增量的迭代器
+    通道迭代StreamReply边生成边发送，content随之累积，迭代结束后即为完整文本
+    bot在流中产出的是错误提示(限流、请求失败后的回退)而非模型的回答时，在流结束前置failed为True
+    """
+
+    def __init__(self, stream, type: ReplyType = ReplyType.TEXT):
+        super().__init__(type, "")
+        self.stream = stream
+        self.finished = False
+
+    def __iter__(self):
+        if self.finished:
+            return
+        try:
+            for delta in self.stream:
+                if delta:
+                    self.content += delta
+                    yield delta
+        finally:
+            self.finished = True
+            # 调用方提前停止迭代时立即关闭底层生成器，释放其持有的http连接
+            close = getattr(self.stream, "close", None)
+            if close:
+                close()
+
+    def read_all(self) -> str:
+        """消费剩余的增量，返回完整文本"""
+        for _ in self:
+            pass
+        return self.content
+
+    def __str__(self):
+        return "StreamReply(type={}, finished={}, content={})".format(self.type, self.finished, self.content)
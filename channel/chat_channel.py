@@ -1,24 +1,29 @@
+import io
 import os
 import re
 import threading
 import time
 from asyncio import CancelledError
-from concurrent.futures import Future, ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import Future
 
+from bridge.bridge import Bridge
 from bridge.context import *
 from bridge.reply import *
 from channel.channel import Channel
+from channel.trigger_matcher import get_trigger_matcher
 from common.dequeue import Dequeue
-from common import memory
+from common import event_loop, memory, metrics, tracing
+from common.handler_pool import handler_pools
+from common.tmp_dir import is_tmp_path, keep_tmp, tmp_scope, track_tmp
+from config import snapshot
 from plugins import *
 
 try:
-    from voice.audio_convert import any_to_wav
+    from voice.audio_convert import any_to_wav_bytes, audio_format, convert_in_pool
 except Exception as e:
     pass
 
-handler_pool = ThreadPoolExecutor(max_workers=8)  # 处理消息的线程池
-
 
 # 抽象类, 它包含了与消息通道无关的通用处理逻辑
 class ChatChannel(Channel):
@@ -26,17 +31,34 @@ class ChatChannel(Channel):
     user_id = None  # 登录的用户id
     futures = {}  # 记录每个session_id提交到线程池的future对象, 用于重置会话时把没执行的future取消掉，正在执行的不会被取消
     sessions = {}  # 用于控制并发，每个session_id同时只能有一个context在处理
-    lock = threading.Lock()  # 用于控制对sessions的访问
+    lock = threading.RLock()  # 用于控制对sessions的访问，future.cancel()会在持锁线程内同步触发回调，因此需要可重入
+    ready_cond = threading.Condition(lock)  # 有session就绪时唤醒消费者线程
+    ready_sessions = deque()  # 待调度的session_id，由produce和线程回调放入
+    ready_set = set()  # 与ready_sessions同步，避免同一session重复入队
+    STREAM_MODE = None  # 流式回复的发送方式，None为不支持，"sentence"为按句发送，"card"为持续更新同一张卡片
+    STREAM_SENTENCE_END = re.compile(r"[。！？!?；;\n]")
 
     def __init__(self):
         _thread = threading.Thread(target=self.consume)
         _thread.setDaemon(True)
         _thread.start()
 
+    @staticmethod
+    def _config(context: Context):
+        """本条消息的配置快照，在构造context时获取；未经_compose_context构造的context使用当前配置的快照"""
+        config = context.get("config")
+        return config if config is not None else snapshot()
+
     # 根据消息构造context，消息内容相关的触发项写在这里
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
+        if "timeline" not in context:
+            metrics.stage(context, "compose", "receive", channel=self.channel_type)
+        tracing.start_trace(context, channel=self.channel_type)
+        if "config" not in context:
+            # 同一条消息的后续处理都使用此时的配置快照，语音转文字后重新构造的context沿用同一份
+            context["config"] = snapshot()
         if ctype == ContextType.ACCEPT_FRIEND:
             return context
         # context首次传入时，origin_ctype是None,
@@ -47,8 +69,8 @@ class ChatChannel(Channel):
         # context首次传入时，receiver是None，根据类型设置receiver
         first_in = "receiver" not in context
         # 群名匹配过程，设置session_id和receiver
+        matcher = get_trigger_matcher(context["config"])
         if first_in:  # context首次传入时，receiver是None，根据类型设置receiver
-            config = conf()
             cmsg = context["msg"]
             user_data = conf().get_user_data(cmsg.from_user_id)
             context["openai_api_key"] = user_data.get("openai_api_key")
@@ -57,38 +79,25 @@ class ChatChannel(Channel):
                 group_name = cmsg.other_user_nickname
                 group_id = cmsg.other_user_id
 
-                group_name_white_list = config.get("group_name_white_list", [])
-                group_name_keyword_white_list = config.get("group_name_keyword_white_list", [])
-                if any(
-                        [
-                            group_name in group_name_white_list,
-                            "ALL_GROUP" in group_name_white_list,
-                            check_contain(group_name, group_name_keyword_white_list),
-                        ]
-                ):
-                    group_chat_in_one_session = conf().get("group_chat_in_one_session", [])
+                if matcher.is_group_allowed(group_name):
                     session_id = cmsg.actual_user_id
-                    if any(
-                            [
-                                group_name in group_chat_in_one_session,
-                                "ALL_GROUP" in group_chat_in_one_session,
-                            ]
-                    ):
+                    if matcher.is_group_in_one_session(group_name):
                         session_id = group_id
                 else:
-                    logger.debug(f"No need reply, groupName not in whitelist, group_name={group_name}")
+                    logger.debug("No need reply, groupName not in whitelist, group_name=%s", group_name)
                     return None
                 context["session_id"] = session_id
                 context["receiver"] = group_id
             else:
                 context["session_id"] = cmsg.other_user_id
                 context["receiver"] = cmsg.other_user_id
-            e_context = PluginManager().emit_event(
-                EventContext(Event.ON_RECEIVE_MESSAGE, {"channel": self, "context": context}))
+            with tracing.use(context):
+                e_context = PluginManager().emit_event(
+                    EventContext(Event.ON_RECEIVE_MESSAGE, {"channel": self, "context": context}))
             context = e_context["context"]
             if e_context.is_pass() or context is None:
                 return context
-            if cmsg.from_user_id == self.user_id and not config.get("trigger_by_self", True):
+            if cmsg.from_user_id == self.user_id and not matcher.trigger_by_self:
                 logger.debug("[chat_channel]self message skipped")
                 return None
 
@@ -99,11 +108,10 @@ class ChatChannel(Channel):
                 logger.debug("[chat_channel]reference query skipped")
                 return None
 
-            nick_name_black_list = conf().get("nick_name_black_list", [])
             if context.get("isgroup", False):  # 群聊
                 # 校验关键字
-                match_prefix = check_prefix(content, conf().get("group_chat_prefix"))
-                match_contain = check_contain(content, conf().get("group_chat_keyword"))
+                match_prefix = matcher.match_prefix(matcher.group_chat_prefix, content)
+                match_contain = matcher.match_contain(matcher.group_chat_keyword, content)
                 flag = False
                 if context["msg"].to_user_id != context["msg"].actual_user_id:
                     if match_prefix is not None or match_contain is not None:
@@ -112,25 +120,22 @@ class ChatChannel(Channel):
                             content = content.replace(match_prefix, "", 1).strip()
                     if context["msg"].is_at:
                         nick_name = context["msg"].actual_user_nickname
-                        if nick_name and nick_name in nick_name_black_list:
+                        if matcher.is_blacklisted(nick_name):
                             # 黑名单过滤
                             logger.warning(f"[chat_channel] Nickname {nick_name} in In BlackList, ignore")
                             return None
 
                         logger.info("[chat_channel]receive group at")
-                        if not conf().get("group_at_off", False):
+                        if not matcher.group_at_off:
                             flag = True
                         self.name = self.name if self.name is not None else ""  # 部分渠道self.name可能没有赋值
-                        pattern = f"@{re.escape(self.name)}(\u2005|\u0020)"
-                        subtract_res = re.sub(pattern, r"", content)
+                        names = [self.name]
                         if isinstance(context["msg"].at_list, list):
-                            for at in context["msg"].at_list:
-                                pattern = f"@{re.escape(at)}(\u2005|\u0020)"
-                                subtract_res = re.sub(pattern, r"", subtract_res)
+                            names.extend(context["msg"].at_list)
+                        subtract_res = matcher.strip_mentions(content, names)
                         if subtract_res == content and context["msg"].self_display_name:
                             # 前缀移除后没有变化，使用群昵称再次移除
-                            pattern = f"@{re.escape(context['msg'].self_display_name)}(\u2005|\u0020)"
-                            subtract_res = re.sub(pattern, r"", content)
+                            subtract_res = matcher.strip_mentions(content, [context["msg"].self_display_name])
                         content = subtract_res
                 if not flag:
                     if context["origin_ctype"] == ContextType.VOICE:
@@ -138,12 +143,12 @@ class ChatChannel(Channel):
                     return None
             else:  # 单聊
                 nick_name = context["msg"].from_user_nickname
-                if nick_name and nick_name in nick_name_black_list:
+                if matcher.is_blacklisted(nick_name):
                     # 黑名单过滤
                     logger.warning(f"[chat_channel] Nickname '{nick_name}' in In BlackList, ignore")
                     return None
 
-                match_prefix = check_prefix(content, conf().get("single_chat_prefix", [""]))
+                match_prefix = matcher.match_prefix(matcher.single_chat_prefix, content)
                 if match_prefix is not None:  # 判断如果匹配到自定义前缀，则返回过滤掉前缀+空格后的内容
                     content = content.replace(match_prefix, "", 1).strip()
                 elif context["origin_ctype"] == ContextType.VOICE:  # 如果源消息是私聊的语音消息，允许不匹配前缀，放宽条件
@@ -151,37 +156,56 @@ class ChatChannel(Channel):
                 else:
                     return None
             content = content.strip()
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix",[""]))
+            img_match_prefix = matcher.match_prefix(matcher.image_create_prefix, content)
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
             else:
                 context.type = ContextType.TEXT
             context.content = content.strip()
-            if "desire_rtype" not in context and conf().get(
-                    "always_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.always_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
         elif context.type == ContextType.VOICE:
-            if "desire_rtype" not in context and conf().get(
-                    "voice_reply_voice") and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
+            if "desire_rtype" not in context and matcher.voice_reply_voice and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                 context["desire_rtype"] = ReplyType.VOICE
+        if context.type == ContextType.TEXT and self.STREAM_MODE and matcher.stream_reply:
+            context["stream"] = context.get("desire_rtype") != ReplyType.VOICE
         return context
 
     def _handle(self, context: Context):
         if context is None or not context.content:
             return
+        metrics.stage(context, "handle", "pool", channel=self.channel_type)
+        with tracing.use(context, end=True), tmp_scope():
+            self._track_context_file(context)
+            self._handle_in_scope(context)
+        metrics.finish(context, channel=self.channel_type)
+
+    def _track_context_file(self, context: Context):
+        """语音、文件、视频消息下载的文件在消息处理完后删除，图片会被下一轮提问使用，交给后台清理"""
+        if context.type in (ContextType.VOICE, ContextType.FILE, ContextType.VIDEO) and is_tmp_path(context.content):
+            track_tmp(context.content)
+
+    def _handle_in_scope(self, context: Context):
         logger.debug("[chat_channel] ready to handle context: {}".format(context))
         # reply的构建步骤
-        reply = self._generate_reply(context)
+        with metrics.timer("stage_seconds", stage="generate", channel=self.channel_type):
+            reply = self._generate_reply(context)
+
+        if isinstance(reply, StreamReply):
+            with metrics.timer("stage_seconds", stage="send", channel=self.channel_type):
+                reply = self._send_stream_reply(context, reply)
 
         logger.debug("[chat_channel] ready to decorate reply: {}".format(reply))
 
         # reply的包装步骤
         if reply and reply.content:
-            reply = self._decorate_reply(context, reply)
+            with metrics.timer("stage_seconds", stage="decorate", channel=self.channel_type):
+                reply = self._decorate_reply(context, reply)
 
             # reply的发送步骤
-            self._send_reply(context, reply)
+            with metrics.timer("stage_seconds", stage="send", channel=self.channel_type):
+                self._send_reply(context, reply)
 
     def _generate_reply(self, context: Context, reply: Reply = Reply()) -> Reply:
         e_context = PluginManager().emit_event(
@@ -197,25 +221,10 @@ class ChatChannel(Channel):
                 context["channel"] = e_context["channel"]
                 reply = super().build_reply_content(context.content, context)
             elif context.type == ContextType.VOICE:  # 语音消息
-                cmsg = context["msg"]
-                cmsg.prepare()
-                file_path = context.content
-                wav_path = os.path.splitext(file_path)[0] + ".wav"
-                try:
-                    any_to_wav(file_path, wav_path)
-                except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
-                    logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
-                    wav_path = file_path
+                file_path, voice = self._prepare_voice(context)
                 # 语音识别
-                reply = super().build_voice_to_text(wav_path)
-                # 删除临时文件
-                try:
-                    os.remove(file_path)
-                    if wav_path != file_path:
-                        os.remove(wav_path)
-                except Exception as e:
-                    pass
-                    # logger.warning("[chat_channel]delete temp file error: " + str(e))
+                reply = super().build_voice_to_text(voice)
+                self._remove_voice_files(file_path, voice)
 
                 if reply.type == ReplyType.TEXT:
                     new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
@@ -223,22 +232,107 @@ class ChatChannel(Channel):
                         reply = self._generate_reply(new_context)
                     else:
                         return
-            elif context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
-                memory.USER_IMAGE_CACHE[context["session_id"]] = {
-                    "path": context.content,
-                    "msg": context.get("msg")
-                }
-            elif context.type == ContextType.ACCEPT_FRIEND:  # 好友申请，匹配字符串
-                reply = self._build_friend_request_reply(context)
-            elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
-                pass
-            elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
-                pass
             else:
-                logger.warning("[chat_channel] unknown context type: {}".format(context.type))
-                return
+                reply = self._generate_other_reply(context, reply)
+        return reply
+
+    def _generate_other_reply(self, context: Context, reply: Reply) -> Reply:
+        """文本和语音以外的消息"""
+        if context.type == ContextType.IMAGE:  # 图片消息，当前仅做下载保存到本地的逻辑
+            memory.USER_IMAGE_CACHE[context["session_id"]] = {
+                "path": context.content,
+                "msg": context.get("msg")
+            }
+        elif context.type == ContextType.ACCEPT_FRIEND:  # 好友申请，匹配字符串
+            reply = self._build_friend_request_reply(context)
+        elif context.type == ContextType.SHARING:  # 分享信息，当前无默认逻辑
+            pass
+        elif context.type == ContextType.FUNCTION or context.type == ContextType.FILE:  # 文件消息及函数调用等，当前无默认逻辑
+            pass
+        else:
+            logger.warning("[chat_channel] unknown context type: {}".format(context.type))
+            return
         return reply
 
+    def _prepare_voice(self, context: Context):
+        """
+        下载语音并在内存中转换为 16k 单声道wav，返回 (原文件路径, 语音)
+        语音为带name属性的BytesIO，直接交给语音识别，不再写出wav临时文件
+        """
+        cmsg = context["msg"]
+        cmsg.prepare()
+        file_path = context.content
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            with tracing.span("voice.convert", fmt="wav", size=len(data)):
+                voice = io.BytesIO(convert_in_pool(any_to_wav_bytes, data, audio_format(file_path)))
+            voice.name = os.path.splitext(os.path.basename(file_path))[0] + ".wav"
+        except Exception as e:  # 转换失败，直接使用mp3，对于某些api，mp3也可以识别
+            logger.warning("[chat_channel]any to wav error, use raw path. " + str(e))
+            voice = file_path
+        return file_path, voice
+
+    def _remove_voice_files(self, file_path, voice):
+        # 删除临时文件
+        try:
+            os.remove(file_path)
+            if isinstance(voice, str) and voice != file_path:
+                os.remove(voice)
+        except Exception as e:
+            pass
+            # logger.warning("[chat_channel]delete temp file error: " + str(e))
+
+    async def _handle_async(self, context: Context):
+        """
+        asyncio模式下的消息处理，与_handle步骤相同
+        bot和语音识别调用异步接口，插件、回复包装和发送等同步步骤在该消息所属的线程池中执行
+        """
+        if context is None or not context.content:
+            return
+        event_loop.current_executor.set(self._select_handler_pool(context))
+        logger.debug("[chat_channel] ready to handle context async: {}".format(context))
+        metrics.stage(context, "handle", "pool", channel=self.channel_type)
+        with tracing.use(context, end=True), tmp_scope():
+            self._track_context_file(context)
+            with metrics.timer("stage_seconds", stage="generate", channel=self.channel_type):
+                reply = await self._generate_reply_async(context)
+            if isinstance(reply, StreamReply):
+                with metrics.timer("stage_seconds", stage="send", channel=self.channel_type):
+                    reply = await event_loop.run_sync(self._send_stream_reply, context, reply)
+            if reply and reply.content:
+                with metrics.timer("stage_seconds", stage="decorate", channel=self.channel_type):
+                    reply = await event_loop.run_sync(self._decorate_reply, context, reply)
+                with metrics.timer("stage_seconds", stage="send", channel=self.channel_type):
+                    await event_loop.run_sync(self._send_reply, context, reply)
+        metrics.finish(context, channel=self.channel_type)
+
+    async def _generate_reply_async(self, context: Context, reply: Reply = Reply()) -> Reply:
+        e_context = await event_loop.run_sync(
+            PluginManager().emit_event,
+            EventContext(
+                Event.ON_HANDLE_CONTEXT,
+                {"channel": self, "context": context, "reply": reply},
+            ),
+        )
+        reply = e_context["reply"]
+        if e_context.is_pass():
+            return reply
+        if context.type == ContextType.TEXT or context.type == ContextType.IMAGE_CREATE:  # 文字和图片消息
+            context["channel"] = e_context["channel"]
+            return await Bridge().fetch_reply_content_async(context.content, context)
+        if context.type == ContextType.VOICE:  # 语音消息
+            file_path, voice = await event_loop.run_sync(self._prepare_voice, context)
+            reply = await Bridge().fetch_voice_to_text_async(voice)
+            self._remove_voice_files(file_path, voice)
+            if reply.type == ReplyType.TEXT:
+                new_context = self._compose_context(ContextType.TEXT, reply.content, **context.kwargs)
+                if not new_context:
+                    return
+                reply = await self._generate_reply_async(new_context)
+            return reply
+        return self._generate_other_reply(context, reply)
+
     def _decorate_reply(self, context: Context, reply: Reply) -> Reply:
         if reply and reply.type:
             e_context = PluginManager().emit_event(
@@ -260,13 +354,14 @@ class ChatChannel(Channel):
                     if desire_rtype == ReplyType.VOICE and ReplyType.VOICE not in self.NOT_SUPPORT_REPLYTYPE:
                         reply = super().build_text_to_voice(reply.content)
                         return self._decorate_reply(context, reply)
+                    config = self._config(context)
                     if context.get("isgroup", False):
                         if not context.get("no_need_at", False):
                             reply_text = "@" + context["msg"].actual_user_nickname + "\n" + reply_text.strip()
-                        reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + conf().get(
+                        reply_text = config.get("group_chat_reply_prefix", "") + reply_text + config.get(
                             "group_chat_reply_suffix", "")
                     else:
-                        reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + conf().get(
+                        reply_text = config.get("single_chat_reply_prefix", "") + reply_text + config.get(
                             "single_chat_reply_suffix", "")
                     reply.content = reply_text
                 elif reply.type == ReplyType.ERROR or reply.type == ReplyType.INFO:
@@ -295,15 +390,93 @@ class ChatChannel(Channel):
                 logger.debug("[chat_channel] ready to send reply: {}, context: {}".format(reply, context))
                 self._send(reply, context)
 
+    def _send_stream_reply(self, context: Context, reply: StreamReply):
+        """
+        边生成边发送流式回复，返回值交给后续的包装和发送步骤
+        通道不支持流式或不需要流式时，读完整个回复后按普通回复处理；
+        有插件处理ON_DECORATE_REPLY或ON_SEND_REPLY时(如敏感词过滤)同样不流式发送，
+        否则文本在插件检查之前就已发出，无法被拦截或改写
+        """
+        if not context.get("stream") or reply.type != ReplyType.TEXT or \
+                PluginManager().has_handlers(Event.ON_DECORATE_REPLY, Event.ON_SEND_REPLY):
+            return Reply(reply.type, reply.read_all())
+        try:
+            if self.STREAM_MODE == "card":
+                self._send_stream_card(context, reply)
+            else:
+                self._send_stream_sentence(context, reply)
+        except Exception as e:
+            logger.exception("[chat_channel] send stream reply error: {}".format(e))
+            if not reply.content:
+                return Reply(ReplyType.ERROR, self._config(context).get("error_reply", "我暂时遇到了一些问题，请您稍后重试~"))
+        return None
+
+    def _stream_prefix_suffix(self, context: Context):
+        config = self._config(context)
+        if context.get("isgroup", False):
+            prefix = config.get("group_chat_reply_prefix", "")
+            if not context.get("no_need_at", False):
+                prefix += "@" + context["msg"].actual_user_nickname + "\n"
+            return prefix, config.get("group_chat_reply_suffix", "")
+        return config.get("single_chat_reply_prefix", ""), config.get("single_chat_reply_suffix", "")
+
+    def _send_stream_sentence(self, context: Context, reply: StreamReply):
+        """按句发送，缓冲区累积到stream_sentence_min_chars个字符后在句末断开"""
+        prefix, suffix = self._stream_prefix_suffix(context)
+        min_chars = self._config(context).get("stream_sentence_min_chars", 50)
+        buffer = ""
+        first = True
+        for delta in reply:
+            buffer += delta
+            if len(buffer) < min_chars:
+                continue
+            match = self.STREAM_SENTENCE_END.search(buffer, min_chars - 1)
+            if match is None:
+                continue
+            text, buffer = buffer[:match.end()].strip(), buffer[match.end():]
+            if text:
+                self._send(Reply(ReplyType.TEXT, (prefix if first else "") + text), context)
+                first = False
+        text = buffer.strip()
+        if text:
+            self._send(Reply(ReplyType.TEXT, (prefix if first else "") + text + suffix), context)
+        elif suffix and not first:
+            self._send(Reply(ReplyType.TEXT, suffix), context)
+
+    def _send_stream_card(self, context: Context, reply: StreamReply):
+        """持续更新同一张卡片，两次更新至少间隔stream_card_interval秒"""
+        interval = self._config(context).get("stream_card_interval", 0.5)
+        card = None
+        last_update = 0
+        try:
+            for _ in reply:
+                if time.monotonic() - last_update >= interval:
+                    card = self.update_stream_card(context, card, reply.content, finished=False)
+                    last_update = time.monotonic()
+        finally:
+            if card is not None or reply.content:
+                self.update_stream_card(context, card, reply.content, finished=True)
+
+    def update_stream_card(self, context: Context, card, content: str, finished: bool):
+        """
+        创建或更新流式回复卡片，STREAM_MODE为"card"的通道需要实现
+        :param card: 首次调用时为None，之后为上一次调用的返回值
+        :return: 卡片标识，下次更新时传回
+        """
+        raise NotImplementedError
+
     def _send(self, reply: Reply, context: Context, retry_cnt=0):
         try:
-            self.send(reply, context)
+            with tracing.span("send", type=reply.type.name if reply.type else None, retry=retry_cnt):
+                self.send(reply, context)
         except Exception as e:
             logger.error("[chat_channel] sendMsg error: {}".format(str(e)))
             if isinstance(e, NotImplementedError):
                 return
             logger.exception(e)
+            metrics.inc("errors_total", stage="send", channel=self.channel_type)
             if retry_cnt < 2:
+                metrics.inc("retries_total", component="send", channel=self.channel_type)
                 time.sleep(3 + 3 * retry_cnt)
                 self._send(reply, context, retry_cnt + 1)
 
@@ -311,7 +484,7 @@ class ChatChannel(Channel):
     def _build_friend_request_reply(self, context):
         if isinstance(context.content, dict) and "Content" in context.content:
             logger.info("friend request content: {}".format(context.content["Content"]))
-            if context.content["Content"] in conf().get("accept_friend_commands", []):
+            if context.content["Content"] in self._config(context).get("accept_friend_commands", []):
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=True)
             else:
                 return Reply(type=ReplyType.ACCEPT_FRIEND, content=False)
@@ -330,6 +503,7 @@ class ChatChannel(Channel):
             try:
                 worker_exception = worker.exception()
                 if worker_exception:
+                    metrics.inc("errors_total", stage="handle", channel=self.channel_type)
                     self._fail_callback(session_id, exception=worker_exception, **kwargs)
                 else:
                     self._success_callback(session_id, **kwargs)
@@ -338,52 +512,87 @@ class ChatChannel(Channel):
             except Exception as e:
                 logger.exception("Worker raise exception: {}".format(e))
             with self.lock:
-                self.sessions[session_id][1].release()
+                if session_id in self.futures and worker in self.futures[session_id]:
+                    self.futures[session_id].remove(worker)
+                if session_id in self.sessions:
+                    self.sessions[session_id][1].release()
+                    self._schedule(session_id)
 
         return func
 
+    # 将session_id标记为就绪并唤醒消费者，需在持有self.lock时调用
+    def _schedule(self, session_id):
+        if session_id not in self.ready_set:
+            self.ready_set.add(session_id)
+            self.ready_sessions.append(session_id)
+            self.ready_cond.notify()
+
     def produce(self, context: Context):
         session_id = context.get("session_id", 0)
+        metrics.stage(context, "queue", "compose", channel=self.channel_type)
         with self.lock:
             if session_id not in self.sessions:
                 self.sessions[session_id] = [
                     Dequeue(),
-                    threading.BoundedSemaphore(conf().get("concurrency_in_session", 4)),
+                    threading.BoundedSemaphore(self._config(context).get("concurrency_in_session", 4)),
                 ]
             if context.type == ContextType.TEXT and context.content.startswith("#"):
                 self.sessions[session_id][0].putleft(context)  # 优先处理管理命令
             else:
                 self.sessions[session_id][0].put(context)
+            self._schedule(session_id)
 
-    # 消费者函数，单独线程，用于从消息队列中取出消息并处理
+    # 消费者函数，单独线程，只在有session就绪时被唤醒，从该session的消息队列中取出消息并处理
     def consume(self):
         while True:
-            with self.lock:
-                session_ids = list(self.sessions.keys())
-                for session_id in session_ids:
-                    context_queue, semaphore = self.sessions[session_id]
-                    if semaphore.acquire(blocking=False):  # 等线程处理完毕才能删除
-                        if not context_queue.empty():
-                            context = context_queue.get()
-                            logger.debug("[chat_channel] consume context: {}".format(context))
-                            future: Future = handler_pool.submit(self._handle, context)
-                            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
-                            if session_id not in self.futures:
-                                self.futures[session_id] = []
-                            self.futures[session_id].append(future)
-                        elif semaphore._initial_value == semaphore._value + 1:  # 除了当前，没有任务再申请到信号量，说明所有任务都处理完毕
-                            self.futures[session_id] = [t for t in self.futures[session_id] if not t.done()]
-                            assert len(self.futures[session_id]) == 0, "thread pool error"
-                            del self.sessions[session_id]
-                        else:
-                            semaphore.release()
-            time.sleep(0.1)
+            with self.ready_cond:
+                while not self.ready_sessions:
+                    self.ready_cond.wait()
+                session_id = self.ready_sessions.popleft()
+                self.ready_set.discard(session_id)
+                self._dispatch(session_id)
+
+    # 在信号量允许的范围内提交该session排队的消息，session空闲且无排队消息时删除，需在持有self.lock时调用
+    def _dispatch(self, session_id):
+        if session_id not in self.sessions:
+            return
+        context_queue, semaphore = self.sessions[session_id]
+        while not context_queue.empty() and semaphore.acquire(blocking=False):
+            context = context_queue.get()
+            logger.debug("[chat_channel] consume context: {}".format(context))
+            metrics.stage(context, "pool", "queue", channel=self.channel_type)
+            metrics.inc("messages_total", channel=self.channel_type, type=context.type.name.lower())
+            if self._config(context).get("handler_mode") == "asyncio":
+                future: Future = event_loop.submit(self._handle_async(context))
+            else:
+                future: Future = self._select_handler_pool(context).submit(self._handle, context)
+            if session_id not in self.futures:
+                self.futures[session_id] = []
+            self.futures[session_id].append(future)
+            future.add_done_callback(self._thread_pool_callback(session_id, context=context))
+        if context_queue.empty() and semaphore._initial_value == semaphore._value:  # 没有排队消息，也没有处理中的任务
+            self.futures[session_id] = [t for t in self.futures.get(session_id, []) if not t.done()]
+            assert len(self.futures[session_id]) == 0, "thread pool error"
+            del self.futures[session_id]
+            del self.sessions[session_id]
+
+    # 根据消息类别和bot类型选择线程池，使管理指令、语音、画图等不会被慢请求阻塞
+    def _select_handler_pool(self, context: Context):
+        if context.type == ContextType.TEXT and context.content.startswith("#"):
+            reply_class = "admin"
+        elif context.type == ContextType.VOICE:
+            reply_class = "voice"
+        elif context.type == ContextType.IMAGE_CREATE:
+            reply_class = "image"
+        else:
+            reply_class = "text"
+        return handler_pools.select(reply_class, bot_type=Bridge().get_bot_type("chat"), channel_type=self.channel_type)
 
     # 取消session_id对应的所有任务，只能取消排队的消息和已提交线程池但未执行的任务
     def cancel_session(self, session_id):
         with self.lock:
             if session_id in self.sessions:
-                for future in self.futures[session_id]:
+                for future in list(self.futures.get(session_id, [])):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
@@ -392,8 +601,8 @@ class ChatChannel(Channel):
 
     def cancel_all_session(self):
         with self.lock:
-            for session_id in self.sessions:
-                for future in self.futures[session_id]:
+            for session_id in list(self.sessions):
+                for future in list(self.futures.get(session_id, [])):
                     future.cancel()
                 cnt = self.sessions[session_id][0].qsize()
                 if cnt > 0:
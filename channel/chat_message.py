@@ -26,11 +26,13 @@ actual_user_id: 实际发送者id (群聊必填)
 actual_user_nickname：实际发送者昵称
 self_display_name: 自身的展示名，设置群昵称时，该字段表示群昵称
 
+received_at: 收到消息的时间(time.monotonic)，用于统计各阶段耗时
 _prepare_fn: 准备函数，用于准备消息的内容，比如下载图片等,
 _prepared: 是否已经调用过准备函数
 _rawmsg: 原始消息对象
 
 """
+import time
 
 
 class ChatMessage(object):
@@ -55,12 +57,15 @@ class ChatMessage(object):
     actual_user_nickname = None
     at_list = None
 
+    received_at = None
+
     _prepare_fn = None
     _prepared = False
     _rawmsg = None
 
     def __init__(self, _rawmsg):
         self._rawmsg = _rawmsg
+        self.received_at = time.monotonic()
 
     def prepare(self):
         if self._prepare_fn and not self._prepared:
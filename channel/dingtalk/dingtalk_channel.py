@@ -100,9 +100,11 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
         super(dingtalk_stream.ChatbotHandler, self).__init__()
         self.logger = self.setup_logger()
         # 历史消息id暂存，用于幂等控制
-        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600), max_size=conf().get("received_msgs_max_size", 10000))
         logger.info("[DingTalk] client_id={}, client_secret={} ".format(
             self.dingtalk_client_id, self.dingtalk_client_secret))
+        # 开启AI卡片时流式回复通过更新卡片发送，否则按句发送
+        self.STREAM_MODE = "card" if conf().get("dingtalk_card_enabled") else "sentence"
         # 无需群校验和前缀
         conf()["group_name_white_list"] = ["ALL_GROUP"]
         # 单聊无需前缀
@@ -200,6 +202,17 @@ class DingTalkChanel(ChatChannel, dingtalk_stream.ChatbotHandler):
             self.reply_text(reply.content, incoming_message)
 
 
+    def update_stream_card(self, context: Context, card, content: str, finished: bool):
+        """流式回复：创建AI卡片并持续更新其markdown内容"""
+        incoming_message = context.kwargs['msg'].incoming_message
+        if card is None:
+            card = self.ai_markdown_card_start(incoming_message)
+        if finished:
+            card.ai_finish(markdown=content)
+        else:
+            card.ai_streaming(markdown=content, append=False)
+        return card
+
     def generate_button_markdown_content(self, context, reply):
         image_url = context.kwargs.get("image_url")
         promptEn = context.kwargs.get("promptEn")
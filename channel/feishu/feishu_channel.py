@@ -8,26 +8,34 @@
 # -*- coding=utf-8 -*-
 import uuid
 
-import requests
 import web
 from channel.feishu.feishu_message import FeishuMessage
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.singleton import singleton
-from config import conf
+from config import conf, snapshot
 from common.expired_dict import ExpiredDict
 from bridge.context import ContextType
 from channel.chat_channel import ChatChannel, check_prefix
+from channel.trigger_matcher import get_trigger_matcher
 from common import utils
+from common import http_client
+from common import http_ingress
+from common import tracing
+from common import media_fetcher
+from common.token_cache import get_token_cache
 import json
 import os
 
 URL_VERIFICATION = "url_verification"
+# tenant_access_token无效或已过期的错误码，token可能在有效期内被提前吊销
+TOKEN_ERROR_CODES = (99991663, 99991668)
 
 
 @singleton
 class FeiShuChanel(ChatChannel):
+    STREAM_MODE = "card"
     feishu_app_id = conf().get('feishu_app_id')
     feishu_app_secret = conf().get('feishu_app_secret')
     feishu_token = conf().get('feishu_token')
@@ -35,7 +43,8 @@ class FeiShuChanel(ChatChannel):
     def __init__(self):
         super().__init__()
         # 历史消息id暂存，用于幂等控制
-        self.receivedMsgs = ExpiredDict(60 * 60 * 7.1)
+        self.receivedMsgs = ExpiredDict(60 * 60 * 7.1, max_size=conf().get("received_msgs_max_size", 10000))
+        self.token_cache = get_token_cache("feishu:{}".format(self.feishu_app_id), self._request_access_token)
         logger.info("[FeiShu] app_id={}, app_secret={} verification_token={}".format(
             self.feishu_app_id, self.feishu_app_secret, self.feishu_token))
         # 无需群校验和前缀
@@ -46,58 +55,88 @@ class FeiShuChanel(ChatChannel):
         urls = (
             '/', 'channel.feishu.feishu_channel.FeishuController'
         )
-        app = web.application(urls, globals(), autoreload=False)
-        port = conf().get("feishu_port", 9891)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_ingress.serve(conf().get("feishu_port", 9891), urls, globals())
 
     def send(self, reply: Reply, context: Context):
-        msg = context.get("msg")
-        is_group = context["isgroup"]
-        if msg:
-            access_token = msg.access_token
-        else:
-            access_token = self.fetch_access_token()
-        headers = {
-            "Authorization": "Bearer " + access_token,
-            "Content-Type": "application/json",
-        }
         msg_type = "text"
         logger.info(f"[FeiShu] start send reply message, type={context.type}, content={reply.content}")
         reply_content = reply.content
         content_key = "text"
         if reply.type == ReplyType.IMAGE_URL:
             # 图片上传
-            reply_content = self._upload_image_url(reply.content, access_token)
+            reply_content = self._upload_image_url(reply.content)
             if not reply_content:
                 logger.warning("[FeiShu] upload file failed")
                 return
             msg_type = "image"
             content_key = "image_key"
-        if is_group:
-            # 群聊中直接回复
-            url = f"https://open.feishu.cn/open-apis/im/v1/messages/{msg.msg_id}/reply"
-            data = {
-                "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+        self._post_message(context, msg_type, json.dumps({content_key: reply_content}))
+
+    def update_stream_card(self, context: Context, card, content: str, finished: bool):
+        """流式回复：首次发送消息卡片，之后更新卡片内容，card为卡片消息的message_id"""
+        card_content = json.dumps({
+            "config": {"wide_screen_mode": True, "update_multi": True},
+            "elements": [{"tag": "markdown", "content": content or "..."}],
+        })
+        if card is None:
+            res = self._post_message(context, "interactive", card_content)
+            return res.get("data", {}).get("message_id")
+        url = f"https://open.feishu.cn/open-apis/im/v1/messages/{card}"
+
+        def request(access_token):
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
             }
-            res = requests.post(url=url, headers=headers, json=data, timeout=(5, 10))
-        else:
-            url = "https://open.feishu.cn/open-apis/im/v1/messages"
-            params = {"receive_id_type": context.get("receive_id_type") or "open_id"}
-            data = {
-                "receive_id": context.get("receiver"),
-                "msg_type": msg_type,
-                "content": json.dumps({content_key: reply_content})
+            return http_client.request("PATCH", url, headers=headers, json={"content": card_content}, timeout=(5, 10)).json()
+
+        res = self._call_api(request)
+        if res.get("code") != 0:
+            logger.warning(f"[FeiShu] update card failed, code={res.get('code')}, msg={res.get('msg')}")
+        return card
+
+    def _call_api(self, request_fn) -> dict:
+        """request_fn(access_token) 调用开放接口并返回json结果，tenant_access_token被提前吊销时刷新后重试一次"""
+        return self.token_cache.request(request_fn, lambda res: res.get("code") in TOKEN_ERROR_CODES)
+
+    def _post_message(self, context: Context, msg_type, content) -> dict:
+        def request(access_token):
+            headers = {
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
             }
-            res = requests.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
-        res = res.json()
+            if context["isgroup"]:
+                # 群聊中直接回复
+                url = f"https://open.feishu.cn/open-apis/im/v1/messages/{context.get('msg').msg_id}/reply"
+                data = {
+                    "msg_type": msg_type,
+                    "content": content
+                }
+                res = http_client.post(url=url, headers=headers, json=data, timeout=(5, 10))
+            else:
+                url = "https://open.feishu.cn/open-apis/im/v1/messages"
+                params = {"receive_id_type": context.get("receive_id_type") or "open_id"}
+                data = {
+                    "receive_id": context.get("receiver"),
+                    "msg_type": msg_type,
+                    "content": content
+                }
+                res = http_client.post(url=url, headers=headers, params=params, json=data, timeout=(5, 10))
+            return res.json()
+
+        res = self._call_api(request)
         if res.get("code") == 0:
             logger.info(f"[FeiShu] send message success")
         else:
             logger.error(f"[FeiShu] send message failed, code={res.get('code')}, msg={res.get('msg')}")
+        return res
 
 
     def fetch_access_token(self) -> str:
+        """获取缓存的tenant_access_token，临近过期时自动刷新"""
+        return self.token_cache.get() or ""
+
+    def _request_access_token(self):
         url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal/"
         headers = {
             "Content-Type": "application/json"
@@ -107,41 +146,42 @@ class FeiShuChanel(ChatChannel):
             "app_secret": self.feishu_app_secret
         }
         data = bytes(json.dumps(req_body), encoding='utf8')
-        response = requests.post(url=url, data=data, headers=headers)
+        response = http_client.post(url=url, data=data, headers=headers)
         if response.status_code == 200:
             res = response.json()
             if res.get("code") != 0:
                 logger.error(f"[FeiShu] get tenant_access_token error, code={res.get('code')}, msg={res.get('msg')}")
-                return ""
+                return None, 0
             else:
-                return res.get("tenant_access_token")
+                return res.get("tenant_access_token"), res.get("expire")
         else:
             logger.error(f"[FeiShu] fetch token error, res={response}")
+            return None, 0
 
 
-    def _upload_image_url(self, img_url, access_token):
+    def _upload_image_url(self, img_url):
         logger.debug(f"[WX] start download image, img_url={img_url}")
-        response = requests.get(img_url)
         suffix = utils.get_path_suffix(img_url)
-        temp_name = str(uuid.uuid4()) + "." + suffix
-        if response.status_code == 200:
-            # 将图片内容保存为临时文件
-            with open(temp_name, "wb") as file:
-                file.write(response.content)
+        image_storage = media_fetcher.fetch_io(img_url, "image")
+        image_storage.name = str(uuid.uuid4()) + "." + suffix
 
         # upload
         upload_url = "https://open.feishu.cn/open-apis/im/v1/images"
         data = {
             'image_type': 'message'
         }
-        headers = {
-            'Authorization': f'Bearer {access_token}',
-        }
-        with open(temp_name, "rb") as file:
-            upload_response = requests.post(upload_url, files={"image": file}, data=data, headers=headers)
+
+        def request(access_token):
+            headers = {
+                'Authorization': f'Bearer {access_token}',
+            }
+            image_storage.seek(0)  # 重试时重新读取图片内容
+            upload_response = http_client.post(upload_url, files={"image": image_storage}, data=data, headers=headers)
             logger.info(f"[FeiShu] upload file, res={upload_response.content}")
-            os.remove(temp_name)
-            return upload_response.json().get("data").get("image_key")
+            return upload_response.json()
+
+        res = self._call_api(request)
+        return (res.get("data") or {}).get("image_key")
 
 
 
@@ -186,50 +226,61 @@ class FeishuController:
                     return self.SUCCESS_MSG
                 channel.receivedMsgs[msg.get("message_id")] = True
 
-                is_group = False
-                chat_type = msg.get("chat_type")
-                if chat_type == "group":
-                    if not msg.get("mentions") and msg.get("message_type") == "text":
-                        # 群聊中未@不响应
-                        return self.SUCCESS_MSG
-                    if msg.get("mentions")[0].get("name") != conf().get("feishu_bot_name") and msg.get("message_type") == "text":
-                        # 不是@机器人，不响应
-                        return self.SUCCESS_MSG
-                    # 群聊
-                    is_group = True
-                    receive_id_type = "chat_id"
-                elif chat_type == "p2p":
-                    receive_id_type = "open_id"
-                else:
-                    logger.warning("[FeiShu] message ignore")
-                    return self.SUCCESS_MSG
-                # 构造飞书消息对象
-                feishu_msg = FeishuMessage(event, is_group=is_group, access_token=channel.fetch_access_token())
-                if not feishu_msg:
-                    return self.SUCCESS_MSG
-
-                context = self._compose_context(
-                    feishu_msg.ctype,
-                    feishu_msg.content,
-                    isgroup=is_group,
-                    msg=feishu_msg,
-                    receive_id_type=receive_id_type,
-                    no_need_at=True
-                )
-                if context:
-                    channel.produce(context)
-                logger.info(f"[FeiShu] query={feishu_msg.content}, type={feishu_msg.ctype}")
+                # 构造消息(需要获取access_token)和上下文在后台完成，立即返回响应
+                http_ingress.dispatch(self.produce, channel, event)
             return self.SUCCESS_MSG
 
         except Exception as e:
             logger.error(e)
             return self.FAILED_MSG
 
+    def produce(self, channel, event):
+        msg = event.get("message")
+        is_group = False
+        chat_type = msg.get("chat_type")
+        if chat_type == "group":
+            if not msg.get("mentions") and msg.get("message_type") == "text":
+                # 群聊中未@不响应
+                return
+            if msg.get("mentions")[0].get("name") != conf().get("feishu_bot_name") and msg.get("message_type") == "text":
+                # 不是@机器人，不响应
+                return
+            # 群聊
+            is_group = True
+            receive_id_type = "chat_id"
+        elif chat_type == "p2p":
+            receive_id_type = "open_id"
+        else:
+            logger.warning("[FeiShu] message ignore")
+            return
+        # 构造飞书消息对象
+        try:
+            feishu_msg = FeishuMessage(event, is_group=is_group, access_token=channel.fetch_access_token())
+        except NotImplementedError as e:
+            logger.debug("[FeiShu] " + str(e))
+            return
+
+        context = self._compose_context(
+            feishu_msg.ctype,
+            feishu_msg.content,
+            isgroup=is_group,
+            msg=feishu_msg,
+            receive_id_type=receive_id_type,
+            no_need_at=True
+        )
+        if context:
+            channel.produce(context)
+        logger.info(f"[FeiShu] query={feishu_msg.content}, type={feishu_msg.ctype}")
+
     def _compose_context(self, ctype: ContextType, content, **kwargs):
         context = Context(ctype, content)
         context.kwargs = kwargs
+        tracing.start_trace(context, channel="feishu")
         if "origin_ctype" not in context:
             context["origin_ctype"] = ctype
+        if "config" not in context:
+            context["config"] = snapshot()
+        config = context["config"]
 
         cmsg = context["msg"]
         context["session_id"] = cmsg.from_user_id
@@ -238,7 +289,7 @@ class FeishuController:
         if ctype == ContextType.TEXT:
             # 1.文本请求
             # 图片生成处理
-            img_match_prefix = check_prefix(content, conf().get("image_create_prefix"))
+            img_match_prefix = check_prefix(content, config.get("image_create_prefix"))
             if img_match_prefix:
                 content = content.replace(img_match_prefix, "", 1)
                 context.type = ContextType.IMAGE_CREATE
@@ -248,7 +299,9 @@ class FeishuController:
 
         elif context.type == ContextType.VOICE:
             # 2.语音请求
-            if "desire_rtype" not in context and conf().get("voice_reply_voice"):
+            if "desire_rtype" not in context and config.get("voice_reply_voice"):
                 context["desire_rtype"] = ReplyType.VOICE
 
+        if context.type == ContextType.TEXT and FeiShuChanel().STREAM_MODE and get_trigger_matcher(config).stream_reply:
+            context["stream"] = context.get("desire_rtype") != ReplyType.VOICE
         return context
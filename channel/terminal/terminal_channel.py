@@ -5,6 +5,8 @@ from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel, check_prefix
 from channel.chat_message import ChatMessage
 from common.log import logger
+from common import http_client
+from common import media_fetcher
 from config import conf
 
 
@@ -42,15 +44,10 @@ class TerminalChannel(ChatChannel):
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             import io
 
-            import requests
             from PIL import Image
 
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
-            image_storage.seek(0)
+            image_storage = media_fetcher.fetch_io(img_url, "image")
             img = Image.open(image_storage)
             print(img_url)
             img.show()
@@ -0,0 +1,99 @@
+"""
+消息触发条件匹配
+_compose_context对每条消息都要判断群白名单、黑名单、前缀和关键词，这里把相关配置预先编译好：
+名单转为set，前缀和关键词合并为一个正则，@昵称的正则按昵称缓存。
+每个TriggerMatcher对应一个配置快照，配置重新加载或被修改后，下次获取时整体重建，不会读到一半新一半旧的配置
+"""
+import re
+from functools import lru_cache
+
+from config import ConfigSnapshot, snapshot
+
+
+def compile_prefix(prefix_list):
+    """按列表顺序匹配第一个命中的前缀，与check_prefix结果一致"""
+    if not prefix_list:
+        return None
+    return re.compile("|".join(re.escape(prefix) for prefix in prefix_list))
+
+
+def compile_contain(keyword_list):
+    if not keyword_list:
+        return None
+    return re.compile("|".join(re.escape(keyword) for keyword in keyword_list))
+
+
+@lru_cache(maxsize=4096)
+def mention_pattern(name):
+    """@昵称后跟四分之一空格(\u2005)或普通空格"""
+    return re.compile(f"@{re.escape(name)}(\u2005|\u0020)")
+
+
+class TriggerMatcher:
+    def __init__(self, config):
+        self.config = config
+        group_name_white_list = config.get("group_name_white_list", []) or []
+        self.group_name_white_list = frozenset(group_name_white_list)
+        self.all_group = "ALL_GROUP" in self.group_name_white_list
+        self.group_name_keyword = compile_contain(config.get("group_name_keyword_white_list", []))
+        self.group_chat_in_one_session = frozenset(config.get("group_chat_in_one_session", []) or [])
+        self.all_group_in_one_session = "ALL_GROUP" in self.group_chat_in_one_session
+        self.nick_name_black_list = frozenset(config.get("nick_name_black_list", []) or [])
+        self.group_chat_prefix = compile_prefix(config.get("group_chat_prefix"))
+        self.group_chat_keyword = compile_contain(config.get("group_chat_keyword"))
+        self.single_chat_prefix = compile_prefix(config.get("single_chat_prefix", [""]))
+        self.image_create_prefix = compile_prefix(config.get("image_create_prefix", [""]))
+        self.group_at_off = config.get("group_at_off", False)
+        self.trigger_by_self = config.get("trigger_by_self", True)
+        self.always_reply_voice = config.get("always_reply_voice")
+        self.voice_reply_voice = config.get("voice_reply_voice")
+        self.stream_reply = config.get("stream_reply")
+
+    def is_group_allowed(self, group_name):
+        if self.all_group or group_name in self.group_name_white_list:
+            return True
+        return self.group_name_keyword is not None and self.group_name_keyword.search(group_name) is not None
+
+    def is_group_in_one_session(self, group_name):
+        return self.all_group_in_one_session or group_name in self.group_chat_in_one_session
+
+    def is_blacklisted(self, nick_name):
+        return bool(nick_name) and nick_name in self.nick_name_black_list
+
+    @staticmethod
+    def match_prefix(pattern, content):
+        """返回命中的前缀，未命中返回None"""
+        if pattern is None:
+            return None
+        match = pattern.match(content)
+        return match.group(0) if match else None
+
+    @staticmethod
+    def match_contain(pattern, content):
+        if pattern is None:
+            return None
+        return True if pattern.search(content) else None
+
+    @staticmethod
+    def strip_mentions(content, names):
+        for name in names:
+            content = mention_pattern(name).sub("", content)
+        return content
+
+
+_matcher = None
+
+
+def get_trigger_matcher(config: ConfigSnapshot = None) -> TriggerMatcher:
+    """
+    返回与配置快照对应的TriggerMatcher，快照变化时重建，不传config时使用当前配置的快照
+    调用方应在处理一条消息期间持有同一个实例
+    """
+    global _matcher
+    if config is None:
+        config = snapshot()
+    matcher = _matcher
+    if matcher is None or matcher.config is not config:
+        matcher = TriggerMatcher(config)
+        _matcher = matcher
+    return matcher
@@ -9,7 +9,6 @@ import json
 import os
 import threading
 import time
-import requests
 
 from bridge.context import *
 from bridge.reply import *
@@ -21,6 +20,8 @@ from common.log import logger
 from common.singleton import singleton
 from common.time_check import time_checker
 from common.utils import convert_webp_to_png
+from common import http_client
+from common import media_fetcher
 from config import conf, get_appdata_dir
 from lib import itchat
 from lib.itchat.content import *
@@ -111,7 +112,7 @@ def qrCallback(uuid, status, qrcode):
         qrcodes = [qr_api2, qr_api1, qr_api3, qr_api4]
         for item in qrcodes:
             try:
-                response = requests.get(item)
+                response = http_client.get(item)
                 response.raise_for_status()
                 with open("wx_qrcode.png", "wb") as f:
                     f.write(response.content)
@@ -127,10 +128,11 @@ def qrCallback(uuid, status, qrcode):
 @singleton
 class WechatChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_MODE = "sentence"
 
     def __init__(self):
         super().__init__()
-        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600))
+        self.receivedMsgs = ExpiredDict(conf().get("expires_in_seconds", 3600), max_size=conf().get("received_msgs_max_size", 10000))
         self.auto_login_times = 0
 
     def startup(self):
@@ -250,14 +252,8 @@ class WechatChannel(ChatChannel):
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
             logger.debug(f"[WX] start download image, img_url={img_url}")
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            size = 0
-            for block in pic_res.iter_content(1024):
-                size += len(block)
-                image_storage.write(block)
-            logger.info(f"[WX] download image success, size={size}, img_url={img_url}")
-            image_storage.seek(0)
+            image_storage = media_fetcher.fetch_io(img_url, "image")
+            logger.info(f"[WX] download image success, size={len(image_storage.getvalue())}, img_url={img_url}")
             if ".webp" in img_url:
                 try:
                     image_storage = convert_webp_to_png(image_storage)
@@ -282,14 +278,8 @@ class WechatChannel(ChatChannel):
         elif reply.type == ReplyType.VIDEO_URL:  # 新增视频URL回复类型
             video_url = reply.content
             logger.debug(f"[WX] start download video, video_url={video_url}")
-            video_res = requests.get(video_url, stream=True)
-            video_storage = io.BytesIO()
-            size = 0
-            for block in video_res.iter_content(1024):
-                size += len(block)
-                video_storage.write(block)
-            logger.info(f"[WX] download video success, size={size}, video_url={video_url}")
-            video_storage.seek(0)
+            video_storage = media_fetcher.fetch_io(video_url, "video")
+            logger.info(f"[WX] download video success, size={len(video_storage.getvalue())}, video_url={video_url}")
             itchat.send_video(video_storage, toUserName=receiver)
             logger.info("[WX] sendVideo url={}, receiver={}".format(video_url, receiver))
 
@@ -1,4 +1,5 @@
 import re
+import uuid
 
 from bridge.context import ContextType
 from channel.chat_message import ChatMessage
@@ -19,11 +20,11 @@ class WechatMessage(ChatMessage):
             self.content = itchat_msg["Text"]
         elif itchat_msg["Type"] == VOICE:
             self.ctype = ContextType.VOICE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().path() + uuid.uuid4().hex[:8] + "-" + itchat_msg["FileName"]  # content直接存临时目录路径
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == PICTURE and itchat_msg["MsgType"] == 3:
             self.ctype = ContextType.IMAGE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().path() + uuid.uuid4().hex[:8] + "-" + itchat_msg["FileName"]  # content直接存临时目录路径
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == NOTE and itchat_msg["MsgType"] == 10000:
             if is_group and ("加入群聊" in itchat_msg["Content"] or "加入了群聊" in itchat_msg["Content"]):
@@ -54,7 +55,7 @@ class WechatMessage(ChatMessage):
                 raise NotImplementedError("Unsupported note message: " + itchat_msg["Content"])
         elif itchat_msg["Type"] == ATTACHMENT:
             self.ctype = ContextType.FILE
-            self.content = TmpDir().path() + itchat_msg["FileName"]  # content直接存临时目录路径
+            self.content = TmpDir().new_file(name=itchat_msg["FileName"])  # 文件保留原文件名，放在单独的子目录中
             self._prepare_fn = lambda: itchat_msg.download(self.content)
         elif itchat_msg["Type"] == SHARING:
             self.ctype = ContextType.SHARING
@@ -9,7 +9,6 @@ import base64
 import os
 import time
 
-from channel import chat_channel
 from wechaty import Contact, Wechaty
 from wechaty.user import Message
 from wechaty_puppet import FileBox
@@ -19,12 +18,14 @@ from bridge.context import Context
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel.wechat.wechaty_message import WechatyMessage
+from common.handler_pool import handler_pools
 from common.log import logger
 from common.singleton import singleton
 from config import conf
 
 try:
-    from voice.audio_convert import any_to_sil
+    from voice.audio_convert import any_to_sil, convert_in_pool
+    from voice.tts_cache import cached_convert
 except Exception as e:
     pass
 
@@ -45,7 +46,7 @@ class WechatyChannel(ChatChannel):
     async def main(self):
         loop = asyncio.get_event_loop()
         # 将asyncio的loop传入处理线程
-        chat_channel.handler_pool._initializer = lambda: asyncio.set_event_loop(loop)
+        handler_pools.set_initializer(lambda: asyncio.set_event_loop(loop))
         self.bot = Wechaty()
         self.bot.on("login", self.on_login)
         self.bot.on("message", self.on_message)
@@ -77,7 +78,8 @@ class WechatyChannel(ChatChannel):
             voiceLength = None
             file_path = reply.content
             sil_file = os.path.splitext(file_path)[0] + ".sil"
-            voiceLength = int(any_to_sil(file_path, sil_file))
+            # silk编码在进程池中执行，开启语音合成缓存时相同的音频直接使用缓存的编码结果
+            voiceLength = int(cached_convert(file_path, sil_file, "sil", lambda src, dst: convert_in_pool(any_to_sil, src, dst)))
             if voiceLength >= 60000:
                 voiceLength = 60000
                 logger.info("[WX] voice too long, length={}, set to 60s".format(voiceLength))
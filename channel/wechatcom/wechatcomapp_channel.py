@@ -3,7 +3,6 @@ import io
 import os
 import time
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -18,8 +17,12 @@ from channel.wechatcom.wechatcomapp_message import WechatComAppMessage
 from common.log import logger
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length, convert_webp_to_png
+from common import http_client
+from common import http_ingress
+from common import media_fetcher
 from config import conf, subscribe_msg
 from voice.audio_convert import any_to_amr, split_audio
+from voice.tts_cache import cached_convert
 
 MAX_UTF8_LEN = 2048
 
@@ -27,6 +30,7 @@ MAX_UTF8_LEN = 2048
 @singleton
 class WechatComAppChannel(ChatChannel):
     NOT_SUPPORT_REPLYTYPE = []
+    STREAM_MODE = "sentence"
 
     def __init__(self):
         super().__init__()
@@ -45,9 +49,7 @@ class WechatComAppChannel(ChatChannel):
     def startup(self):
         # start message listener
         urls = ("/wxcomapp/?", "channel.wechatcom.wechatcomapp_channel.Query")
-        app = web.application(urls, globals(), autoreload=False)
-        port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_ingress.serve(conf().get("wechatcomapp_port", 9898), urls, globals())
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -66,7 +68,7 @@ class WechatComAppChannel(ChatChannel):
                 media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
+                cached_convert(file_path, amr_file, "amr", any_to_amr)
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
                     logger.info("[wechatcom] voice too long {}s > 60s , split into {} parts".format(duration / 1000.0, len(files)))
@@ -89,10 +91,7 @@ class WechatComAppChannel(ChatChannel):
             logger.info("[wechatcom] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
+            image_storage = media_fetcher.fetch_io(img_url, "image")
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcom] image too large, ready to compress, sz={}".format(sz))
@@ -168,17 +167,21 @@ class Query:
                     res = channel.crypto.encrypt_message(reply, nonce, timestamp)
                     return res
         else:
-            try:
-                wechatcom_msg = WechatComAppMessage(msg, client=channel.client)
-            except NotImplementedError as e:
-                logger.debug("[wechatcom] " + str(e))
-                return "success"
-            context = channel._compose_context(
-                wechatcom_msg.ctype,
-                wechatcom_msg.content,
-                isgroup=False,
-                msg=wechatcom_msg,
-            )
-            if context:
-                channel.produce(context)
+            # 构造消息和上下文在后台完成，立即返回响应
+            http_ingress.dispatch(self.produce, channel, msg)
         return "success"
+
+    def produce(self, channel, msg):
+        try:
+            wechatcom_msg = WechatComAppMessage(msg, client=channel.client)
+        except NotImplementedError as e:
+            logger.debug("[wechatcom] " + str(e))
+            return
+        context = channel._compose_context(
+            wechatcom_msg.ctype,
+            wechatcom_msg.content,
+            isgroup=False,
+            msg=wechatcom_msg,
+        )
+        if context:
+            channel.produce(context)
@@ -0,0 +1,127 @@
+"""
+企业微信客服消息同步
+回调(kf_msg_or_event)只通知有新消息，消息内容需要调用 kf/sync_msg 拉取：
+- 每个客服账号(open_kfid)的cursor保存在磁盘上，重启后从上次的位置继续，不会重复拉取
+- has_more为真时继续翻页，每条新消息按顺序交给on_message
+- 同一open_kfid的回调并发到达时合并：正在同步时只记下最新的token，本轮结束后再同步一次
+- 超过max_age秒的消息(如首次同步拉到的历史消息)不处理，已处理的msgid在一段时间内去重
+sync_api为调用同步接口的函数，便于替换成本地的模拟接口测试
+"""
+import json
+import os
+import threading
+import time
+
+from common.expired_dict import ExpiredDict
+from common.log import logger
+
+SYNC_LIMIT = 1000  # 接口允许的单页最大条数
+
+
+class KfMsgSync(object):
+    def __init__(self, sync_api, on_message, cursor_path, max_age=600):
+        """
+        sync_api(token, open_kfid, cursor, limit) 返回接口的json结果
+        on_message(msg) 处理一条新消息，msg为msg_list中的元素
+        """
+        self.sync_api = sync_api
+        self.on_message = on_message
+        self.cursor_path = cursor_path
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.cursors = self._load_cursors()
+        self.running = set()  # 正在同步的open_kfid
+        self.pending = {}  # open_kfid -> 同步期间收到的最新token
+        self.seen = ExpiredDict(max(max_age, 60) * 2, max_size=10000)
+        self.stats = {"runs": 0, "coalesced": 0, "pages": 0, "messages": 0, "skipped": 0, "errors": 0}
+
+    def _load_cursors(self):
+        try:
+            with open(self.cursor_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning("[wechatcs] load sync cursors failed, sync from the beginning: {}".format(e))
+            return {}
+
+    def _save_cursors(self):
+        tmp_path = self.cursor_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.cursors, f)
+        os.replace(tmp_path, self.cursor_path)
+
+    def request(self, open_kfid, token):
+        """
+        收到回调时调用，在当前线程中同步到没有新消息为止。
+        其它线程正在同步同一open_kfid时立即返回，由那个线程在本轮结束后再同步一次
+        """
+        with self.lock:
+            if open_kfid in self.running:
+                self.pending[open_kfid] = token
+                self.stats["coalesced"] += 1
+                return
+            self.running.add(open_kfid)
+        try:
+            while True:
+                self._sync(open_kfid, token)
+                with self.lock:
+                    token = self.pending.pop(open_kfid, None)
+                    if token is None:
+                        self.running.discard(open_kfid)
+                        return
+        except BaseException:
+            with self.lock:
+                self.pending.pop(open_kfid, None)
+                self.running.discard(open_kfid)
+            raise
+
+    def _sync(self, open_kfid, token):
+        with self.lock:
+            self.stats["runs"] += 1
+        while True:
+            cursor = self.cursors.get(open_kfid, "")
+            res = self.sync_api(token, open_kfid, cursor, SYNC_LIMIT)
+            if res.get("errcode") != 0:
+                with self.lock:
+                    self.stats["errors"] += 1
+                logger.error("[wechatcs] sync_msg failed, open_kfid={}, errcode={}, errmsg={}".format(
+                    open_kfid, res.get("errcode"), res.get("errmsg")))
+                return
+            msg_list = res.get("msg_list") or []
+            with self.lock:
+                self.stats["pages"] += 1
+            for msg in msg_list:
+                self._handle(msg)
+            next_cursor = res.get("next_cursor")
+            if next_cursor and next_cursor != cursor:
+                with self.lock:
+                    self.cursors[open_kfid] = next_cursor
+                    try:
+                        self._save_cursors()
+                    except OSError as e:
+                        logger.warning("[wechatcs] save sync cursors failed: {}".format(e))
+            if not res.get("has_more") or not next_cursor:
+                return
+
+    def _handle(self, msg):
+        msgid = msg.get("msgid")
+        if msgid in self.seen:
+            return
+        self.seen[msgid] = True
+        if self.max_age and time.time() - msg.get("send_time", 0) > self.max_age:
+            with self.lock:
+                self.stats["skipped"] += 1
+            return
+        with self.lock:
+            self.stats["messages"] += 1
+        try:
+            self.on_message(msg)
+        except Exception as e:
+            logger.exception("[wechatcs] handle message {} failed: {}".format(msgid, e))
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["kfids"] = len(self.cursors)
+        return stats
@@ -3,8 +3,8 @@ import io
 import json
 import os
 import time
+import xml.etree.ElementTree as ET
 
-import requests
 import web
 from wechatpy.enterprise import create_reply, parse_message
 from wechatpy.enterprise.crypto import WeChatCrypto
@@ -14,23 +14,21 @@ from wechatpy.exceptions import InvalidSignatureException, WeChatClientException
 from bridge.context import Context
 from bridge.reply import Reply, ReplyType
 from channel.chat_channel import ChatChannel
-from channel.wechatcom.wechatcomapp_client import WechatComAppClient
+from channel.wechatcs.kf_sync import KfMsgSync
+from channel.wechatcs.wechatcomservice_client import WechatComServiceClient
 from channel.wechatcs.wechatcomservice_message import WechatComServiceMessage
 from common.log import logger
 from common.singleton import singleton
 from common.utils import compress_imgfile, fsize, split_string_by_utf8_length
-from config import conf, subscribe_msg
+from common import http_client
+from common import http_ingress
+from common import media_fetcher
+from config import conf, get_appdata_dir, subscribe_msg
 from voice.audio_convert import any_to_amr, split_audio
-
-import web
-import json
-import requests
-import xml.etree.ElementTree as ET
-from wechatpy.enterprise.crypto import WeChatCrypto
-from wechatpy.exceptions import InvalidSignatureException
-from wechatpy.enterprise.exceptions import InvalidCorpIdException
+from voice.tts_cache import cached_convert
 
 MAX_UTF8_LEN = 2048
+KF_ORIGIN_CUSTOMER = 3  # 消息来源: 3-客户发送 4-系统推送 5-接待人员发送
 
 
 @singleton
@@ -53,15 +51,21 @@ class WechatComServiceChannel(ChatChannel):
                                                                                                     self.aes_key)
         )
         self.crypto = WeChatCrypto(self.token, self.aes_key, self.corp_id)
-        self.client = WechatComAppClient(self.corp_id, self.secret)
+        # access_token来自共享的token缓存，客服接口和wechatpy的接口(如上传素材)共用，被吊销时刷新后重试
+        self.client = WechatComServiceClient(self.corp_id, self.secret)
+        # 按客服账号保存拉取消息的cursor，回调时同步所有新消息
+        self.kf_sync = KfMsgSync(
+            self.sync_msg,
+            self.handle_kf_message,
+            os.path.join(get_appdata_dir(), "wechatcs_cursors.json"),
+            max_age=conf().get("wechatcs_msg_max_age", 600),
+        )
 
     def startup(self):
         # start message listener
         # wechatcomservice_channel.py
         urls = ("/wxcomapp", "channel.wechatcs.wechatcomservice_channel.Query")
-        app = web.application(urls, globals(), autoreload=False)
-        port = conf().get("wechatcomapp_port", 9898)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_ingress.serve(conf().get("wechatcomapp_port", 9898), urls, globals())
 
     def send(self, reply: Reply, context: Context):
         receiver = context["receiver"]
@@ -83,7 +87,7 @@ class WechatComServiceChannel(ChatChannel):
                 media_ids = []
                 file_path = reply.content
                 amr_file = os.path.splitext(file_path)[0] + ".amr"
-                any_to_amr(file_path, amr_file)
+                cached_convert(file_path, amr_file, "amr", any_to_amr)
                 duration, files = split_audio(amr_file, 60 * 1000)
                 if len(files) > 1:
                     logger.info(
@@ -110,10 +114,7 @@ class WechatComServiceChannel(ChatChannel):
             logger.info("[wechatcs] sendVoice={}, receiver={}".format(reply.content, receiver))
         elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
             img_url = reply.content
-            pic_res = requests.get(img_url, stream=True)
-            image_storage = io.BytesIO()
-            for block in pic_res.iter_content(1024):
-                image_storage.write(block)
+            image_storage = media_fetcher.fetch_io(img_url, "image")
             sz = fsize(image_storage)
             if sz >= 10 * 1024 * 1024:
                 logger.info("[wechatcs] image too large, ready to compress, sz={}".format(sz))
@@ -177,8 +178,15 @@ class WechatComServiceChannel(ChatChannel):
             except json.JSONDecodeError:
                 logger.error("Invalid JSON format in reply.content")
 
+    def _post_kf_api(self, api, data):
+        """调用微信客服接口，access_token被提前吊销时刷新后重试一次"""
+        def request(access_token):
+            url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/{api}?access_token={access_token}"
+            return http_client.post(url, json=data).json()
+
+        return self.client.token_manager.request(request)
+
     def send_text_message(self, external_userid, open_kfid, content, msgid=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -188,11 +196,9 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data)
-        return response.json()
+        return self._post_kf_api("send_msg", data)
 
     def send_image_message(self, external_userid, open_kfid, msgid=None, media_id=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -202,7 +208,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data).json()
+        response = self._post_kf_api("send_msg", data)
         if response['errmsg'] == 'ok':
             print(f"Send IMAGE Message Success")
         else:
@@ -210,7 +216,6 @@ class WechatComServiceChannel(ChatChannel):
         return response
 
     def send_voice_message(self, external_userid, open_kfid, media_id, msgid=None):
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
         data = {
             "touser": external_userid,
             "open_kfid": open_kfid,
@@ -220,7 +225,7 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
 
-        response = requests.post(url, json=data).json()
+        response = self._post_kf_api("send_msg", data)
         if response['errmsg'] == 'ok':
             print(f"Send VOICE Message Success")
         else:
@@ -239,43 +244,46 @@ class WechatComServiceChannel(ChatChannel):
         if msgid:
             data["msgid"] = msgid
         # 发送图文链接消息
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/send_msg?access_token={self.client.fetch_access_token()}"
-        response = requests.post(url, json=data).json()
+        response = self._post_kf_api("send_msg", data)
         if response['errmsg'] == 'ok':
             print("Send LINK Message Success")
         else:
             print(f"Something error: {response}")
         return response
 
-    def get_latest_message(self, token, open_kfid, next_cursor=""):
-        logger.debug(f"self.client.fetch_access_token():{self.client.fetch_access_token()}")
-        url = f"https://qyapi.weixin.qq.com/cgi-bin/kf/sync_msg?access_token={self.client.fetch_access_token()}"
+    def sync_msg(self, token, open_kfid, cursor="", limit=1000):
+        """调用kf/sync_msg拉取一页消息，返回接口的json结果"""
         data = {
             "token": token,
             "open_kfid": open_kfid,
-            "limit": 1000
+            "limit": limit
         }
-        if next_cursor:
-            data["cursor"] = next_cursor
-
-        response = requests.post(url, json=data)
-        response_data = response.json()
-        # if response_data["errcode"] == 0 and response_data["msg_list"]:
-        #     return response_data["msg_list"][-1]  # 返回最新的一条消息
-        # else:
-        #     return None
+        if cursor:
+            data["cursor"] = cursor
 
+        response_data = self._post_kf_api("sync_msg", data)
         # 检查是否有错误码并打印相关错误信息
         if response_data.get("errcode") != 0:
             logger.error(
                 f"[ERROR][{response_data.get('errcode')}][{response_data.get('errmsg')}] - Failed to fetch messages, more info at {response_data.get('more_info') or 'https://open.work.weixin.qq.com/devtool/query?e=' + str(response_data.get('errcode'))}")
-            return None
-
         logger.debug(f"response_data:{response_data}")
-        if response_data.get("msg_list"):
-            return response_data["msg_list"][-1]  # 返回最新的一条消息
-        else:
-            return None
+        return response_data
+
+    def handle_kf_message(self, msg):
+        """同步到的一条消息，只处理客户发送的文本、图片和语音"""
+        if msg.get("origin") != KF_ORIGIN_CUSTOMER or msg.get("msgtype") not in ["text", "image", "voice"]:
+            return
+        wechatcom_copy_msg = WechatComServiceMessage(msg=msg, client=self.client)
+        logger.debug(f"[wechatcs] wechatcom_copy_msg: {wechatcom_copy_msg}")
+        context = self._compose_context(
+            wechatcom_copy_msg.ctype,
+            wechatcom_copy_msg.content,
+            isgroup=False,
+            msg=wechatcom_copy_msg,
+        )
+        logger.debug(f"[wechatcs] context: {context}")
+        if context:
+            self.produce(context)
 
 
 class Query:
@@ -317,26 +325,8 @@ class Query:
                 # 示例代码，根据实际情况修改
                 token = xml_tree.find("Token").text
                 open_kfid = xml_tree.find("OpenKfId").text
-                next_cursor = ""  # 第一次请求时不需要提供 cursor
-
-                latest_message = channel.get_latest_message(token, open_kfid, next_cursor)
-                logger.debug(f"[wechatcs] latest_message: {latest_message}")
-                try:
-                    wechatcom_copy_msg = WechatComServiceMessage(msg=latest_message, client=channel.client)
-                    logger.debug(f"[wechatcs] wechatcom_copy_msg: {wechatcom_copy_msg}")
-                except NotImplementedError as e:
-                    logger.debug("[wechatcs] " + str(e))
-                    return "success"
-                context = channel._compose_context(
-                    wechatcom_copy_msg.ctype,
-                    wechatcom_copy_msg.content,
-                    isgroup=False,
-                    msg=wechatcom_copy_msg,
-                )
-                logger.debug(f"[wechatcs] context: {context}")
-                if context:
-                    channel.produce(context)
-                logger.debug(f"[wechatcs] get latest message: {latest_message}")
+                # 拉取消息和构造上下文在后台完成，立即返回响应，同一客服账号的并发回调合并为一次同步
+                http_ingress.dispatch(self.produce, channel, token, open_kfid)
                 return json.dumps({"status": "success"})
             else:
                 return "Unsupported event type"
@@ -346,3 +336,6 @@ class Query:
         except ET.ParseError as e:
             logger.error(f"[wechatcs] XML Parse Error: {e}")
             return "Invalid XML format"
+
+    def produce(self, channel, token, open_kfid):
+        channel.kf_sync.request(open_kfid, token)
@@ -1,31 +1,38 @@
 import threading
 import time
-import requests
+from common import http_client
+from common.token_cache import get_token_cache
 import time
 from wechatpy.enterprise import WeChatClient
 from config import conf
 
+# access_token无效、不合法或已过期的错误码，token可能被提前吊销(如在管理后台重置了secret)
+TOKEN_ERRCODES = (40001, 40014, 42001)
+
 
 class WeChatTokenManager:
     def __init__(self):
-        self.access_token = None
-        self.expires_at = 0
+        corpid = conf().get("wechatcom_corp_id")
+        self.token_cache = get_token_cache("wechatcs:{}".format(corpid), self._request_token)
 
     def get_token(self):
-        current_time = time.time()
-        if self.access_token and self.expires_at - current_time > 60:
-            return self.access_token
+        access_token = self.token_cache.get()
+        if not access_token:
+            raise Exception("Failed to retrieve access token")
+        return access_token
 
+    def request(self, request_fn):
+        """request_fn(access_token) 调用接口并返回json结果，token被判定失效时作废缓存并重试一次"""
+        return self.token_cache.request(request_fn, lambda res: res.get("errcode") in TOKEN_ERRCODES)
+
+    def _request_token(self):
         corpid = conf().get("wechatcom_corp_id")
         corpsecret = conf().get("wechatcomapp_secret")
         url = f"https://qyapi.weixin.qq.com/cgi-bin/gettoken?corpid={corpid}&corpsecret={corpsecret}"
 
-        response = requests.get(url).json()
+        response = http_client.get(url).json()
         if 'access_token' in response:
-            self.access_token = response['access_token']
-            self.expires_at = current_time + response['expires_in'] - 60
-            print(f'access_token:{self.access_token}')
-            return self.access_token
+            return response['access_token'], response['expires_in']
         else:
             raise Exception("Failed to retrieve access token")
 
@@ -53,7 +60,18 @@ class WechatComServiceClient(WeChatClient):
         self.token_manager = WeChatTokenManager()
         self.fetch_access_token_lock = threading.Lock()
 
+    @property
+    def access_token(self):  # 重载父类属性，统一从共享的token缓存读取
+        return self.token_manager.get_token()
+
     def fetch_access_token(self):
+        """
+        父类仅在token缺失或接口返回40001/40014/42001自动重试时调用，
+        此时作废缓存的token并重新获取，同时写入session供父类的重试请求使用
+        """
         with self.fetch_access_token_lock:
-            return self.token_manager.get_token()
+            self.token_manager.token_cache.invalidate()
+            access_token = self.token_manager.get_token()
+            self.session.set(self.access_token_key, access_token)
+            return access_token
 
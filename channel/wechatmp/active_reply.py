@@ -9,6 +9,7 @@ from bridge.reply import *
 from channel.wechatmp.common import *
 from channel.wechatmp.wechatmp_channel import WechatMPChannel
 from channel.wechatmp.wechatmp_message import WeChatMPMessage
+from common import http_ingress
 from common.log import logger
 from config import conf, subscribe_msg
 
@@ -36,27 +37,17 @@ class Query:
                 logger.debug("[wechatmp] Receive post data:\n" + message.decode("utf-8"))
             msg = parse_message(message)
             if msg.type in ["text", "voice", "image"]:
-                wechatmp_msg = WeChatMPMessage(msg, client=channel.client)
-                from_user = wechatmp_msg.from_user_id
-                content = wechatmp_msg.content
-                message_id = wechatmp_msg.msg_id
-
                 logger.info(
                     "[wechatmp] {}:{} Receive post query {} {}: {}".format(
                         web.ctx.env.get("REMOTE_ADDR"),
                         web.ctx.env.get("REMOTE_PORT"),
-                        from_user,
-                        message_id,
-                        content,
+                        msg.source,
+                        msg.id,
+                        getattr(msg, "content", msg.type),
                     )
                 )
-                if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
-                    context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
-                else:
-                    context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, msg=wechatmp_msg)
-                if context:
-                    channel.produce(context)
-                # The reply will be sent by channel.send() in another thread
+                # 构造消息和上下文在后台完成，立即返回响应，回复由channel.send()在其它线程发送
+                http_ingress.dispatch(self.produce, channel, msg)
                 return "success"
             elif msg.type == "event":
                 logger.info("[wechatmp] Event {} from {}".format(msg.event, msg.source))
@@ -73,3 +64,13 @@ class Query:
         except Exception as exc:
             logger.exception(exc)
             return exc
+
+    def produce(self, channel, msg):
+        wechatmp_msg = WeChatMPMessage(msg, client=channel.client)
+        content = wechatmp_msg.content
+        if msg.type == "voice" and wechatmp_msg.ctype == ContextType.TEXT and conf().get("voice_reply_voice", False):
+            context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, desire_rtype=ReplyType.VOICE, msg=wechatmp_msg)
+        else:
+            context = channel._compose_context(wechatmp_msg.ctype, content, isgroup=False, msg=wechatmp_msg)
+        if context:
+            channel.produce(context)
@@ -0,0 +1,107 @@
+"""
+公众号被动回复模式的会话状态
+微信服务器对同一条消息最多请求3次，每次等待5秒，回复生成好之前请求线程需要等待。
+每个用户一个PassiveUser，处理开始时新建Event，回复生成完(send/回调)时set，等待中的请求立即返回，不再轮询；
+用户状态和请求计数都放在ExpiredDict中，超过有效期未访问的(如用户不再发消息取回的回复)自动淘汰，总数也有上限
+"""
+import threading
+
+from common.expired_dict import ExpiredDict
+
+REQUEST_CNT_TTL = 60  # 微信对同一条消息的重试在15秒内完成
+
+
+class PassiveUser(object):
+    def __init__(self):
+        self.replies = []  # 待发送的回复 (类型, 内容)
+        self.running = False
+        self.done = threading.Event()
+        self.done.set()
+
+
+class PassiveReplyState(object):
+    def __init__(self, ttl=600, max_users=10000):
+        self.lock = threading.Lock()
+        self.users = ExpiredDict(ttl, max_users)
+        self.request_cnt = ExpiredDict(REQUEST_CNT_TTL)
+
+    def _user(self, user_id, create=False):
+        user = self.users.get(user_id)
+        if user is None and create:
+            user = self.users[user_id] = PassiveUser()
+        return user
+
+    def start(self, user_id):
+        """开始处理用户的新消息"""
+        with self.lock:
+            user = self._user(user_id, create=True)
+            user.running = True
+            user.done = threading.Event()
+
+    def finish(self, user_id):
+        """回复已生成(或处理失败)，唤醒等待的请求"""
+        with self.lock:
+            user = self._user(user_id)
+            if user is None:
+                return
+            user.running = False
+            done = user.done
+        done.set()
+
+    def wait(self, user_id, timeout):
+        """等待回复生成，返回是否已处理完"""
+        with self.lock:
+            user = self._user(user_id)
+            if user is None or not user.running:
+                return True
+            done = user.done
+        if timeout <= 0:
+            return done.is_set()
+        return done.wait(timeout)
+
+    def is_running(self, user_id):
+        with self.lock:
+            user = self._user(user_id)
+            return user is not None and user.running
+
+    def is_idle(self, user_id):
+        """没有正在处理的消息，也没有待取的回复"""
+        with self.lock:
+            user = self._user(user_id)
+            return user is None or (not user.running and not user.replies)
+
+    def add_reply(self, user_id, reply_type, content):
+        with self.lock:
+            self._user(user_id, create=True).replies.append((reply_type, content))
+
+    def pop_reply(self, user_id):
+        """取出最早的一条回复，没有时返回None"""
+        with self.lock:
+            user = self._user(user_id)
+            if user is None or not user.replies:
+                return None
+            reply = user.replies.pop(0)
+            if not user.replies and not user.running:
+                del self.users[user_id]
+            return reply
+
+    def has_replies(self, user_id):
+        with self.lock:
+            user = self._user(user_id)
+            return user is not None and bool(user.replies)
+
+    def count_request(self, message_id):
+        """记录微信服务器对同一条消息的请求次数，返回这是第几次"""
+        with self.lock:
+            cnt = self.request_cnt.get(message_id, 0) + 1
+            self.request_cnt[message_id] = cnt
+            return cnt
+
+    def has_request(self, message_id):
+        return message_id in self.request_cnt
+
+    def clear_request(self, message_id):
+        self.request_cnt.pop(message_id, None)
+
+    def stats(self):
+        return {"users": len(self.users), "requests": len(self.request_cnt)}
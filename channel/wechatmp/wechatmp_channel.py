@@ -6,29 +6,26 @@ import os
 import threading
 import time
 
-import requests
-import web
 from wechatpy.crypto import WeChatCrypto
 from wechatpy.exceptions import WeChatClientException
-from collections import defaultdict
 
 from bridge.context import *
 from bridge.reply import *
 from channel.chat_channel import ChatChannel
 from channel.wechatmp.common import *
+from channel.wechatmp.passive_state import PassiveReplyState
 from channel.wechatmp.wechatmp_client import WechatMPClient
 from common.log import logger
 from common.singleton import singleton
 from common.utils import split_string_by_utf8_length
+from common import http_client
+from common import http_ingress
+from common import media_fetcher
 from config import conf
 from voice.audio_convert import any_to_mp3, split_audio
+from voice.tts_cache import cached_convert
 
-# If using SSL, uncomment the following lines, and modify the certificate path.
-# from cheroot.server import HTTPServer
-# from cheroot.ssl.builtin import BuiltinSSLAdapter
-# HTTPServer.ssl_adapter = BuiltinSSLAdapter(
-#         certificate='/ssl/cert.pem',
-#         private_key='/ssl/cert.key')
+# If using SSL, set ingress_ssl_cert and ingress_ssl_key in config.json
 
 
 @singleton
@@ -46,12 +43,9 @@ class WechatMPChannel(ChatChannel):
         if aes_key:
             self.crypto = WeChatCrypto(token, aes_key, appid)
         if self.passive_reply:
-            # Cache the reply to the user's first message
-            self.cache_dict = defaultdict(list)
-            # Record whether the current message is being processed
-            self.running = set()
-            # Count the request from wechat official server by message_id
-            self.request_cnt = dict()
+            # 每个用户待发送的回复、是否正在处理，以及微信服务器对每条消息的请求次数，超时未访问的自动淘汰
+            self.passive_state = PassiveReplyState(conf().get("wechatmp_state_ttl", 600),
+                                                   conf().get("wechatmp_state_max_users", 10000))
             # The permanent media need to be deleted to avoid media number limit
             self.delete_media_loop = asyncio.new_event_loop()
             t = threading.Thread(target=self.start_loop, args=(self.delete_media_loop,))
@@ -63,9 +57,7 @@ class WechatMPChannel(ChatChannel):
             urls = ("/wx", "channel.wechatmp.passive_reply.Query")
         else:
             urls = ("/wx", "channel.wechatmp.active_reply.Query")
-        app = web.application(urls, globals(), autoreload=False)
-        port = conf().get("wechatmp_port", 8080)
-        web.httpserver.runsimple(app.wsgifunc(), ("0.0.0.0", port))
+        http_ingress.serve(conf().get("wechatmp_port", 8080), urls, globals())
 
     def start_loop(self, loop):
         asyncio.set_event_loop(loop)
@@ -83,7 +75,7 @@ class WechatMPChannel(ChatChannel):
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
                 reply_text = reply.content
                 logger.info("[wechatmp] text cached, receiver {}\n{}".format(receiver, reply_text))
-                self.cache_dict[receiver].append(("text", reply_text))
+                self.passive_state.add_reply(receiver, "text", reply_text)
             elif reply.type == ReplyType.VOICE:
                 voice_file_path = reply.content
                 duration, files = split_audio(voice_file_path, 60 * 1000)
@@ -104,15 +96,11 @@ class WechatMPChannel(ChatChannel):
                         return
                     media_id = response["media_id"]
                     logger.info("[wechatmp] voice uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                    self.cache_dict[receiver].append(("voice", media_id))
+                    self.passive_state.add_reply(receiver, "voice", media_id)
 
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
+                image_storage = media_fetcher.fetch_io(img_url, "image")
                 image_type = imghdr.what(image_storage)
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
@@ -124,7 +112,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.passive_state.add_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.IMAGE:  # 从文件读取图片
                 image_storage = reply.content
                 image_storage.seek(0)
@@ -139,14 +127,10 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] image uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("image", media_id))
+                self.passive_state.add_reply(receiver, "image", media_id)
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
+                video_storage = media_fetcher.fetch_io(video_url, "video")
                 video_type = 'mp4'
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
@@ -158,7 +142,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.passive_state.add_reply(receiver, "video", media_id)
 
             elif reply.type == ReplyType.VIDEO:  # 从文件读取视频
                 video_storage = reply.content
@@ -174,7 +158,7 @@ class WechatMPChannel(ChatChannel):
                     return
                 media_id = response["media_id"]
                 logger.info("[wechatmp] video uploaded, receiver {}, media_id {}".format(receiver, media_id))
-                self.cache_dict[receiver].append(("video", media_id))
+                self.passive_state.add_reply(receiver, "video", media_id)
 
         else:
             if reply.type == ReplyType.TEXT or reply.type == ReplyType.INFO or reply.type == ReplyType.ERROR:
@@ -198,7 +182,7 @@ class WechatMPChannel(ChatChannel):
                         file_type = "audio/amr"
                     else:
                         mp3_file = os.path.splitext(file_path)[0] + ".mp3"
-                        any_to_mp3(file_path, mp3_file)
+                        cached_convert(file_path, mp3_file, "mp3", any_to_mp3)
                         file_path = mp3_file
                         file_name = os.path.basename(file_path)
                         file_type = "audio/mpeg"
@@ -228,11 +212,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send voice to {}".format(receiver))
             elif reply.type == ReplyType.IMAGE_URL:  # 从网络下载图片
                 img_url = reply.content
-                pic_res = requests.get(img_url, stream=True)
-                image_storage = io.BytesIO()
-                for block in pic_res.iter_content(1024):
-                    image_storage.write(block)
-                image_storage.seek(0)
+                image_storage = media_fetcher.fetch_io(img_url, "image")
                 image_type = imghdr.what(image_storage)
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + image_type
                 content_type = "image/" + image_type
@@ -260,11 +240,7 @@ class WechatMPChannel(ChatChannel):
                 logger.info("[wechatmp] Do send image to {}".format(receiver))
             elif reply.type == ReplyType.VIDEO_URL:  # 从网络下载视频
                 video_url = reply.content
-                video_res = requests.get(video_url, stream=True)
-                video_storage = io.BytesIO()
-                for block in video_res.iter_content(1024):
-                    video_storage.write(block)
-                video_storage.seek(0)
+                video_storage = media_fetcher.fetch_io(video_url, "video")
                 video_type = 'mp4'
                 filename = receiver + "-" + str(context["msg"].msg_id) + "." + video_type
                 content_type = "video/" + video_type
@@ -295,10 +271,9 @@ class WechatMPChannel(ChatChannel):
     def _success_callback(self, session_id, context, **kwargs):  # 线程异常结束时的回调函数
         logger.debug("[wechatmp] Success to generate reply, msgId={}".format(context["msg"].msg_id))
         if self.passive_reply:
-            self.running.remove(session_id)
+            self.passive_state.finish(session_id)
 
     def _fail_callback(self, session_id, exception, context, **kwargs):  # 线程异常结束时的回调函数
         logger.exception("[wechatmp] Fail to generate reply to user, msgId={}, exception={}".format(context["msg"].msg_id, exception))
         if self.passive_reply:
-            assert session_id not in self.cache_dict
-            self.running.remove(session_id)
+            self.passive_state.finish(session_id)
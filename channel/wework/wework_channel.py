@@ -5,7 +5,6 @@ import tempfile
 import threading
 os.environ['ntwork_LOG'] = "ERROR"
 import ntwork
-import requests
 import uuid
 
 from bridge.context import *
@@ -16,7 +15,10 @@ from channel.wework.wework_message import WeworkMessage
 from common.singleton import singleton
 from common.log import logger
 from common.time_check import time_checker
+from common.tmp_dir import track_tmp
 from common.utils import compress_imgfile, fsize
+from common import http_client
+from common import media_fetcher
 from config import conf
 from channel.wework.run import wework
 from channel.wework import run
@@ -39,10 +41,7 @@ def download_and_compress_image(url, filename, quality=30):
         os.makedirs(directory)
 
     # 下载图片
-    pic_res = requests.get(url, stream=True)
-    image_storage = io.BytesIO()
-    for block in pic_res.iter_content(1024):
-        image_storage.write(block)
+    image_storage = media_fetcher.fetch_io(url, "image")
 
     # 检查图片大小并可能进行压缩
     sz = fsize(image_storage)
@@ -56,7 +55,7 @@ def download_and_compress_image(url, filename, quality=30):
 
     # 读取并保存图片
     image = Image.open(image_storage)
-    image_path = os.path.join(directory, f"{filename}.png")
+    image_path = track_tmp(os.path.join(directory, f"{filename}.png"))
     image.save(image_path, "png")
 
     return image_path
@@ -69,23 +68,13 @@ def download_video(url, filename):
     if not os.path.exists(directory):
         os.makedirs(directory)
 
-    # 下载视频
-    response = requests.get(url, stream=True)
-    total_size = 0
-
-    video_path = os.path.join(directory, f"{filename}.mp4")
-
-    with open(video_path, 'wb') as f:
-        for block in response.iter_content(1024):
-            total_size += len(block)
-
-            # 如果视频的总大小超过30MB (30 * 1024 * 1024 bytes)，则停止下载并返回
-            if total_size > 30 * 1024 * 1024:
-                logger.info("[WX] Video is larger than 30MB, skipping...")
-                return None
-
-            f.write(block)
-
+    # 下载视频，超过media_max_size中video的大小(默认30MB)时跳过
+    video_path = track_tmp(os.path.join(directory, f"{filename}.mp4"))
+    try:
+        media_fetcher.fetch_to_file(url, video_path, "video")
+    except media_fetcher.MediaTooLarge as e:
+        logger.info("[WX] Video is too large, skipping... {}".format(e))
+        return None
     return video_path
 
 
@@ -319,8 +308,6 @@ class WeworkChannel(ChatChannel):
                 wework.send_video(receiver, video_path)
             logger.info("[WX] sendVideo, receiver={}".format(receiver))
         elif reply.type == ReplyType.VOICE:
-            current_dir = os.getcwd()
-            voice_file = reply.content.split("/")[-1]
-            reply.content = os.path.join(current_dir, "tmp", voice_file)
+            reply.content = os.path.abspath(reply.content)
             wework.send_file(receiver, reply.content)
             logger.info("[WX] sendFile={}, receiver={}".format(reply.content, receiver))
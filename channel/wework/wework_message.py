@@ -3,6 +3,7 @@ import json
 import os
 import re
 import time
+import uuid
 import pilk
 
 from bridge.context import ContextType
@@ -118,7 +119,7 @@ class WeworkMessage(ChatMessage):
                 self.ctype = ContextType.TEXT
                 self.content = wework_msg['data']['content']
             elif wework_msg["type"] == 11044:  # 语音消息类型，需要缓存文件
-                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + ".silk"
+                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + "-" + uuid.uuid4().hex[:8] + ".silk"
                 base_name, _ = os.path.splitext(file_name)
                 file_name_2 = base_name + ".wav"
                 current_dir = os.getcwd()
@@ -126,7 +127,7 @@ class WeworkMessage(ChatMessage):
                 self.content = os.path.join(current_dir, "tmp", file_name_2)
                 self._prepare_fn = lambda: c2c_download_and_convert(wework, wework_msg, file_name)
             elif wework_msg["type"] == 11042:  # 图片消息类型，需要下载文件
-                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + ".jpg"
+                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + "-" + uuid.uuid4().hex[:8] + ".jpg"
                 current_dir = os.getcwd()
                 self.ctype = ContextType.IMAGE
                 self.content = os.path.join(current_dir, "tmp", file_name)
@@ -134,7 +135,7 @@ class WeworkMessage(ChatMessage):
             elif wework_msg["type"] == 11045:  # 文件消息
                 print("文件消息")
                 print(wework_msg)
-                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+                file_name = datetime.datetime.now().strftime('%Y%m%d%H%M%S') + "-" + uuid.uuid4().hex[:8] + "-"
                 file_name = file_name + wework_msg['data']['cdn']['file_name']
                 current_dir = os.getcwd()
                 self.ctype = ContextType.FILE
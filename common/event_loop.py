@@ -0,0 +1,65 @@
+"""
+asyncio消息处理模式使用的事件循环
+所有协程运行在同一个后台线程的事件循环中，同步的bot、插件和通道发送通过run_sync转交给线程池执行
+"""
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import Future
+
+from common.handler_pool import handler_pools
+from common.log import logger
+
+# 当前消息使用的线程池，run_sync未指定executor时使用，由ChatChannel在处理每条消息前设置
+current_executor = contextvars.ContextVar("current_executor", default=None)
+
+
+class EventLoopThread:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        thread = threading.Thread(target=self._run, name="event_loop", daemon=True)
+        thread.start()
+        self.ready.wait()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> Future:
+        """在事件循环中运行协程，返回concurrent.futures.Future，可以像线程池任务一样取消和添加回调"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+_event_loop = None
+_lock = threading.Lock()
+
+
+def get_event_loop() -> EventLoopThread:
+    global _event_loop
+    if _event_loop is None:
+        with _lock:
+            if _event_loop is None:
+                _event_loop = EventLoopThread()
+                logger.info("[EventLoop] asyncio event loop started")
+    return _event_loop
+
+
+def submit(coro) -> Future:
+    return get_event_loop().submit(coro)
+
+
+async def run_sync(fn, *args, executor=None, **kwargs):
+    """
+    在线程池中执行同步函数并等待结果，不阻塞事件循环
+    函数在当前协程的contextvars上下文中执行，可以读到消息级的状态(如临时文件作用域)
+    """
+    if executor is None:
+        executor = current_executor.get()
+    if executor is None:
+        executor = handler_pools.select("text")
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(executor, functools.partial(ctx.run, fn, *args, **kwargs))
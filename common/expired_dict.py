@@ -1,22 +1,47 @@
-from datetime import datetime, timedelta
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 
-class ExpiredDict(dict):
-    def __init__(self, expires_in_seconds):
-        super().__init__()
+class ExpiredDict:
+    """
+    带过期时间的字典，用法与dict一致
+    每次读写都会把key的过期时间刷新为expires_in_seconds秒之后，并把key移到队尾；所有key的有效期相同，
+    因此队首的key总是最先过期，淘汰时只需从队首弹出，单次操作为O(1)均摊
+    读写时顺带淘汰队首已过期的key，另有后台线程定期清理不再被访问的字典；
+    设置max_size时超出容量按LRU淘汰最久未访问的key
+    """
+
+    def __init__(self, expires_in_seconds, max_size=None):
         self.expires_in_seconds = expires_in_seconds if expires_in_seconds else 3600
+        self.max_size = max_size
+        self._data = OrderedDict()  # key -> (value, 过期时间)
+        self._lock = threading.RLock()
+        _sweeper.register(self)
 
     def __getitem__(self, key):
-        value, expiry_time = super().__getitem__(key)
-        if datetime.now() > expiry_time:
-            del self[key]
-            raise KeyError("expired {}".format(key))
-        self.__setitem__(key, value)
-        return value
+        with self._lock:
+            now = time.monotonic()
+            value, expiry_time = self._data[key]
+            if now > expiry_time:
+                del self._data[key]
+                raise KeyError("expired {}".format(key))
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            self._evict(now)
+            return value
 
     def __setitem__(self, key, value):
-        expiry_time = datetime.now() + timedelta(seconds=self.expires_in_seconds)
-        super().__setitem__(key, (value, expiry_time))
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (value, now + self.expires_in_seconds)
+            self._data.move_to_end(key)
+            self._evict(now)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
 
     def get(self, key, default=None):
         try:
@@ -24,6 +49,21 @@ class ExpiredDict(dict):
         except KeyError:
             return default
 
+    def pop(self, key, *default):
+        with self._lock:
+            if key in self:
+                return self._data.pop(key)[0]
+            if default:
+                return default[0]
+            raise KeyError(key)
+
+    def setdefault(self, key, default=None):
+        with self._lock:
+            if key in self:
+                return self[key]
+            self[key] = default
+            return default
+
     def __contains__(self, key):
         try:
             self[key]
@@ -31,12 +71,84 @@ class ExpiredDict(dict):
         except KeyError:
             return False
 
+    def __len__(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return len(self._data)
+
     def keys(self):
-        keys = list(super().keys())
-        return [key for key in keys if key in self]
+        with self._lock:
+            self._evict(time.monotonic())
+            return list(self._data.keys())
+
+    def values(self):
+        with self._lock:
+            self._evict(time.monotonic())
+            return [value for value, _ in self._data.values()]
 
     def items(self):
-        return [(key, self[key]) for key in self.keys()]
+        with self._lock:
+            self._evict(time.monotonic())
+            return [(key, value) for key, (value, _) in self._data.items()]
 
     def __iter__(self):
-        return self.keys().__iter__()
+        return iter(self.keys())
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def expire(self):
+        """淘汰所有已过期的key，返回淘汰数量"""
+        with self._lock:
+            return self._evict(time.monotonic())
+
+    # 需在持有self._lock时调用
+    def _evict(self, now):
+        data = self._data
+        evicted = 0
+        while data:
+            key = next(iter(data))
+            if data[key][1] >= now:
+                break
+            del data[key]
+            evicted += 1
+        if self.max_size:
+            while len(data) > self.max_size:
+                data.popitem(last=False)
+                evicted += 1
+        return evicted
+
+    def __repr__(self):
+        return "ExpiredDict({})".format(dict(self.items()))
+
+
+class _Sweeper:
+    """
+    定期清理所有ExpiredDict中的过期key，只持有弱引用，字典被回收后自动移除
+    """
+
+    def __init__(self, interval=60):
+        self.interval = interval
+        self.dicts = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, expired_dict):
+        with self.lock:
+            self.dicts.add(expired_dict)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="expired_dict_sweeper", daemon=True)
+                self.thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self.lock:
+                dicts = list(self.dicts)
+            for d in dicts:
+                d.expire()
+            del dicts
+
+
+_sweeper = _Sweeper()
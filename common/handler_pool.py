@@ -0,0 +1,199 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+from common.log import logger
+from config import conf
+
+
+class HandlerPool:
+    """
+    可伸缩的消息处理线程池
+    排队任务多于空闲线程时扩容(不超过max_workers)，线程空闲超过idle_timeout秒后退出(保留min_workers个)
+    """
+
+    def __init__(self, name, max_workers, min_workers=0, idle_timeout=60, initializer=None):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.min_workers = max(0, min(int(min_workers), self.max_workers))
+        self.idle_timeout = idle_timeout
+        self.initializer = initializer
+        self.cond = threading.Condition()
+        self.queue = deque()  # (future, fn, args, kwargs, 入队时间)
+        self.workers = 0  # 当前线程数
+        self.idle = 0  # 空闲线程数
+        self.is_running = True
+        # 统计数据
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.run_time_total = 0.0
+        self.run_time_max = 0.0
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        with self.cond:
+            if not self.is_running:
+                raise RuntimeError("handler pool {} is shutdown".format(self.name))
+            self.queue.append((future, fn, args, kwargs, time.monotonic()))
+            self.submitted += 1
+            if self.idle < len(self.queue) and self.workers < self.max_workers:
+                self._spawn_worker()
+            self.cond.notify()
+        return future
+
+    def resize(self, max_workers, min_workers=None):
+        with self.cond:
+            self.max_workers = max(1, int(max_workers))
+            if min_workers is not None:
+                self.min_workers = max(0, min(int(min_workers), self.max_workers))
+            # 缩容由空闲线程超时退出完成，这里只需按新的上限补充线程
+            while self.idle < len(self.queue) and self.workers < self.max_workers:
+                self._spawn_worker()
+            self.cond.notify_all()
+
+    def shutdown(self):
+        with self.cond:
+            self.is_running = False
+            self.cond.notify_all()
+
+    # 需在持有self.cond时调用
+    def _spawn_worker(self):
+        self.workers += 1
+        self.idle += 1
+        thread = threading.Thread(target=self._worker, name="{}_{}".format(self.name, self.workers), daemon=True)
+        thread.start()
+
+    def _worker(self):
+        if self.initializer:
+            try:
+                self.initializer()
+            except Exception as e:
+                logger.exception("[HandlerPool] {} initializer error: {}".format(self.name, e))
+        while True:
+            with self.cond:
+                while not self.queue:
+                    timeout = not self.cond.wait(self.idle_timeout)
+                    if not self.is_running or (self.workers > self.max_workers) or (
+                            timeout and not self.queue and self.workers > self.min_workers):
+                        self.workers -= 1
+                        self.idle -= 1
+                        return
+                future, fn, args, kwargs, enqueue_time = self.queue.popleft()
+                self.idle -= 1
+            self._run(future, fn, args, kwargs, enqueue_time)
+            with self.cond:
+                self.idle += 1
+
+    def _run(self, future: Future, fn, args, kwargs, enqueue_time):
+        if not future.set_running_or_notify_cancel():
+            with self.cond:
+                self.cancelled += 1
+            return
+        start = time.monotonic()
+        wait_time = start - enqueue_time
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            failed = True
+        else:
+            future.set_result(result)
+            failed = False
+        run_time = time.monotonic() - start
+        with self.cond:
+            self.completed += 1
+            if failed:
+                self.failed += 1
+            self.wait_time_total += wait_time
+            self.wait_time_max = max(self.wait_time_max, wait_time)
+            self.run_time_total += run_time
+            self.run_time_max = max(self.run_time_max, run_time)
+
+    def stats(self) -> dict:
+        with self.cond:
+            completed = self.completed or 1
+            return {
+                "name": self.name,
+                "workers": self.workers,
+                "busy": self.workers - self.idle,
+                "max_workers": self.max_workers,
+                "queue_depth": len(self.queue),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "wait_avg": self.wait_time_total / completed,
+                "wait_max": self.wait_time_max,
+                "run_avg": self.run_time_total / completed,
+                "run_max": self.run_time_max,
+            }
+
+
+class HandlerPoolGroup:
+    """
+    按预算拆分的线程池集合，避免单个慢后端占满所有线程
+    handler_pool_budgets中的key可以是 "回复类别"、"bot类型"、"bot类型:回复类别" 或 "通道类型"，value为该池的最大线程数，
+    回复类别为 admin(#管理指令)、text、voice、image，未匹配到预算的任务进入default池
+    管理指令总是使用独立的admin池(容量为budgets["admin"]或handler_pool_admin_workers)，不会排在慢后端的请求后面
+    """
+
+    DEFAULT = "default"
+
+    def __init__(self):
+        self.pools = {}
+        self.lock = threading.Lock()
+        self.initializer = None
+
+    def set_initializer(self, initializer):
+        """设置新建线程的初始化函数，只对之后新建的线程生效"""
+        with self.lock:
+            self.initializer = initializer
+            for pool in self.pools.values():
+                pool.initializer = initializer
+
+    def select(self, reply_class, bot_type=None, channel_type=None) -> HandlerPool:
+        budgets = conf().get("handler_pool_budgets", {}) or {}
+        if reply_class == "admin":
+            return self.get("admin", budgets.get("admin") or conf().get("handler_pool_admin_workers", 2))
+        candidates = []
+        if bot_type:
+            candidates.append("{}:{}".format(bot_type, reply_class))
+        candidates.append(reply_class)
+        if bot_type:
+            candidates.append(bot_type)
+        if channel_type:
+            candidates.append(channel_type)
+        for name in candidates:
+            if name in budgets:
+                return self.get(name, budgets[name])
+        return self.get(self.DEFAULT, conf().get("handler_pool_max_workers", 8))
+
+    def get(self, name, max_workers) -> HandlerPool:
+        with self.lock:
+            pool = self.pools.get(name)
+            if pool is None:
+                pool = HandlerPool(
+                    "handler_pool_{}".format(name),
+                    max_workers,
+                    min_workers=conf().get("handler_pool_min_workers", 1),
+                    idle_timeout=conf().get("handler_pool_idle_timeout", 60),
+                    initializer=self.initializer,
+                )
+                self.pools[name] = pool
+                logger.info("[HandlerPool] create pool {}, max_workers={}".format(name, max_workers))
+            elif pool.max_workers != max_workers:  # 配置重载后调整容量
+                pool.resize(max_workers)
+            return pool
+
+    def stats(self) -> list:
+        with self.lock:
+            pools = list(self.pools.values())
+        return [pool.stats() for pool in pools]
+
+
+handler_pools = HandlerPoolGroup()  # 所有通道共享的消息处理线程池
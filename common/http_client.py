@@ -0,0 +1,104 @@
+"""
+共享HTTP客户端
+所有bot、插件和通道的HTTP请求都通过这里发出，按host复用keep-alive连接池，统一默认超时和重试策略，
+用法与requests模块一致: http_client.post(url, json=body, headers=headers)
+"""
+import threading
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common import tracing
+from common.log import logger
+from config import conf
+
+
+class HttpClient:
+    def __init__(self, pool_connections=20, pool_maxsize=32, max_retries=2, backoff_factor=0.5,
+                 connect_timeout=5, read_timeout=180):
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        # 不同服务共用一个Session，禁止cookie在请求之间串用
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        # 只对连接失败以及幂等请求的网关错误重试，避免LLM的POST请求被重复提交
+        retry = Retry(total=max_retries, connect=max_retries, read=0, backoff_factor=backoff_factor,
+                      status_forcelist=[502, 503, 504], raise_on_status=False)
+        self.adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+    def request(self, method, url, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        parts = urlsplit(url)
+        # 查询参数中可能有access_token，只记录host和path
+        with tracing.span("http", method=method, host=parts.netloc, path=parts.path) as span:
+            response = self.session.request(method, url, **kwargs)
+            span.set(status=response.status_code)
+        return response
+
+    def get(self, url, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        每个host连接池的请求数(num_requests)和新建连接数(num_connections)，两者之差即复用已有连接的次数
+        """
+        hosts = {}
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = "{}://{}:{}".format(pool.scheme, pool.host, pool.port)
+            requests_cnt = getattr(pool, "num_requests", 0)
+            misses = getattr(pool, "num_connections", 0)
+            hosts[host] = {"requests": requests_cnt, "hits": max(requests_cnt - misses, 0), "misses": misses}
+        return {
+            "requests": sum(h["requests"] for h in hosts.values()),
+            "hits": sum(h["hits"] for h in hosts.values()),
+            "misses": sum(h["misses"] for h in hosts.values()),
+            "hosts": hosts,
+        }
+
+
+_client = None
+_lock = threading.Lock()
+
+
+def get_client() -> HttpClient:
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                _client = HttpClient(
+                    pool_connections=conf().get("http_pool_connections", 20),
+                    pool_maxsize=conf().get("http_pool_maxsize", 32),
+                    max_retries=conf().get("http_max_retries", 2),
+                    backoff_factor=conf().get("http_backoff_factor", 0.5),
+                    connect_timeout=conf().get("http_connect_timeout", 5),
+                    read_timeout=conf().get("request_timeout", 180),
+                )
+                logger.info("[HttpClient] shared http client created")
+    return _client
+
+
+def request(method, url, **kwargs) -> requests.Response:
+    return get_client().request(method, url, **kwargs)
+
+
+def get(url, **kwargs) -> requests.Response:
+    return get_client().get(url, **kwargs)
+
+
+def post(url, **kwargs) -> requests.Response:
+    return get_client().post(url, **kwargs)
+
+
+def stats() -> dict:
+    return get_client().stats()
@@ -0,0 +1,153 @@
+"""
+Webhook通道的HTTP入口
+公众号、企业微信、企业微信客服和飞书都通过回调接收消息，原来各自用web.py的runsimple启动(开发用的服务器，固定10个线程)。
+这里统一使用cheroot的多线程WSGI服务器：
+- 通道调用 serve(port, urls, fvars) 挂载web.py路由，同一端口上的多个通道共用一个服务器
+- 工作线程数、排队连接数、请求体大小上限、keep-alive超时可以配置，空闲的keep-alive连接不占用工作线程
+- 回调在请求线程中只做签名校验和解密，解析消息、构造上下文、调用平台接口等交给 dispatch 在后台线程池中完成，
+  尽快返回响应，避免平台等待超时后重试
+"""
+import re
+import threading
+import time
+from collections import Counter
+
+import web
+from cheroot import wsgi
+
+from common.handler_pool import handler_pools
+from common.log import logger
+from config import conf
+
+
+class IngressServer(object):
+    """一个端口上的WSGI服务器，按路径把请求分发给挂载的web.py应用"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.lock = threading.Lock()
+        self.apps = []  # (路径正则列表, wsgi函数)
+        self.server = None
+        self.thread = None
+        self.stats = Counter()
+
+    def mount(self, urls, fvars):
+        """urls与web.application相同: (路径, 处理类, 路径, 处理类, ...)"""
+        app = web.application(urls, fvars, autoreload=False)
+        patterns = [re.compile(r"^(?:{})\Z".format(urls[i])) for i in range(0, len(urls), 2)]
+        with self.lock:
+            self.apps.append((patterns, app.wsgifunc()))
+        logger.info("[Ingress] mount {} on port {}".format(", ".join(urls[::2]), self.port))
+
+    def __call__(self, environ, start_response):
+        path = environ.get("PATH_INFO") or "/"
+        with self.lock:
+            apps = list(self.apps)
+        for patterns, func in apps:
+            if any(pattern.match(path) for pattern in patterns):
+                start = time.time()
+                try:
+                    return func(environ, start_response)
+                finally:
+                    cost = time.time() - start
+                    with self.lock:
+                        self.stats["requests"] += 1
+                        self.stats["request_seconds"] += cost
+                    if cost > 3:
+                        logger.warning("[Ingress] slow request {} {}, cost={:.2f}s".format(environ.get("REQUEST_METHOD"), path, cost))
+        with self.lock:
+            self.stats["not_found"] += 1
+        start_response("404 Not Found", [("Content-Type", "text/plain")])
+        return [b"not found"]
+
+    def start(self):
+        """在后台线程中启动，端口被占用等错误在调用线程中抛出"""
+        server = wsgi.Server(
+            (self.host, self.port),
+            self,
+            numthreads=conf().get("ingress_workers", 32),
+            server_name="ingress",
+            request_queue_size=conf().get("ingress_request_queue_size", 128),
+            timeout=conf().get("ingress_keepalive_timeout", 15),
+        )
+        server.nodelay = True
+        server.max_request_body_size = int(conf().get("ingress_max_body_size", 10) * 1024 * 1024)
+        cert, key = conf().get("ingress_ssl_cert"), conf().get("ingress_ssl_key")
+        if cert and key:
+            from cheroot.ssl.builtin import BuiltinSSLAdapter
+
+            server.ssl_adapter = BuiltinSSLAdapter(certificate=cert, private_key=key)
+        server.prepare()
+        self.server = server
+        self.thread = threading.Thread(target=server.serve, name="ingress_{}".format(self.port), daemon=True)
+        self.thread.start()
+        logger.info("[Ingress] listening on {}://{}:{}, workers={}".format(
+            "https" if server.ssl_adapter else "http", self.host, self.port, server.requests.min))
+
+    def stop(self):
+        if self.server:
+            self.server.stop()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["paths"] = [pattern.pattern for patterns, _ in self.apps for pattern in patterns]
+        stats["port"] = self.port
+        if self.server:
+            stats["workers"] = self.server.requests.min
+            stats["idle_workers"] = self.server.requests.idle
+        return stats
+
+
+_servers = {}  # port -> IngressServer
+_lock = threading.Lock()
+
+
+def mount(port, urls, fvars) -> IngressServer:
+    """挂载路由，端口上还没有服务器时启动一个"""
+    with _lock:
+        server = _servers.get(port)
+        if server is not None:
+            server.mount(urls, fvars)
+            return server
+        server = IngressServer(conf().get("ingress_host", "0.0.0.0"), port)
+        server.mount(urls, fvars)
+        server.start()
+        _servers[port] = server
+    return server
+
+
+def serve(port, urls, fvars):
+    """挂载路由并阻塞，用于通道的startup"""
+    server = mount(port, urls, fvars)
+    server.thread.join()
+
+
+def dispatch(func, *args, **kwargs):
+    """
+    在ingress线程池中执行回调的后续处理，请求线程可以立即返回。
+    func中不能再使用web.input()、web.data()等请求相关的数据，需要的值在请求线程中取出后作为参数传入
+    """
+
+    def run():
+        try:
+            func(*args, **kwargs)
+        except Exception as e:
+            logger.exception("[Ingress] dispatch {} failed: {}".format(getattr(func, "__name__", func), e))
+
+    return handler_pools.get("ingress", conf().get("ingress_dispatch_workers", 8)).submit(run)
+
+
+def stats() -> list:
+    with _lock:
+        servers = list(_servers.values())
+    return [server.get_stats() for server in servers]
+
+
+def shutdown():
+    with _lock:
+        servers = list(_servers.values())
+        _servers.clear()
+    for server in servers:
+        server.stop()
@@ -2,7 +2,7 @@ from bridge.context import Context, ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from linkai import LinkAIClient, PushMsg
-from config import conf, pconf, plugin_config, available_setting
+from config import conf, pconf, plugin_config, available_setting, update_config
 from plugins import PluginManager
 import time
 
@@ -33,7 +33,8 @@ class ChatClient(LinkAIClient):
         if config.get("enabled") != "Y":
             return
 
-        local_config = conf()
+        # 先收集所有修改，再一次性发布新配置
+        local_config = {}
         for key in config.keys():
             if key in available_setting and config.get(key) is not None:
                 local_config[key] = config.get(key)
@@ -44,6 +45,7 @@ class ChatClient(LinkAIClient):
                 local_config["voice_reply_voice"] = True
             elif reply_voice_mode == "always_reply_voice":
                 local_config["always_reply_voice"] = True
+        update_config(local_config)
 
         if config.get("admin_password"):
             if not plugin_config.get("Godcmd"):
@@ -1,6 +1,17 @@
+import contextvars
 import logging
 import sys
 
+# 当前处理的消息的trace_id，由tracing.use设置，日志行中显示为[trace_id]
+log_trace_id = contextvars.ContextVar("log_trace_id", default=None)
+
+
+class _TraceFilter(logging.Filter):
+    def filter(self, record):
+        trace_id = log_trace_id.get()
+        record.trace = "[{}]".format(trace_id) if trace_id else ""
+        return True
+
 
 def _reset_logger(log):
     for handler in log.handlers:
@@ -8,18 +19,20 @@ def _reset_logger(log):
         log.removeHandler(handler)
         del handler
     log.handlers.clear()
+    log.filters.clear()
+    log.addFilter(_TraceFilter())
     log.propagate = False
     console_handle = logging.StreamHandler(sys.stdout)
     console_handle.setFormatter(
         logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
+            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d]%(trace)s - %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
     )
     file_handle = logging.FileHandler("run.log", encoding="utf-8")
     file_handle.setFormatter(
         logging.Formatter(
-            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d] - %(message)s",
+            "[%(levelname)s][%(asctime)s][%(filename)s:%(lineno)d]%(trace)s - %(message)s",
             datefmt="%Y-%m-%d %H:%M:%S",
         )
     )
@@ -0,0 +1,204 @@
+"""
+媒体下载
+通道发送图片、视频链接时都要先下载到内存再上传，这里统一处理：
+- 按媒体类型限制大小(media_max_size)，先看Content-Length，再按实际读取的字节数截断
+- 统一的超时和64KB的读取块，请求通过共享的http_client发出
+- 同一URL的并发下载只请求一次，其它线程等待结果(single-flight)
+- 下载结果按URL缓存，内容按sha256去重，缓存总大小和有效期有上限，同一张图发到多个群只下载一次
+用法: image_storage = media_fetcher.fetch_io(img_url, "image")
+"""
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from common import http_client, tracing
+from common.log import logger
+from config import conf
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_MAX_SIZES = {"image": 20, "video": 30, "voice": 10, "file": 50}  # MB
+
+
+class MediaTooLarge(Exception):
+    pass
+
+
+class MediaFetcher(object):
+    def __init__(self, max_sizes=None, timeout=(5, 60), cache_bytes=64 * 1024 * 1024, cache_ttl=600):
+        self.max_sizes = dict(DEFAULT_MAX_SIZES)
+        self.max_sizes.update(max_sizes or {})
+        self.timeout = timeout
+        self.cache_bytes = cache_bytes
+        self.cache_ttl = cache_ttl
+        self.lock = threading.Lock()
+        self.inflight = {}  # url -> Future
+        self.urls = OrderedDict()  # url -> (digest, 过期时间)，按最近使用排序
+        self.blobs = {}  # digest -> [内容, 引用的url数]
+        self.total_bytes = 0
+        self.counters = {"requests": 0, "hits": 0, "shared": 0, "downloaded_bytes": 0, "too_large": 0, "errors": 0}
+
+    def max_size(self, media_type):
+        return int(self.max_sizes.get(media_type, self.max_sizes["file"]) * 1024 * 1024)
+
+    def fetch(self, url, media_type="image") -> bytes:
+        """
+        返回媒体内容，超过大小限制时抛出MediaTooLarge，HTTP错误抛出requests的异常
+        """
+        with tracing.span("media.fetch", media_type=media_type) as span:
+            content = self._fetch(url, media_type, span)
+            span.set(size=len(content))
+        return content
+
+    def _fetch(self, url, media_type, span):
+        with self.lock:
+            self.counters["requests"] += 1
+            content = self._cache_get(url)
+            if content is not None:
+                self.counters["hits"] += 1
+                span.set(source="cache")
+                return content
+            future = self.inflight.get(url)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.inflight[url] = future
+            else:
+                self.counters["shared"] += 1
+        if not owner:
+            span.set(source="shared")
+            content = future.result()
+            self._check_size(len(content), self.max_size(media_type), media_type, url)
+            return content
+        try:
+            content = self._download(url, media_type)
+        except BaseException as e:
+            with self.lock:
+                self.inflight.pop(url, None)
+                if isinstance(e, MediaTooLarge):
+                    self.counters["too_large"] += 1
+                else:
+                    self.counters["errors"] += 1
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.inflight.pop(url, None)
+            self.counters["downloaded_bytes"] += len(content)
+            self._cache_put(url, content)
+        future.set_result(content)
+        return content
+
+    def fetch_io(self, url, media_type="image") -> io.BytesIO:
+        """返回从头开始读的BytesIO，每次调用都是新的对象，可以直接交给上传接口"""
+        return io.BytesIO(self.fetch(url, media_type))
+
+    def fetch_to_file(self, url, path, media_type="file"):
+        content = self.fetch(url, media_type)
+        with open(path, "wb") as f:
+            f.write(content)
+        return path
+
+    @staticmethod
+    def _check_size(size, limit, media_type, url):
+        if size > limit:
+            raise MediaTooLarge("{} too large, size={}, limit={}, url={}".format(media_type, size, limit, url))
+
+    def _download(self, url, media_type):
+        limit = self.max_size(media_type)
+        start = time.time()
+        with http_client.get(url, stream=True, timeout=self.timeout) as res:
+            res.raise_for_status()
+            length = res.headers.get("Content-Length")
+            if length and length.isdigit():
+                self._check_size(int(length), limit, media_type, url)
+            buffer = bytearray()
+            for block in res.iter_content(CHUNK_SIZE):
+                buffer += block
+                self._check_size(len(buffer), limit, media_type, url)
+        logger.debug("[MediaFetcher] downloaded {}, size={}, cost={:.2f}s".format(url, len(buffer), time.time() - start))
+        return bytes(buffer)
+
+    def _cache_get(self, url):
+        item = self.urls.get(url)
+        if item is None:
+            return None
+        digest, expire = item
+        if expire < time.monotonic():
+            self._cache_remove(url)
+            return None
+        self.urls.move_to_end(url)
+        return self.blobs[digest][0]
+
+    def _cache_put(self, url, content):
+        if not self.cache_bytes or len(content) > self.cache_bytes:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        if url in self.urls:
+            self._cache_remove(url)
+        blob = self.blobs.get(digest)
+        if blob is None:
+            # 不同URL内容相同时只保存一份
+            blob = self.blobs[digest] = [content, 0]
+            self.total_bytes += len(content)
+        blob[1] += 1
+        self.urls[url] = (digest, time.monotonic() + self.cache_ttl)
+        while self.total_bytes > self.cache_bytes and self.urls:
+            self._cache_remove(next(iter(self.urls)))
+
+    def _cache_remove(self, url):
+        digest, _ = self.urls.pop(url)
+        blob = self.blobs[digest]
+        blob[1] -= 1
+        if blob[1] <= 0:
+            del self.blobs[digest]
+            self.total_bytes -= len(blob[0])
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats["cached_urls"] = len(self.urls)
+            stats["cached_bytes"] = self.total_bytes
+            stats["inflight"] = len(self.inflight)
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.urls.clear()
+            self.blobs.clear()
+            self.total_bytes = 0
+
+
+_fetcher = None
+_lock = threading.Lock()
+
+
+def get_fetcher() -> MediaFetcher:
+    global _fetcher
+    if _fetcher is None:
+        with _lock:
+            if _fetcher is None:
+                _fetcher = MediaFetcher(
+                    max_sizes=conf().get("media_max_size", {}),
+                    timeout=(conf().get("http_connect_timeout", 5), conf().get("media_fetch_timeout", 60)),
+                    cache_bytes=int(conf().get("media_cache_size", 64) * 1024 * 1024),
+                    cache_ttl=conf().get("media_cache_ttl", 600),
+                )
+    return _fetcher
+
+
+def fetch(url, media_type="image") -> bytes:
+    return get_fetcher().fetch(url, media_type)
+
+
+def fetch_io(url, media_type="image") -> io.BytesIO:
+    return get_fetcher().fetch_io(url, media_type)
+
+
+def fetch_to_file(url, path, media_type="file"):
+    return get_fetcher().fetch_to_file(url, path, media_type)
+
+
+def stats() -> dict:
+    return get_fetcher().stats()
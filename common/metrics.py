@@ -0,0 +1,264 @@
+"""
+消息处理链路的指标
+每条消息在context["timeline"]中记录各阶段开始的时间(time.monotonic)，阶段的耗时计入stage_seconds{stage=...}：
+- receive: 通道收到消息到开始构造上下文
+- compose: 构造上下文，包括ON_RECEIVE_MESSAGE插件
+- queue: 在会话队列中等待(同一会话的并发上限)
+- pool: 提交线程池后等待空闲线程
+- generate / decorate / send: 生成回复(插件和bot)、包装回复、发送回复
+收到消息到回复发送完成的总耗时计入message_seconds
+另外按插件和事件统计插件耗时，按bot类型统计bot、语音识别和语音合成的耗时，以及token数、错误数和重试次数。
+只在内存中累加，/metrics 按Prometheus文本格式输出，设置metrics_port后通过http_ingress提供
+"""
+import bisect
+import threading
+import time
+
+from common.log import logger
+from config import conf
+
+PREFIX = "onewebot_"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+HELP = {
+    "stage_seconds": "Time spent in each stage of the message pipeline",
+    "message_seconds": "Time from receiving a message to finishing its reply",
+    "plugin_seconds": "Time spent in plugin event handlers",
+    "bot_seconds": "Time spent in chat, voice-to-text and text-to-voice calls",
+    "messages_total": "Messages handed to the handler pools",
+    "errors_total": "Errors by stage",
+    "retries_total": "Retries of bot requests and reply sending",
+    "tokens_total": "Tokens reported by the bots",
+}
+
+
+class Histogram(object):
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.sum = 0.0
+        self.count = 0
+
+
+class MetricsRegistry(object):
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: Histogram}
+        self.collectors = []
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram(len(self.buckets) + 1)
+            histogram.counts[index] += 1
+            histogram.sum += seconds
+            histogram.count += 1
+
+    def register_collector(self, func):
+        """func() 返回 (指标名, 类型, 标签dict, 值) 的列表，在输出时调用"""
+        self.collectors.append(func)
+
+    def render(self) -> str:
+        lines = []
+        with self.lock:
+            counters = {name: dict(series) for name, series in self.counters.items()}
+            histograms = {
+                name: {key: (list(h.counts), h.sum, h.count) for key, h in series.items()}
+                for name, series in self.histograms.items()
+            }
+        for name in sorted(counters):
+            _header(lines, name, "counter")
+            for key, value in sorted(counters[name].items()):
+                lines.append("{}{}{} {}".format(PREFIX, name, _labels(key), _number(value)))
+        for name in sorted(histograms):
+            _header(lines, name, "histogram")
+            for key, (counts, total, count) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append("{}{}_bucket{} {}".format(PREFIX, name, _labels(key + (("le", _number(bound)),)), cumulative))
+                lines.append("{}{}_bucket{} {}".format(PREFIX, name, _labels(key + (("le", "+Inf"),)), count))
+                lines.append("{}{}_sum{} {}".format(PREFIX, name, _labels(key), _number(total)))
+                lines.append("{}{}_count{} {}".format(PREFIX, name, _labels(key), count))
+        seen = set()
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.debug("[Metrics] collector {} failed: {}".format(getattr(collector, "__name__", collector), e))
+                continue
+            for name, metric_type, labels, value in samples:
+                if name not in seen:
+                    seen.add(name)
+                    lines.append("# TYPE {}{} {}".format(PREFIX, name, metric_type))
+                lines.append("{}{}{} {}".format(PREFIX, name, _labels(tuple(sorted(labels.items()))), _number(value)))
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+
+def _header(lines, name, metric_type):
+    if name in HELP:
+        lines.append("# HELP {}{} {}".format(PREFIX, name, HELP[name]))
+    lines.append("# TYPE {}{} {}".format(PREFIX, name, metric_type))
+
+
+def _labels(key):
+    if not key:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for k, v in key) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+registry = MetricsRegistry()
+
+
+def enabled():
+    return conf().get("metrics", True)
+
+
+def inc(name, value=1, **labels):
+    if enabled():
+        registry.inc(name, value, **labels)
+
+
+def observe(name, seconds, **labels):
+    if enabled():
+        registry.observe(name, seconds, **labels)
+
+
+class timer(object):
+    """with metrics.timer("bot_seconds", kind="chat", bot=bot_type): ..."""
+
+    __slots__ = ("name", "labels", "start")
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.name, time.monotonic() - self.start, **self.labels)
+
+
+def timeline(context, msg=None):
+    """返回context的阶段时间记录，没有时新建，收到消息的时间取ChatMessage.received_at"""
+    stamps = context.get("timeline")
+    if stamps is None:
+        now = time.monotonic()
+        msg = msg or context.get("msg")
+        stamps = context["timeline"] = {"receive": getattr(msg, "received_at", None) or now}
+    return stamps
+
+
+def stage(context, name, previous=None, **labels):
+    """记录进入name阶段的时间，previous不为空时把previous阶段的耗时(到现在为止)计入stage_seconds"""
+    if context is None or not enabled():
+        return
+    stamps = timeline(context)
+    now = time.monotonic()
+    stamps[name] = now
+    if previous and previous in stamps:
+        registry.observe("stage_seconds", now - stamps[previous], stage=previous, **labels)
+
+
+def finish(context, **labels):
+    """回复发送完成，记录整条消息的耗时"""
+    if context is None or not enabled():
+        return
+    stamps = context.get("timeline")
+    if stamps:
+        registry.observe("message_seconds", time.monotonic() - stamps["receive"], **labels)
+
+
+def _pool_samples():
+    from common.handler_pool import handler_pools
+
+    for stats in handler_pools.stats():
+        labels = {"pool": stats["name"]}
+        yield "handler_pool_workers", "gauge", labels, stats["workers"]
+        yield "handler_pool_busy", "gauge", labels, stats["busy"]
+        yield "handler_pool_queue_depth", "gauge", labels, stats["queue_depth"]
+        yield "handler_pool_completed_total", "counter", labels, stats["completed"]
+        yield "handler_pool_failed_total", "counter", labels, stats["failed"]
+
+
+def _cache_samples():
+    from bot.reply_cache import get_reply_cache
+    from common import media_fetcher
+    from common.tmp_dir import tmp_stats
+    from voice.tts_cache import get_tts_cache
+
+    for key, value in tmp_stats().items():
+        yield _sample("tmp_" + key, key in ("held_bytes", "active_files"), {}, value)
+    for key, value in media_fetcher.stats().items():
+        yield _sample("media_" + key, key.startswith(("cached", "inflight")), {}, value)
+    for name, cache in (("tts", get_tts_cache()), ("reply", get_reply_cache())):
+        if cache is None:
+            continue
+        for key, value in cache.stats().items():
+            yield _sample("cache_" + key, key in ("size", "bytes", "hit_rate"), {"cache": name}, value)
+
+
+def _sample(name, gauge, labels, value):
+    if gauge:
+        return name, "gauge", labels, value
+    return name + "_total", "counter", labels, value
+
+
+def _ingress_samples():
+    from common import http_ingress
+
+    for stats in http_ingress.stats():
+        labels = {"port": stats["port"]}
+        yield "ingress_requests_total", "counter", labels, stats.get("requests", 0)
+        yield "ingress_request_seconds_total", "counter", labels, stats.get("request_seconds", 0.0)
+        yield "ingress_not_found_total", "counter", labels, stats.get("not_found", 0)
+        yield "ingress_idle_workers", "gauge", labels, stats.get("idle_workers", 0)
+
+
+registry.register_collector(_pool_samples)
+registry.register_collector(_cache_samples)
+registry.register_collector(_ingress_samples)
+
+
+class MetricsHandler:
+    def GET(self):
+        import web
+
+        web.header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        return registry.render()
+
+
+def start_metrics_server():
+    """metrics_port不为0时在该端口提供/metrics，与回调通道端口相同时共用一个服务器"""
+    port = conf().get("metrics_port", 0)
+    if not port or not enabled():
+        return
+    from common import http_ingress
+
+    http_ingress.mount(port, ("/metrics", "MetricsHandler"), globals())
@@ -1,8 +1,24 @@
+"""
+临时文件目录
+语音、图片、文件和视频的下载，以及语音合成和格式转换的结果都放在 ./tmp/ 下：
+- new_file 生成不会重名的文件路径
+- 在 tmp_scope 中创建或登记(track_tmp)的文件，在作用域结束(一条消息处理完)时删除，需要保留的用 keep_tmp 取消登记
+- 后台清理线程按 tmp_max_age 删除过期文件，总大小超过 tmp_max_size 时删除最久未使用的文件
+"""
+import contextvars
 import os
 import pathlib
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
 
+from common.log import logger
 from config import conf
 
+SWEEP_MIN_AGE = 60  # 最近修改过的文件可能还在下载或发送，清理时跳过
+
 
 class TmpDir(object):
     """A temporary directory that is deleted when the object is destroyed."""
@@ -16,3 +32,193 @@ class TmpDir(object):
 
     def path(self):
         return str(self.tmpFilePath) + "/"
+
+    def new_file(self, suffix="", prefix="", name=None):
+        """
+        返回临时目录下不会重名的文件路径，并登记到当前作用域
+        name不为空时保留原文件名(发送文件时对方看到的是文件名)，放在单独的子目录中
+        """
+        if name:
+            directory = os.path.join(self.path(), uuid.uuid4().hex)
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, os.path.basename(name))
+        else:
+            path = self.path() + prefix + uuid.uuid4().hex + suffix
+        with _lock:
+            _stats["created"] += 1
+        return track_tmp(path)
+
+
+class TmpScope(object):
+    """一条消息处理期间创建的临时文件"""
+
+    def __init__(self):
+        self.paths = []
+
+    def track(self, path):
+        if path not in self.paths:
+            self.paths.append(path)
+            with _lock:
+                _active[os.path.abspath(path)] += 1
+
+    def keep(self, path):
+        if path in self.paths:
+            self.paths.remove(path)
+            _release(path)
+
+    def cleanup(self):
+        paths, self.paths = self.paths, []
+        for path in paths:
+            _release(path)
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError:
+                continue
+            with _lock:
+                _stats["scope_removed_files"] += 1
+                _stats["scope_removed_bytes"] += size
+            directory = os.path.dirname(path)
+            # new_file(name=...)创建的子目录
+            if os.path.abspath(os.path.dirname(directory)) == os.path.abspath(TmpDir.tmpFilePath):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    pass
+
+
+_scope = contextvars.ContextVar("tmp_scope", default=None)
+_lock = threading.Lock()
+_active = Counter()  # 仍在作用域中的文件，清理线程不会删除
+_stats = Counter()
+
+
+def _release(path):
+    path = os.path.abspath(path)
+    with _lock:
+        _active[path] -= 1
+        if _active[path] <= 0:
+            del _active[path]
+
+
+@contextmanager
+def tmp_scope():
+    """作用域内通过new_file创建或track_tmp登记的文件在退出时删除"""
+    scope = TmpScope()
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        scope.cleanup()
+
+
+def track_tmp(path):
+    """登记到当前作用域，没有作用域时只依赖后台清理。返回path，方便直接赋值"""
+    scope = _scope.get()
+    if scope is not None and path:
+        scope.track(path)
+    return path
+
+
+def keep_tmp(path):
+    """文件需要在消息处理完后继续使用(如缓存的图片)，从当前作用域中移除"""
+    scope = _scope.get()
+    if scope is not None and path:
+        scope.keep(path)
+
+
+def is_tmp_path(path):
+    """path是否在临时目录下"""
+    if not isinstance(path, str):
+        return False
+    root = os.path.abspath(TmpDir.tmpFilePath)
+    return os.path.abspath(path).startswith(root + os.sep)
+
+
+def sweep(max_bytes=None, max_age=None):
+    """
+    删除超过max_age秒未使用的文件，总大小仍超过max_bytes时按最近使用时间从旧到新删除，返回删除的文件数
+    """
+    root = str(TmpDir.tmpFilePath)
+    if not os.path.exists(root):
+        return 0
+    now = time.time()
+    files = []
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            total += stat.st_size
+            used = max(stat.st_atime, stat.st_mtime)
+            if now - stat.st_mtime < SWEEP_MIN_AGE:
+                continue
+            files.append((used, stat.st_size, path))
+    with _lock:
+        active = set(_active)
+    files = [item for item in files if os.path.abspath(item[2]) not in active]
+    files.sort()
+    removed = removed_bytes = 0
+    for used, size, path in files:
+        expired = max_age and now - used > max_age
+        over = max_bytes and total > max_bytes
+        if not expired and not over:
+            break  # 按使用时间从旧到新排序，后面的文件也不会过期，总大小也已经不超
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        removed += 1
+        removed_bytes += size
+    # 删除空的子目录
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if dirpath != root and not dirnames and not filenames:
+            try:
+                if now - os.stat(dirpath).st_mtime >= SWEEP_MIN_AGE:
+                    os.rmdir(dirpath)
+            except OSError:
+                pass
+    with _lock:
+        _stats["swept_files"] += removed
+        _stats["swept_bytes"] += removed_bytes
+        _stats["held_bytes"] = total
+        _stats["sweeps"] += 1
+    if removed:
+        logger.info("[TmpDir] swept {} files, {:.1f}MB, {:.1f}MB held".format(removed, removed_bytes / 1024 / 1024, total / 1024 / 1024))
+    return removed
+
+
+def tmp_stats():
+    """held_bytes为最近一次清理时临时目录的总大小"""
+    with _lock:
+        stats = dict(_stats)
+        stats["active_files"] = len(_active)
+    return stats
+
+
+_sweeper = None
+
+
+def start_tmp_sweeper():
+    """启动后台清理线程，tmp_sweep_interval为0时不启动"""
+    global _sweeper
+    interval = conf().get("tmp_sweep_interval", 300)
+    if not interval or _sweeper is not None:
+        return
+
+    def run():
+        while True:
+            try:
+                max_size = conf().get("tmp_max_size", 2048)
+                sweep(max_size * 1024 * 1024 if max_size else None, conf().get("tmp_max_age", 86400))
+            except Exception as e:
+                logger.warning("[TmpDir] sweep failed: {}".format(e))
+            time.sleep(interval)
+
+    _sweeper = threading.Thread(target=run, name="tmp_sweeper", daemon=True)
+    _sweeper.start()
@@ -0,0 +1,113 @@
+import threading
+import time
+
+from common.log import logger
+
+
+class TokenCache:
+    """
+    access_token缓存
+    按接口返回的expires_in过期，剩余有效期少于refresh_ahead秒时在后台线程刷新，调用方继续使用旧token不被阻塞；
+    token缺失或已过期时同步获取，并保证同一时间只有一个线程在请求token
+    fetch_fn: 无参函数，返回 (token, expires_in秒)，获取失败时返回 (None, 0) 或抛出异常
+    """
+
+    def __init__(self, name, fetch_fn, refresh_ahead=300, default_expires_in=3600):
+        self.name = name
+        self.fetch_fn = fetch_fn
+        self.refresh_ahead = refresh_ahead
+        self.default_expires_in = default_expires_in
+        self.token = None
+        self.expires_at = 0
+        self.refresh_at = 0  # 开始后台刷新的时间，按每个token的有效期计算
+        self.lock = threading.Lock()  # 保证同一时间只有一个线程刷新
+        self.refreshing = False  # 是否已有后台刷新线程
+        self.refreshing_lock = threading.Lock()
+
+    def get(self):
+        """返回有效的token，获取失败且旧token已过期时返回None"""
+        token, expires_at = self.token, self.expires_at
+        now = time.monotonic()
+        if token and now < expires_at:
+            if now >= self.refresh_at:
+                self._refresh_in_background()
+            return token
+        with self.lock:
+            if not (self.token and time.monotonic() < self.expires_at):  # 等锁期间可能已被其他线程刷新
+                self._refresh()
+            if self.token and time.monotonic() < self.expires_at:
+                return self.token
+            return None
+
+    def invalidate(self, token=None):
+        """
+        token被服务端判定失效时调用，下次get会重新获取；
+        传入token时只在它仍是当前token时作废，避免并发请求各自作废刚刷新的新token
+        """
+        with self.lock:
+            if token is None or token == self.token:
+                self.token = None
+                self.expires_at = 0
+                self.refresh_at = 0
+
+    def request(self, request_fn, is_token_error):
+        """
+        request_fn(token) 发起接口请求并返回结果，is_token_error(结果) 为真表示token已被服务端提前吊销，
+        此时作废该token并用新token重试一次
+        """
+        token = self.get()
+        result = request_fn(token)
+        if token and is_token_error(result):
+            logger.warning("[TokenCache] {} token rejected by server, refresh and retry".format(self.name))
+            self.invalidate(token)
+            result = request_fn(self.get())
+        return result
+
+    # 需在持有self.lock时调用
+    def _refresh(self):
+        token, expires_in = self.fetch_fn()
+        if not token:
+            logger.error("[TokenCache] {} fetch token failed".format(self.name))
+            return
+        expires_in = expires_in or self.default_expires_in
+        now = time.monotonic()
+        self.token = token
+        self.expires_at = now + expires_in
+        # 有效期比提前刷新时间还短时，在有效期过半时刷新
+        self.refresh_at = self.expires_at - min(self.refresh_ahead, expires_in / 2)
+        logger.debug("[TokenCache] {} token refreshed, expires_in={}".format(self.name, expires_in))
+
+    def _refresh_in_background(self):
+        with self.refreshing_lock:
+            if self.refreshing:
+                return
+            self.refreshing = True
+
+        def refresh():
+            try:
+                with self.lock:
+                    if time.monotonic() < self.refresh_at:  # 已被其他线程刷新
+                        return
+                    self._refresh()
+            except Exception as e:
+                logger.warning("[TokenCache] {} background refresh error: {}".format(self.name, e))
+            finally:
+                self.refreshing = False
+
+        threading.Thread(target=refresh, daemon=True).start()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_token_cache(name, fetch_fn, **kwargs) -> TokenCache:
+    """
+    按name获取共享的token缓存，相同凭证的多个bot、插件或通道实例共用同一个token
+    """
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = TokenCache(name, fetch_fn, **kwargs)
+            _caches[name] = cache
+        return cache
@@ -0,0 +1,284 @@
+"""
+消息追踪
+每个Context在构造时分配trace_id(保存在context["trace"]，语音转文字等嵌套生成的context沿用同一个)，
+处理消息期间(tracing.use)日志行带上[trace_id]，同一条消息的日志可以直接grep出来。
+被采样的消息还会记录span：插件事件、bot调用、HTTP请求、语音转换、媒体下载和发送，每个span结束时导出：
+- trace_exporter 为 "jsonl" 时写入本地文件(每行一个span)，按大小轮转
+- trace_exporter 为 "otlp" 时按OTLP/HTTP JSON格式批量发送到本地的collector
+采样由 trace_sample_rate(比例) 和 trace_max_per_second(每秒最多采样的消息数) 控制，
+未采样的消息只分配trace_id，span不做任何记录
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from common.log import log_trace_id, logger
+from config import conf, get_appdata_dir
+
+# 当前的 (Trace, span_id)
+_current = contextvars.ContextVar("trace_span", default=None)
+
+
+class Trace(object):
+    __slots__ = ("trace_id", "root_id", "sampled", "start", "attrs", "ended")
+
+    def __init__(self, sampled, attrs):
+        self.trace_id = os.urandom(16).hex()
+        self.root_id = os.urandom(8).hex()
+        self.sampled = sampled
+        self.start = time.time()
+        self.attrs = attrs
+        self.ended = False
+
+
+class Sampler(object):
+    """按比例采样，每秒采样数不超过上限"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.second = 0
+        self.count = 0
+
+    def sample(self):
+        if not conf().get("trace_exporter"):
+            return False
+        rate = conf().get("trace_sample_rate", 0.1)
+        if rate <= 0 or (rate < 1 and random.random() >= rate):
+            return False
+        limit = conf().get("trace_max_per_second", 20)
+        if not limit:
+            return True
+        now = int(time.monotonic())
+        with self.lock:
+            if now != self.second:
+                self.second = now
+                self.count = 0
+            if self.count >= limit:
+                return False
+            self.count += 1
+            return True
+
+
+_sampler = Sampler()
+
+
+def start_trace(context, **attrs) -> Trace:
+    """给context分配trace，已有时(嵌套的context)直接返回"""
+    trace = context.get("trace")
+    if trace is None:
+        trace = context["trace"] = Trace(_sampler.sample(), attrs)
+    return trace
+
+
+def trace_id(context=None):
+    """context的trace_id，不传时为当前正在处理的消息的trace_id"""
+    if context is not None:
+        trace = context.get("trace")
+        return trace.trace_id if trace else None
+    current = _current.get()
+    return current[0].trace_id if current else None
+
+
+class use(object):
+    """
+    with tracing.use(context): 在消息的trace中执行，期间创建的span以整条消息为父节点，日志带上trace_id
+    end为True时退出时导出整条消息的根span
+    """
+
+    __slots__ = ("context", "trace", "end", "tokens")
+
+    def __init__(self, context, end=False):
+        self.context = context
+        self.trace = context.get("trace") if context is not None else None
+        self.end = end
+
+    def __enter__(self):
+        if self.trace is None:
+            self.tokens = None
+            return self
+        self.tokens = (_current.set((self.trace, self.trace.root_id)), log_trace_id.set(self.trace.trace_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.tokens:
+            _current.reset(self.tokens[0])
+            log_trace_id.reset(self.tokens[1])
+        if self.end:
+            end_trace(self.context, "{}: {}".format(exc_type.__name__, exc) if exc_type else None)
+
+
+def end_trace(context, error=None):
+    """消息处理完成，导出表示整条消息的根span"""
+    trace = context.get("trace") if context is not None else None
+    if trace is None or not trace.sampled or trace.ended:
+        return
+    trace.ended = True
+    trace.attrs["session_id"] = context.get("session_id")
+    trace.attrs["type"] = context.type.name if context.type else None
+    _export(trace.trace_id, trace.root_id, None, "message", trace.start, time.time(), trace.attrs, error)
+
+
+class span(object):
+    """
+    with tracing.span("bot.chat", bot=bot_type) as s:
+        ...
+        s.set(status_code=200)
+    不在被采样的消息中时什么也不做
+    """
+
+    __slots__ = ("name", "attrs", "trace", "parent_id", "span_id", "start", "token")
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.trace = None
+
+    def __enter__(self):
+        current = _current.get()
+        if current is None or not current[0].sampled:
+            return self
+        self.trace, self.parent_id = current
+        self.span_id = os.urandom(8).hex()
+        self.start = time.time()
+        self.token = _current.set((self.trace, self.span_id))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.trace is None:
+            return
+        _current.reset(self.token)
+        error = "{}: {}".format(exc_type.__name__, exc) if exc_type else None
+        _export(self.trace.trace_id, self.span_id, self.parent_id, self.name, self.start, time.time(), self.attrs, error)
+
+    def set(self, **attrs):
+        if self.trace is not None:
+            self.attrs.update(attrs)
+
+
+def _export(trace_id, span_id, parent_id, name, start, end, attrs, error):
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    exporter.export({
+        "trace_id": trace_id,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "name": name,
+        "start": start,
+        "duration": end - start,
+        "attrs": attrs,
+        "error": error,
+    })
+
+
+class JsonlExporter(object):
+    """写入在后台线程中完成，文件超过trace_file_max_size后轮转"""
+
+    def __init__(self, path, max_bytes, backups):
+        self.queue = queue.SimpleQueue()
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self.listener = QueueListener(self.queue, handler)
+        self.listener.start()
+        self.trace_logger = logging.getLogger("trace_spans")
+        self.trace_logger.propagate = False
+        self.trace_logger.setLevel(logging.INFO)
+        for old_handler in list(self.trace_logger.handlers):  # 配置重载后切换了文件
+            self.trace_logger.removeHandler(old_handler)
+        self.trace_logger.addHandler(QueueHandler(self.queue))
+
+    def export(self, item):
+        self.trace_logger.info(json.dumps(item, ensure_ascii=False, default=str))
+
+
+class OtlpExporter(object):
+    """按OTLP/HTTP JSON格式，每秒或攒够batch_size个span发送一次，发送失败的丢弃"""
+
+    def __init__(self, endpoint, batch_size=256, max_queue=10000):
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.queue = queue.Queue(max_queue)
+        self.dropped = 0
+        threading.Thread(target=self._run, name="trace_exporter", daemon=True).start()
+
+    def export(self, item):
+        try:
+            self.queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        from common import http_client
+
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + 1
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                http_client.post(self.endpoint, json=self._payload(batch), timeout=(2, 5))
+            except Exception as e:
+                logger.debug("[Tracing] export {} spans failed: {}".format(len(batch), e))
+
+    @staticmethod
+    def _payload(batch):
+        spans = []
+        for item in batch:
+            span_item = {
+                "traceId": item["trace_id"],
+                "spanId": item["span_id"],
+                "name": item["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(int(item["start"] * 1e9)),
+                "endTimeUnixNano": str(int((item["start"] + item["duration"]) * 1e9)),
+                "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in item["attrs"].items()],
+                "status": {"code": 2, "message": item["error"]} if item["error"] else {"code": 1},
+            }
+            if item["parent_id"]:
+                span_item["parentSpanId"] = item["parent_id"]
+            spans.append(span_item)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": "onewebot"}}]},
+                "scopeSpans": [{"scope": {"name": "onewebot"}, "spans": spans}],
+            }]
+        }
+
+
+_exporter = None
+_exporter_type = None
+_lock = threading.Lock()
+
+
+def get_exporter():
+    """trace_exporter为空时返回None"""
+    global _exporter, _exporter_type
+    exporter_type = conf().get("trace_exporter")
+    if not exporter_type:
+        return None
+    if _exporter is None or _exporter_type != exporter_type:
+        with _lock:
+            if _exporter is None or _exporter_type != exporter_type:
+                if exporter_type == "otlp":
+                    endpoint = conf().get("trace_otlp_endpoint", "http://127.0.0.1:4318/v1/traces")
+                    _exporter = OtlpExporter(endpoint)
+                    logger.info("[Tracing] export spans to {}".format(endpoint))
+                else:
+                    path = conf().get("trace_file") or os.path.join(get_appdata_dir(), "traces.jsonl")
+                    max_bytes = int(conf().get("trace_file_max_size", 50) * 1024 * 1024)
+                    _exporter = JsonlExporter(path, max_bytes, conf().get("trace_file_backups", 3))
+                    logger.info("[Tracing] export spans to {}".format(path))
+                _exporter_type = exporter_type
+    return _exporter
@@ -5,6 +5,10 @@ import logging
 import os
 import pickle
 import copy
+import re
+import threading
+import time
+from types import MappingProxyType
 
 from common.log import logger
 
@@ -54,13 +58,38 @@ available_setting = {
     "azure_openai_dalle_deployment_id":"", # [可选] azure openai 用于回复图片的资源 deployment id，默认使用 text_to_image
     "image_proxy": True,  # 是否需要图片代理，国内访问LinkAI时需要
     "image_create_prefix": ["画", "看", "找"],  # 开启图片回复的前缀
+    "stream_reply": False,  # 是否开启流式回复，回复边生成边发送，目前支持chatgpt和dify(chatbot)，通道支持wx、wechatcom_app(按句发送)、dingtalk、feishu(卡片更新)；启用了处理回复的插件(如敏感词过滤)时不流式发送
+    "stream_sentence_min_chars": 50,  # 按句发送时每条消息的最少字符数
+    "stream_card_interval": 0.5,  # 卡片更新的最小间隔秒数
     "concurrency_in_session": 1,  # 同一会话最多有多少条消息在处理中，大于1可能乱序
+    "handler_mode": "thread",  # 消息处理模式，thread为每条消息占用一个线程，asyncio为在事件循环中以协程处理，支持异步的bot不占用线程
+    "handler_pool_max_workers": 8,  # 默认消息处理线程池的最大线程数
+    "handler_pool_min_workers": 1,  # 每个线程池空闲时保留的最少线程数
+    "handler_pool_idle_timeout": 60,  # 线程空闲超过该秒数后退出
+    "handler_pool_admin_workers": 2,  # 管理指令(#开头)独立线程池的最大线程数
+    "handler_pool_budgets": {},  # 独立线程池的最大线程数，key为回复类别(admin/text/voice/image)、bot类型、"bot类型:回复类别"或通道类型，如 {"admin": 2, "dify": 8, "linkai:image": 4}
     "image_create_size": "256x256",  # 图片大小,可选有 256x256, 512x512, 1024x1024 (dall-e-3默认为1024x1024)
     "group_chat_exit_group": False,
     "group_exit_msg": "",  # 退出群聊的消息
     "accept_friend_msg": "",  # 接受好友请求后发送的消息
     # chatgpt会话参数
     "expires_in_seconds": 3600,  # 无操作会话的过期时间
+    "received_msgs_max_size": 10000,  # 消息去重缓存最多保存的消息id数，超出后淘汰最久的
+    "session_store": "memory",  # 会话存储，memory(仅内存，重启后丢失)、sqlite 或 redis
+    "session_store_path": "",  # sqlite会话存储的文件路径，为空时使用数据目录下的sessions.db
+    "session_store_redis_url": "redis://localhost:6379/0",  # redis会话存储地址，兼容任何Redis协议的服务
+    "session_store_flush_interval": 1,  # sqlite会话存储批量写入的间隔秒数
+    "session_cache_max_size": 1000,  # 使用持久化会话存储时，进程内最多缓存的活跃会话数
+    # 回复缓存，对无上下文的常见问题直接返回缓存的回复
+    "reply_cache": False,  # 是否开启回复缓存
+    "reply_cache_backend": "memory",  # 缓存后端，支持 memory, sqlite
+    "reply_cache_path": "",  # sqlite缓存文件路径，默认为数据目录下的reply_cache.db
+    "reply_cache_ttl": 86400,  # 缓存有效期(秒)，从写入时开始计算
+    "reply_cache_max_size": 10000,  # 最多缓存的回复数，超出后淘汰最久未使用的
+    "reply_cache_scope": "first_turn",  # first_turn: 只缓存会话的第一轮提问; always: 不考虑上下文，所有提问都使用缓存
+    "reply_cache_groups": [],  # 开启回复缓存的群名称，ALL_GROUP表示所有群
+    "reply_cache_single_chat": False,  # 私聊是否使用回复缓存
+    "reply_cache_simhash_distance": 0,  # 近似问题匹配的SimHash汉明距离(1~7，建议3~5)，0为只精确匹配
     # 人格描述
     "character_desc": "你是ChatGPT, 一个由OpenAI训练的大型语言模型, 你旨在回答并解决人们的任何问题，并且可以使用多种语言与人交流。",
     "conversation_max_tokens": 1000,  # 支持上下文记忆的最多字符数
@@ -74,6 +103,31 @@ available_setting = {
     "presence_penalty": 0,
     "request_timeout": 180,  # chatgpt请求超时时间，openai接口默认设置为600，对于难问题一般需要较长时间
     "timeout": 120,  # chatgpt重试超时时间，在这个时间内，将会自动重试
+    # 共享HTTP连接池配置，默认读超时使用request_timeout
+    "http_pool_connections": 20,  # 缓存连接池的host数量
+    "http_pool_maxsize": 32,  # 每个host保持的最大keep-alive连接数
+    "http_max_retries": 2,  # 连接失败和幂等请求网关错误的重试次数
+    "http_backoff_factor": 0.5,  # 重试退避系数，单位秒
+    "http_connect_timeout": 5,  # 建立连接的超时时间，单位秒
+    # 回调通道(公众号、企业微信、企业微信客服、飞书)共用的HTTP服务器配置，同一端口上的通道共用一个服务器
+    "ingress_host": "0.0.0.0",  # 监听地址
+    "ingress_workers": 32,  # 处理请求的工作线程数
+    "ingress_request_queue_size": 128,  # 等待accept的连接队列长度
+    "ingress_keepalive_timeout": 15,  # 连接读写超时和keep-alive空闲超时，单位秒
+    "ingress_max_body_size": 10,  # 请求体大小上限，单位MB，超过时返回413
+    "ingress_dispatch_workers": 8,  # 回调返回后解析消息、构造上下文的后台线程数
+    "ingress_ssl_cert": "",  # 使用https时的证书路径
+    "ingress_ssl_key": "",  # 使用https时的私钥路径
+    # 消息处理链路的指标(各阶段耗时直方图、token数、错误和重试次数)
+    "metrics": True,  # 是否统计，只在内存中累加
+    "metrics_port": 0,  # 提供Prometheus格式/metrics的端口，0为不提供，可以与回调通道的端口相同
+    "trace_exporter": "",  # 消息追踪span的导出方式，可选 jsonl(写入本地文件)、otlp(发送到OTLP/HTTP collector)，为空时日志仍带trace_id但不记录span
+    "trace_sample_rate": 0.1,  # 记录span的消息比例
+    "trace_max_per_second": 20,  # 每秒最多采样的消息数，0为不限制
+    "trace_file": "",  # jsonl导出的文件路径，为空时为appdata目录下的traces.jsonl
+    "trace_file_max_size": 50,  # jsonl文件的轮转大小，单位MB
+    "trace_file_backups": 3,  # jsonl文件保留的轮转份数
+    "trace_otlp_endpoint": "http://127.0.0.1:4318/v1/traces",  # otlp导出的地址
     # Baidu 文心一言参数
     "baidu_wenxin_model": "eb-instant",  # 默认使用ERNIE-Bot-turbo模型
     "baidu_wenxin_api_key": "",  # Baidu api key
@@ -116,6 +170,19 @@ available_setting = {
     "voice_reply_voice": False,  # 是否使用语音回复语音，需要设置对应语音合成引擎的api key
     "always_reply_voice": False,  # 是否一直使用语音回复
     "voice_to_text": "openai",  # 语音识别引擎，支持openai,baidu,google,azure,xunfei,ali
+    "voice_convert_processes": 2,  # 语音编解码(silk、重采样)使用的进程数，0表示在消息处理线程中直接转换
+    "voice_convert_timeout": 60,  # 单条语音转换的超时时间(秒)
+    "tts_cache": False,  # 是否缓存语音合成结果，相同引擎、音色和文本直接使用缓存的音频
+    "tts_cache_dir": "",  # 语音合成缓存目录，默认为数据目录下的tts_cache
+    "tts_cache_max_size": 200,  # 语音合成缓存占用的最大磁盘空间(MB)，超出后淘汰最久未使用的
+    "tts_cache_prewarm": [],  # 启动时预先合成并缓存的语句，如欢迎语
+    "tmp_max_size": 2048,  # 临时目录(tmp)的最大占用空间(MB)，超出后删除最久未使用的文件，0为不限制
+    "tmp_max_age": 86400,  # 临时文件超过该时间(秒)未使用时删除，0为不限制
+    "tmp_sweep_interval": 300,  # 临时目录后台清理的间隔(秒)，0为不启动后台清理
+    "media_max_size": {"image": 20, "video": 30, "voice": 10, "file": 50},  # 下载图片、视频等媒体的大小上限(MB)
+    "media_fetch_timeout": 60,  # 下载媒体的读取超时(秒)
+    "media_cache_size": 64,  # 媒体下载缓存的最大内存占用(MB)，同一链接发送到多个会话时只下载一次，0为不缓存
+    "media_cache_ttl": 600,  # 媒体下载缓存的有效期(秒)
     "text_to_voice": "openai",  # 语音合成引擎，支持openai,baidu,google,azure,xunfei,ali,pytts(offline),elevenlabs,edge(online)
     "text_to_voice_model": "tts-1",
     "tts_voice_id": "alloy",
@@ -152,6 +219,8 @@ available_setting = {
     "wechatmp_app_id": "",  # 微信公众平台的appID
     "wechatmp_app_secret": "",  # 微信公众平台的appsecret
     "wechatmp_aes_key": "",  # 微信公众平台的EncodingAESKey，加密模式需要
+    "wechatmp_state_ttl": 600,  # 被动回复模式下，用户未取走的回复和处理状态的保留时间(秒)
+    "wechatmp_state_max_users": 10000,  # 被动回复模式下最多保留状态的用户数，超出后淘汰最久未访问的
     # wechatcom的通用配置
     "wechatcom_corp_id": "",  # 企业微信公司的corpID
     # wechatcomapp的配置
@@ -160,6 +229,7 @@ available_setting = {
     "wechatcomapp_secret": "",  # 企业微信app的secret
     "wechatcomapp_agent_id": "",  # 企业微信app的agent_id
     "wechatcomapp_aes_key": "",  # 企业微信app的aes_key
+    "wechatcs_msg_max_age": 600,  # 企业微信客服同步到的消息超过该秒数不再回复(如首次同步拉到的历史消息)
     # 飞书配置
     "feishu_port": 80,  # 飞书bot监听端口
     "feishu_app_id": "",  # 飞书机器人应用APP Id
@@ -177,11 +247,15 @@ available_setting = {
     "channel_type": "",  # 通道类型，支持：{wx,wxy,terminal,wechatmp,wechatmp_service,wechatcom_app,dingtalk}
     "subscribe_msg": "",  # 订阅消息, 支持: wechatmp, wechatmp_service, wechatcom_app
     "debug": False,  # 是否开启debug模式，开启后会打印更多日志
+    "config_watch": False,  # 是否监听config.json的修改并自动重新加载配置
+    "config_watch_interval": 5,  # 检查配置文件修改的间隔(秒)
     "appdata_dir": "",  # 数据目录
     # 插件配置
     "plugin_trigger_prefix": "$",  # 规范插件提供聊天相关指令的前缀，建议不要和管理员指令前缀"#"冲突
     # 是否使用全局插件配置
     "use_global_plugin_config": False,
+    "plugin_time_budget": 0,  # 插件处理单个事件的时间预算(秒)，超出时告警，0为不限制；也可按插件名配置，如 {"default": 5, "Linkai": 30}
+    "plugin_budget_max_overruns": 0,  # 插件连续超出时间预算多少次后暂时跳过该插件，0为不跳过，重载插件或#pstats reset后恢复
     "max_media_send_count": 3,  # 单次最大发送媒体资源的个数
     "media_send_interval": 1,  # 发送图片的事件间隔，单位秒
     # 智谱AI 平台配置
@@ -203,6 +277,7 @@ available_setting = {
 class Config(dict):
     def __init__(self, d=None):
         super().__init__()
+        self.version = 0  # 每次修改配置项时递增，供依赖配置的缓存判断是否需要重建
         if d is None:
             d = {}
         for k, v in d.items():
@@ -218,15 +293,13 @@ class Config(dict):
     def __setitem__(self, key, value):
         if key not in available_setting:
             raise Exception("key {} not in available_setting".format(key))
+        self.version += 1
         return super().__setitem__(key, value)
 
     def get(self, key, default=None):
-        try:
-            return self[key]
-        except KeyError as e:
-            return default
-        except Exception as e:
-            raise e
+        if key not in available_setting:
+            raise Exception("key {} not in available_setting".format(key))
+        return dict.get(self, key, default)
 
     # Make sure to return a dictionary to ensure atomic
     def get_user_data(self, user) -> dict:
@@ -257,6 +330,94 @@ class Config(dict):
 config = Config()
 
 
+class ConfigSnapshot:
+    """
+    某一时刻配置的只读快照
+    每个配置项都是同名属性(未配置的为None)，读取不经过available_setting校验和异常处理；
+    配置被重新加载或修改后会生成新的快照，已取得旧快照的调用方在处理本条消息期间看到的配置保持一致
+    """
+
+    def __init__(self, source: Config):
+        values = dict(source)
+        object.__setattr__(self, "source", source)
+        object.__setattr__(self, "version", source.version)
+        object.__setattr__(self, "values", MappingProxyType(values))
+        for key in available_setting:
+            object.__setattr__(self, key, values.get(key))
+        # 预先解析服务时间，格式错误时chat_time_range为None
+        object.__setattr__(self, "chat_time_range", self._parse_chat_time(
+            values.get("chat_start_time", "00:00"), values.get("chat_stop_time", "24:00")))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+    def __delattr__(self, key):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+    def get(self, key, default=None):
+        return self.values.get(key, default)
+
+    def __getitem__(self, key):
+        return self.values[key]
+
+    def __contains__(self, key):
+        return key in self.values
+
+    @staticmethod
+    def _parse_chat_time(start, stop):
+        """返回 (开始分钟数, 结束分钟数)"""
+        time_regex = re.compile(r"^([01]?[0-9]|2[0-4]):([0-5][0-9])$")
+        result = []
+        for value in (start, stop):
+            match = time_regex.match(value) if isinstance(value, str) else None
+            if not match:
+                return None
+            result.append(int(match.group(1)) * 60 + int(match.group(2)))
+        return tuple(result)
+
+
+_snapshot = None
+_publish_lock = threading.RLock()
+
+
+def snapshot() -> ConfigSnapshot:
+    """
+    返回当前配置的只读快照，同一条消息的处理过程中应只获取一次
+    通过conf()[key] = value 原地修改的配置也会在下次获取时生成新快照
+    """
+    global _snapshot
+    current = _snapshot
+    source = config
+    if current is None or current.source is not source or current.version != source.version:
+        with _publish_lock:
+            current = _snapshot
+            if current is None or current.source is not config or current.version != config.version:
+                current = ConfigSnapshot(config)
+                _snapshot = current
+    return current
+
+
+def publish_config(new_config: Config):
+    """用完整构建好的配置整体替换当前配置，读取方不会看到只更新了一部分的配置"""
+    global config, _snapshot
+    with _publish_lock:
+        new_snapshot = ConfigSnapshot(new_config)
+        config = new_config
+        _snapshot = new_snapshot
+
+
+def update_config(values: dict):
+    """
+    批量修改配置项并原子发布，用于远程下发配置等需要同时修改多个配置项的场景
+    """
+    with _publish_lock:
+        new_config = Config(dict(config))
+        new_config.user_datas = config.user_datas
+        for key, value in values.items():
+            new_config[key] = value
+        publish_config(new_config)
+
+
 def drag_sensitive(config):
     try:
         if isinstance(config, str):
@@ -282,7 +443,6 @@ def drag_sensitive(config):
 
 
 def load_config():
-    global config
     config_path = "./config.json"
     if not os.path.exists(config_path):
         logger.info("配置文件不存在，将使用config-template.json模板")
@@ -291,8 +451,8 @@ def load_config():
     config_str = read_file(config_path)
     logger.debug("[INIT] config str: {}".format(drag_sensitive(config_str)))
 
-    # 将json字符串反序列化为dict类型
-    config = Config(json.loads(config_str))
+    # 将json字符串反序列化为dict类型，在局部变量中构建完成后再整体发布
+    new_config = Config(json.loads(config_str))
 
     # override config with environment variables.
     # Some online deployment platforms (e.g. Railway) deploy project from github directly. So you shouldn't put your secrets like api key in a config file, instead use environment variables to override the default config.
@@ -301,22 +461,58 @@ def load_config():
         if name in available_setting:
             logger.info("[INIT] override config by environ args: {}={}".format(name, value))
             try:
-                config[name] = eval(value)
+                new_config[name] = eval(value)
             except:
                 if value == "false":
-                    config[name] = False
+                    new_config[name] = False
                 elif value == "true":
-                    config[name] = True
+                    new_config[name] = True
                 else:
-                    config[name] = value
+                    new_config[name] = value
 
-    if config.get("debug", False):
+    if new_config.get("debug", False):
         logger.setLevel(logging.DEBUG)
         logger.debug("[INIT] set log level to DEBUG")
 
-    logger.info("[INIT] load config: {}".format(drag_sensitive(config)))
+    logger.info("[INIT] load config: {}".format(drag_sensitive(new_config)))
+
+    new_config.load_user_datas()
+    publish_config(new_config)
 
-    config.load_user_datas()
+    if new_config.get("config_watch", False):
+        _start_config_watcher(config_path, new_config.get("config_watch_interval", 5))
+
+
+_watcher = None
+
+
+def _start_config_watcher(config_path, interval):
+    """
+    轮询配置文件的修改时间，变化后自动重新加载
+    """
+    global _watcher
+    with _publish_lock:
+        if _watcher is not None:
+            return
+        _watcher = threading.Thread(target=_watch_config, args=(config_path, interval), name="config_watcher", daemon=True)
+        _watcher.start()
+    logger.info("[INIT] watching config file: {}".format(config_path))
+
+
+def _watch_config(config_path, interval):
+    last_mtime = os.path.getmtime(config_path) if os.path.exists(config_path) else None
+    while True:
+        time.sleep(interval)
+        try:
+            mtime = os.path.getmtime(config_path) if os.path.exists(config_path) else None
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            logger.info("[Config] config file changed, reloading")
+            load_config()
+        except Exception as e:
+            # 文件写到一半时可能解析失败，保留当前配置，等待下次修改
+            logger.warning("[Config] reload config failed, keep current config: {}".format(e))
 
 
 def get_root():
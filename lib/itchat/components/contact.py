@@ -123,8 +123,7 @@ def update_local_chatrooms(core, l):
             if 'RemarkName' in member:
                 utils.emoji_formatter(member, 'RemarkName')
         # update it to old chatrooms
-        oldChatroom = utils.search_dict_list(
-            core.chatroomList, 'UserName', chatroom['UserName'])
+        oldChatroom = core.chatroomList.find(chatroom['UserName'])
         if oldChatroom:
             update_info_dict(oldChatroom, chatroom)
             #  - update other values
@@ -132,21 +131,19 @@ def update_local_chatrooms(core, l):
             oldMemberList = oldChatroom['MemberList']
             if memberList:
                 for member in memberList:
-                    oldMember = utils.search_dict_list(
-                        oldMemberList, 'UserName', member['UserName'])
+                    oldMember = oldMemberList.find(member['UserName'])
                     if oldMember:
                         update_info_dict(oldMember, member)
                     else:
                         oldMemberList.append(member)
         else:
             core.chatroomList.append(chatroom)
-            oldChatroom = utils.search_dict_list(
-                core.chatroomList, 'UserName', chatroom['UserName'])
+            oldChatroom = core.chatroomList.find(chatroom['UserName'])
         # delete useless members
         if len(chatroom['MemberList']) != len(oldChatroom['MemberList']) and \
                 chatroom['MemberList']:
-            existsUserNames = [member['UserName']
-                               for member in chatroom['MemberList']]
+            existsUserNames = set(member['UserName']
+                                  for member in chatroom['MemberList'])
             delList = []
             for i, member in enumerate(oldChatroom['MemberList']):
                 if member['UserName'] not in existsUserNames:
@@ -156,8 +153,7 @@ def update_local_chatrooms(core, l):
                 del oldChatroom['MemberList'][i]
         #  - update OwnerUin
         if oldChatroom.get('ChatRoomOwner') and oldChatroom.get('MemberList'):
-            owner = utils.search_dict_list(oldChatroom['MemberList'],
-                                           'UserName', oldChatroom['ChatRoomOwner'])
+            owner = oldChatroom['MemberList'].find(oldChatroom['ChatRoomOwner'])
             oldChatroom['OwnerUin'] = (owner or {}).get('Uin', 0)
         #  - update IsAdmin
         if 'OwnerUin' in oldChatroom and oldChatroom['OwnerUin'] != 0:
@@ -166,9 +162,11 @@ def update_local_chatrooms(core, l):
         else:
             oldChatroom['IsAdmin'] = None
         #  - update Self
-        newSelf = utils.search_dict_list(oldChatroom['MemberList'],
-                                         'UserName', core.storageClass.userName)
+        newSelf = oldChatroom['MemberList'].find(core.storageClass.userName)
         oldChatroom['Self'] = newSelf or copy.deepcopy(core.loginInfo['User'])
+        # NickName may have been updated in place
+        oldChatroom['MemberList'].reindex()
+    core.chatroomList.reindex()
     return {
         'Type': 'System',
         'Text': [chatroom['UserName'] for chatroom in l],
@@ -182,7 +180,6 @@ def update_local_friends(core, l):
     '''
         get a list of friends or mps for updating local contact
     '''
-    fullList = core.memberList + core.mpList
     for friend in l:
         if 'NickName' in friend:
             utils.emoji_formatter(friend, 'NickName')
@@ -190,8 +187,8 @@ def update_local_friends(core, l):
             utils.emoji_formatter(friend, 'DisplayName')
         if 'RemarkName' in friend:
             utils.emoji_formatter(friend, 'RemarkName')
-        oldInfoDict = utils.search_dict_list(
-            fullList, 'UserName', friend['UserName'])
+        oldInfoDict = core.memberList.find(friend['UserName']) or \
+            core.mpList.find(friend['UserName'])
         if oldInfoDict is None:
             oldInfoDict = copy.deepcopy(friend)
             if oldInfoDict['VerifyFlag'] & 8 == 0:
@@ -200,6 +197,9 @@ def update_local_friends(core, l):
                 core.mpList.append(oldInfoDict)
         else:
             update_info_dict(oldInfoDict, friend)
+    # NickName may have been updated in place
+    core.memberList.reindex()
+    core.mpList.reindex()
 
 
 @contact_change
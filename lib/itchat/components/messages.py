@@ -224,6 +224,12 @@ def produce_msg(core, msgList):
         rl.append(m)
     return rl
 
+def search_member(chatroom, userName):
+    memberList = (chatroom or {}).get('MemberList') or []
+    if isinstance(memberList, templates.ContactList):
+        return memberList.find(userName)
+    return utils.search_dict_list(memberList, 'UserName', userName)
+
 def produce_group_chat(core, msg):
     r = re.match('(@[0-9a-z]*?):<br/>(.*)$', msg['Content'])
     if r:
@@ -240,12 +246,10 @@ def produce_group_chat(core, msg):
         utils.msg_formatter(msg, 'Content')
         return
     chatroom = core.storageClass.search_chatrooms(userName=chatroomUserName)
-    member = utils.search_dict_list((chatroom or {}).get(
-        'MemberList') or [], 'UserName', actualUserName)
+    member = search_member(chatroom, actualUserName)
     if member is None:
         chatroom = core.update_chatroom(chatroomUserName)
-        member = utils.search_dict_list((chatroom or {}).get(
-            'MemberList') or [], 'UserName', actualUserName)
+        member = search_member(chatroom, actualUserName)
     if member is None:
         logger.debug('chatroom member fetch failed with %s' % actualUserName)
         msg['ActualNickName'] = ''
@@ -59,15 +59,17 @@ class Storage(object):
                 chatroom['Self'].core = chatroom.core
                 chatroom['Self'].chatroom = chatroom
         self.lastInputUserName = j.get('lastInputUserName', None)
+    # search_* return shallow views (copy.copy) of stored contacts instead of deep copies,
+    # so a chatroom's MemberList is shared with storage and should be treated as read-only
     def search_friends(self, name=None, userName=None, remarkName=None, nickName=None,
             wechatAccount=None):
         with self.updateLock:
             if (name or userName or remarkName or nickName or wechatAccount) is None:
-                return copy.deepcopy(self.memberList[0]) # my own account
+                return copy.copy(self.memberList[0]) # my own account
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.find(userName)
+                if m is not None:
+                    return copy.copy(m)
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -81,6 +83,8 @@ class Storage(object):
                     for m in self.memberList:
                         if any([m.get(k) == name for k in ('RemarkName', 'NickName', 'Alias')]):
                             contact.append(m)
+                elif nickName is not None:
+                    contact = self.memberList.find_by_nickname(nickName)
                 else:
                     contact = self.memberList[:]
                 if matchDict: # select again based on matchDict
@@ -88,30 +92,30 @@ class Storage(object):
                     for m in contact:
                         if all([m.get(k) == v for k, v in matchDict.items()]):
                             friendList.append(m)
-                    return copy.deepcopy(friendList)
+                    return [copy.copy(m) for m in friendList]
                 else:
-                    return copy.deepcopy(contact)
+                    return [copy.copy(m) for m in contact]
     def search_chatrooms(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.chatroomList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.chatroomList.find(userName)
+                if m is not None:
+                    return copy.copy(m)
             elif name is not None:
                 matchList = []
                 for m in self.chatroomList:
                     if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
+                        matchList.append(copy.copy(m))
                 return matchList
     def search_mps(self, name=None, userName=None):
         with self.updateLock:
             if userName is not None:
-                for m in self.mpList:
-                    if m['UserName'] == userName:
-                        return copy.deepcopy(m)
+                m = self.mpList.find(userName)
+                if m is not None:
+                    return copy.copy(m)
             elif name is not None:
                 matchList = []
                 for m in self.mpList:
                     if name in m['NickName']:
-                        matchList.append(copy.deepcopy(m))
+                        matchList.append(copy.copy(m))
                 return matchList
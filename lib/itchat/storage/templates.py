@@ -1,6 +1,7 @@
 import logging, copy, pickle
 from weakref import ref
 
+from .. import utils
 from ..returnvalues import ReturnValue
 from ..utils import update_info_dict
 
@@ -48,6 +49,53 @@ class ContactList(list):
         if self.contactInitFn is not None:
             contact = self.contactInitFn(self, contact) or contact
         super(ContactList, self).append(contact)
+        self._indexDirty = True
+    # any structural change invalidates the indexes, they are rebuilt lazily on next lookup
+    # extend is kept as plain list.extend because pickle restores items through it
+    def extend(self, values):
+        super(ContactList, self).extend(values)
+        self._indexDirty = True
+    def insert(self, i, value):
+        super(ContactList, self).insert(i, value)
+        self._indexDirty = True
+    def pop(self, *args):
+        self._indexDirty = True
+        return super(ContactList, self).pop(*args)
+    def remove(self, value):
+        super(ContactList, self).remove(value)
+        self._indexDirty = True
+    def clear(self):
+        super(ContactList, self).clear()
+        self._indexDirty = True
+    def __setitem__(self, key, value):
+        super(ContactList, self).__setitem__(key, value)
+        self._indexDirty = True
+    def __delitem__(self, key):
+        super(ContactList, self).__delitem__(key)
+        self._indexDirty = True
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+    def reindex(self):
+        ''' mark indexes as stale, call it after contacts' NickName may have changed in place '''
+        self._indexDirty = True
+    def _build_index(self):
+        userNameIndex, nickNameIndex = {}, {}
+        for contact in self:
+            userNameIndex.setdefault(contact.get('UserName'), contact)
+            nickNameIndex.setdefault(contact.get('NickName'), []).append(contact)
+        self._userNameIndex, self._nickNameIndex = userNameIndex, nickNameIndex
+        self._indexDirty = False
+    def find(self, userName):
+        ''' O(1) lookup by UserName, returns the stored contact itself (first match) or None '''
+        if getattr(self, '_indexDirty', True):
+            self._build_index()
+        return self._userNameIndex.get(userName)
+    def find_by_nickname(self, nickName):
+        ''' O(1) lookup by exact NickName, returns a list of stored contacts '''
+        if getattr(self, '_indexDirty', True):
+            self._build_index()
+        return list(self._nickNameIndex.get(nickName, ()))
     def __deepcopy__(self, memo):
         r = self.__class__([copy.deepcopy(v) for v in self])
         r.contactInitFn = self.contactInitFn
@@ -130,6 +178,13 @@ class AbstractUserDict(AttributeDict):
             r[copy.deepcopy(k)] = copy.deepcopy(v)
         r.core = self.core
         return r
+    def __copy__(self):
+        ''' shallow view: top level keys can be changed freely, nested values
+            (e.g. MemberList) are shared with storage and should be treated as read-only '''
+        r = self.__class__.__new__(self.__class__)
+        dict.update(r, self)
+        r.__dict__.update(self.__dict__)
+        return r
     def __str__(self):
         return '{%s}' % ', '.join(
             ['%s: %s' % (repr(k),repr(v)) for k,v in self.items()])
@@ -192,6 +247,8 @@ class Chatroom(AbstractUserDict):
         return getattr(self, '_core', lambda: fakeItchat)() or fakeItchat
     @core.setter
     def core(self, value):
+        if getattr(self, '_core', lambda: None)() is value:
+            return # members already bound, skip walking the whole MemberList
         self._core = ref(value)
         self.memberList.core = value
         for member in self.memberList:
@@ -216,9 +273,10 @@ class Chatroom(AbstractUserDict):
             if (name or userName or remarkName or nickName or wechatAccount) is None:
                 return None
             elif userName: # return the only userName match
-                for m in self.memberList:
-                    if m.userName == userName:
-                        return copy.deepcopy(m)
+                m = self.memberList.find(userName) if isinstance(self.memberList, ContactList) \
+                    else utils.search_dict_list(self.memberList, 'UserName', userName)
+                if m is not None:
+                    return copy.copy(m)
             else:
                 matchDict = {
                     'RemarkName' : remarkName,
@@ -239,9 +297,9 @@ class Chatroom(AbstractUserDict):
                     for m in contact:
                         if all([m.get(k) == v for k, v in matchDict.items()]):
                             friendList.append(m)
-                    return copy.deepcopy(friendList)
+                    return [copy.copy(m) for m in friendList]
                 else:
-                    return copy.deepcopy(contact)
+                    return [copy.copy(m) for m in contact]
     def __setstate__(self, state):
         super(Chatroom, self).__setstate__(state)
         if not 'MemberList' in self:
@@ -1,5 +1,6 @@
 # encoding:utf-8
 
+import hashlib
 import json
 import os
 
@@ -38,13 +39,21 @@ class Banwords(Plugin):
             self.searchr = WordsSearch()
             self.action = conf["action"]
             banwords_path = os.path.join(curdir, "banwords.txt")
-            with open(banwords_path, "r", encoding="utf-8") as f:
+            with open(banwords_path, "rb") as f:
+                raw = f.read()
+            # 编译好的自动机缓存到文件，词库未变化时直接加载
+            cache_path = os.path.join(curdir, "banwords.cache")
+            use_cache = conf.get("cache", True)
+            digest = hashlib.md5(raw).hexdigest()
+            if not (use_cache and self._load_cache(cache_path, digest)):
                 words = []
-                for line in f:
+                for line in raw.decode("utf-8").split("\n"):
                     word = line.strip()
                     if word:
                         words.append(word)
-            self.searchr.SetKeywords(words)
+                self.searchr.SetKeywords(words)
+                if use_cache:
+                    self._save_cache(cache_path, digest)
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             if conf.get("reply_filter", True):
                 self.handlers[Event.ON_DECORATE_REPLY] = self.on_decorate_reply
@@ -54,6 +63,21 @@ class Banwords(Plugin):
             logger.warn("[Banwords] init failed, ignore or see https://github.com/zhayujie/chatgpt-on-wechat/tree/master/plugins/banwords .")
             raise e
 
+    def _load_cache(self, cache_path, digest):
+        try:
+            if self.searchr.Load(cache_path, digest):
+                logger.info("[Banwords] loaded compiled banwords from cache")
+                return True
+        except Exception as e:
+            logger.warning("[Banwords] load cache failed: {}".format(e))
+        return False
+
+    def _save_cache(self, cache_path, digest):
+        try:
+            self.searchr.Save(cache_path, digest)
+        except Exception as e:
+            logger.warning("[Banwords] save cache failed: {}".format(e))
+
     def on_handle_context(self, e_context: EventContext):
         if e_context["context"].type not in [
             ContextType.TEXT,
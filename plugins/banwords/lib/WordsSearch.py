@@ -6,245 +6,258 @@
 # 更新日志
 # 2020.04.06 第一次提交
 # 2020.05.16 修改，支持大于0xffff的字符
+# 2026.10.17 改为数组存储的AC自动机，节点不再是Python对象，支持序列化到文件后直接加载
+
+import json
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
 
 __all__ = ['WordsSearch']
 __author__ = 'Lin Zhijun'
 __date__ = '2020.05.16'
 
-class TrieNode():
-    def __init__(self):
-        self.Index = 0
-        self.Index = 0
-        self.Layer = 0
-        self.End = False
-        self.Char = ''
-        self.Results = []
-        self.m_values = {}
-        self.Failure = None
-        self.Parent = None
-
-    def Add(self,c):
-        if c in self.m_values :
-            return self.m_values[c]
-        node = TrieNode()
-        node.Parent = self
-        node.Char = c
-        self.m_values[c] = node
-        return node
-
-    def SetResults(self,index):
-        if (self.End == False):
-            self.End = True
-        self.Results.append(index)
-
-class TrieNode2():
-    def __init__(self):
-        self.End = False
-        self.Results = []
-        self.m_values = {}
-        self.minflag = 0xffff
-        self.maxflag = 0
-
-    def Add(self,c,node3):
-        if (self.minflag > c):
-            self.minflag = c
-        if (self.maxflag < c):
-             self.maxflag = c
-        self.m_values[c] = node3
-
-    def SetResults(self,index):
-        if (self.End == False) :
-            self.End = True
-        if (index in self.Results )==False : 
-            self.Results.append(index)
-
-    def HasKey(self,c):
-        return c in self.m_values
-        
- 
-    def TryGetValue(self,c):
-        if (self.minflag <= c and self.maxflag >= c):
-            if c in self.m_values:
-                return self.m_values[c]
-        return None
+_MAGIC = b"WSAC\x01"
+_ARRAYS = ("_root_next", "_child_start", "_edge_code", "_single", "_fail", "_first", "_link", "_out_start", "_out_ids", "_offsets")
 
 
 class WordsSearch():
+    """
+    字符先按出现频率编码为从1开始的整数，不在任何关键词中的字符直接回到根节点
+    状态按广度优先编号，同一状态的子状态编号连续且按字符编码升序排列：
+    子状态为 child_start[s] 到 child_start[s + 1] 之间的状态，edge_code[t] 为进入状态t的字符编码；
+    匹配时根节点的转移按编码直接索引 root_next，只有一个子状态的(绝大多数)比较 single[s]，
+    有多个子状态的(single[s]为-1)查 multi 字典，没有转移时沿失败指针fail回退
+    first[s] 为在状态s结束的第一个关键词(包含沿失败指针可达的)，没有则为-1；
+    link[s] 为沿失败指针最近的有关键词结束的状态，配合 out_start/out_ids 列出所有命中的关键词
+    所有表都是array('i')，关键词拼接为一个字符串按offsets切分
+    """
+
     def __init__(self):
-        self._first = {}
-        self._keywords = []
-        self._indexs=[]
-    
-    def SetKeywords(self,keywords):
-        self._keywords = keywords
-        self._indexs=[]
-        for i in range(len(keywords)):
-            self._indexs.append(i)
-
-        root = TrieNode()
-        allNodeLayer={}
-
-        for i in range(len(self._keywords)): # for (i = 0; i < _keywords.length; i++) 
-            p = self._keywords[i]
-            nd = root
-            for j in range(len(p)): # for (j = 0; j < p.length; j++) 
-                nd = nd.Add(ord(p[j]))
-                if (nd.Layer == 0):
-                    nd.Layer = j + 1
-                    if nd.Layer in allNodeLayer:
-                        allNodeLayer[nd.Layer].append(nd)
-                    else:
-                        allNodeLayer[nd.Layer]=[]
-                        allNodeLayer[nd.Layer].append(nd)
-            nd.SetResults(i)
-
-
-        allNode = []
-        allNode.append(root)
-        for key in allNodeLayer.keys():
-            for nd in allNodeLayer[key]:
-                allNode.append(nd)
-        allNodeLayer=None
-
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            if i==0 :
+        self._codes = {}
+        self._alphabet = ""
+        self._text = ""
+        for name in _ARRAYS:
+            setattr(self, name, array('i'))
+        self._child_start.extend([1, 1])
+        self._single.append(0)
+        self._first.append(-1)
+        self._multi = {}
+
+    def SetKeywords(self, keywords):
+        keywords = list(keywords)
+        counter = Counter()
+        for keyword in keywords:
+            counter.update(keyword)
+        alphabet = "".join(ch for ch, _ in counter.most_common())
+        codes = {ch: i + 1 for i, ch in enumerate(alphabet)}
+        # 按编码序列排序后，同一前缀的关键词是连续的一段，逐层按段构建，不需要临时的节点对象
+        entries = sorted((tuple(codes[ch] for ch in keyword), i) for i, keyword in enumerate(keywords) if keyword)
+
+        root_next = [0] * (len(alphabet) + 1)
+        child_start = [1]
+        edge_code = [0]
+        fail = [0]
+        own = {}  # 状态 -> 在该状态结束的关键词下标
+
+        def goto(s, c):
+            if not s:
+                return root_next[c]
+            lo, hi = child_start[s], child_start[s + 1]
+            i = bisect_left(edge_code, c, lo, hi)
+            return i if i < hi and edge_code[i] == c else 0
+
+        # 状态按出队顺序处理，子状态入队时编号，因此处理完状态s后追加的就是 child_start[s + 1]
+        queue = deque([(0, 0, 0, len(entries))])
+        while queue:
+            s, depth, lo, hi = queue.popleft()
+            i = lo
+            while i < hi and len(entries[i][0]) == depth:
+                own.setdefault(s, []).append(entries[i][1])
+                i += 1
+            while i < hi:
+                c = entries[i][0][depth]
+                j = i + 1
+                while j < hi and entries[j][0][depth] == c:
+                    j += 1
+                t = len(edge_code)
+                edge_code.append(c)
+                if s:
+                    f = fail[s]
+                    while f and not goto(f, c):
+                        f = fail[f]
+                    fail.append(goto(f, c))
+                else:
+                    root_next[c] = t
+                    fail.append(0)
+                queue.append((t, depth + 1, i, j))
+                i = j
+            child_start.append(len(edge_code))
+
+        size = len(edge_code)
+        single = [0] * size
+        first = [-1] * size
+        link = [-1] * size
+        for s in range(1, size):
+            count = child_start[s + 1] - child_start[s]
+            if count == 1:
+                single[s] = edge_code[child_start[s]]
+            elif count > 1:
+                single[s] = -1
+            f = fail[s]
+            link[s] = f if f in own else link[f]
+            first[s] = own[s][0] if s in own else first[f]
+        out_start = [0] * (size + 1)
+        out_ids = []
+        for s in range(size):
+            out_ids.extend(own.get(s, ()))
+            out_start[s + 1] = len(out_ids)
+        offsets = [0]
+        for keyword in keywords:
+            offsets.append(offsets[-1] + len(keyword))
+
+        self._codes = codes
+        self._alphabet = alphabet
+        self._text = "".join(keywords)
+        self._root_next = array('i', root_next)
+        self._child_start = array('i', child_start)
+        self._edge_code = array('i', edge_code)
+        self._single = array('i', single)
+        self._fail = array('i', fail)
+        self._first = array('i', first)
+        self._link = array('i', link)
+        self._out_start = array('i', out_start)
+        self._out_ids = array('i', out_ids)
+        self._offsets = array('i', offsets)
+        self._build_multi()
+
+    def _build_multi(self):
+        """多个子状态的转移放入以 状态 * (字符种类 + 1) + 编码 为key的字典"""
+        width = len(self._alphabet) + 1
+        child_start, edge_code = self._child_start, self._edge_code
+        multi = {}
+        for s, code in enumerate(self._single):
+            if code < 0:
+                for t in range(child_start[s], child_start[s + 1]):
+                    multi[s * width + edge_code[t]] = t
+        self._multi = multi
+
+    def Save(self, path, tag=""):
+        """
+        将编译好的自动机写入文件，tag用于加载时校验词库是否变化
+        """
+        header = {
+            "tag": tag,
+            "byteorder": sys.byteorder,
+            "itemsize": array('i').itemsize,
+            "alphabet": self._alphabet,
+            "text": self._text,
+            "arrays": [len(getattr(self, name)) for name in _ARRAYS],
+        }
+        header = json.dumps(header, ensure_ascii=False).encode("utf-8")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for name in _ARRAYS:
+                getattr(self, name).tofile(f)
+        os.replace(tmp_path, path)
+
+    def Load(self, path, tag=None):
+        """
+        从Save生成的文件加载自动机，文件不存在、格式不符或tag不一致时返回False
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                return False
+            header = json.loads(f.read(int.from_bytes(f.read(4), "little")).decode("utf-8"))
+            if tag is not None and header["tag"] != tag:
+                return False
+            if header["byteorder"] != sys.byteorder or header["itemsize"] != array('i').itemsize:
+                return False
+            arrays = {}
+            for name, length in zip(_ARRAYS, header["arrays"]):
+                arr = array('i')
+                arr.fromfile(f, length)
+                arrays[name] = arr
+        for name, arr in arrays.items():
+            setattr(self, name, arr)
+        self._alphabet = header["alphabet"]
+        self._text = header["text"]
+        self._codes = {ch: i + 1 for i, ch in enumerate(self._alphabet)}
+        self._build_multi()
+        return True
+
+    def _keyword(self, index):
+        return self._text[self._offsets[index]:self._offsets[index + 1]]
+
+    def _result(self, index, end):
+        keyword = self._keyword(index)
+        return {"Keyword": keyword, "Success": True, "End": end, "Start": end + 1 - len(keyword), "Index": index}
+
+    def _scan(self, text):
+        """逐字符推进自动机，依次产出 (位置, 状态)，只产出有关键词结束的状态"""
+        code_of = self._codes.get
+        multi_get = self._multi.get
+        width = len(self._alphabet) + 1
+        root_next, child_start, single = self._root_next, self._child_start, self._single
+        fail, first = self._fail, self._first
+        s = 0
+        for index, ch in enumerate(text):
+            c = code_of(ch)
+            if c is None:
+                s = 0
                 continue
-            nd=allNode[i]
-            nd.Index = i
-            r = nd.Parent.Failure
-            c = nd.Char
-            while (r != None and (c in r.m_values)==False):
-                r = r.Failure
-            if (r == None):
-                nd.Failure = root
-            else:
-                nd.Failure = r.m_values[c]
-                for key2 in nd.Failure.Results :
-                    nd.SetResults(key2)
-        root.Failure = root
-
-        allNode2 = []
-        for i in range(len(allNode)): # for (i = 0; i < allNode.length; i++) 
-            allNode2.append( TrieNode2())
-        
-        for i in range(len(allNode2)): # for (i = 0; i < allNode2.length; i++) 
-            oldNode = allNode[i]
-            newNode = allNode2[i]
-
-            for key in oldNode.m_values :
-                index = oldNode.m_values[key].Index
-                newNode.Add(key, allNode2[index])
-            
-            for index in range(len(oldNode.Results)): # for (index = 0; index < oldNode.Results.length; index++) 
-                item = oldNode.Results[index]
-                newNode.SetResults(item)
-            
-            oldNode=oldNode.Failure
-            while oldNode != root:
-                for key in oldNode.m_values :
-                    if (newNode.HasKey(key) == False):
-                        index = oldNode.m_values[key].Index
-                        newNode.Add(key, allNode2[index])
-                for index in range(len(oldNode.Results)): 
-                    item = oldNode.Results[index]
-                    newNode.SetResults(item)
-                oldNode=oldNode.Failure
-        allNode = None
-        root = None
-
-        # first = []
-        # for index in range(65535):# for (index = 0; index < 0xffff; index++) 
-        #     first.append(None)
-        
-        # for key in allNode2[0].m_values :
-        #     first[key] = allNode2[0].m_values[key]
-        
-        self._first = allNode2[0]
-    
-
-    def FindFirst(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
+            while s:
+                code = single[s]
+                if code == c:
+                    s = child_start[s]
+                    break
+                if code < 0:
+                    t = multi_get(s * width + c)
+                    if t:
+                        s = t
+                        break
+                s = fail[s]
             else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    item = tn.Results[0]
-                    keyword = self._keywords[item]
-                    return { "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] }
-            ptr = tn
+                s = root_next[c]
+            if first[s] >= 0:
+                yield index, s
+
+    def FindFirst(self, text):
+        for index, s in self._scan(text):
+            return self._result(self._first[s], index)
         return None
 
-    def FindAll(self,text):
-        ptr = None
-        list = []
+    def FindAll(self, text):
+        out_start, out_ids, link = self._out_start, self._out_ids, self._link
+        results = []
+        for index, s in self._scan(text):
+            if out_start[s] == out_start[s + 1]:
+                s = link[s]
+            while s >= 0:
+                for i in range(out_start[s], out_start[s + 1]):
+                    results.append(self._result(out_ids[i], index))
+                s = link[s]
+        return results
 
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-                
-            
-            if (tn != None):
-                if (tn.End):
-                    for j in range(len(tn.Results)): # for (j = 0; j < tn.Results.length; j++) 
-                        item = tn.Results[j]
-                        keyword = self._keywords[item]
-                        list.append({ "Keyword": keyword, "Success": True, "End": index, "Start": index + 1 - len(keyword), "Index": self._indexs[item] })
-            ptr = tn
-        return list
-
-
-    def ContainsAny(self,text):
-        ptr = None
-        for index in range(len(text)): # for (index = 0; index < text.length; index++) 
-            t =ord(text[index]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    return True
-            ptr = tn
+    def ContainsAny(self, text):
+        for _ in self._scan(text):
+            return True
         return False
-    
-    def Replace(self,text, replaceChar = '*'):
-        result = list(text) 
-
-        ptr = None
-        for i in range(len(text)): # for (i = 0; i < text.length; i++) 
-            t =ord(text[i]) # text.charCodeAt(index)
-            tn = None
-            if (ptr == None):
-                tn = self._first.TryGetValue(t)
-            else:
-                tn = ptr.TryGetValue(t)
-                if (tn==None):
-                    tn = self._first.TryGetValue(t)
-            
-            if (tn != None):
-                if (tn.End):
-                    maxLength = len( self._keywords[tn.Results[0]])
-                    start = i + 1 - maxLength
-                    for j in range(start,i+1): # for (j = start; j <= i; j++) 
-                        result[j] = replaceChar
-            ptr = tn
-        return ''.join(result) 
\ No newline at end of file
+
+    def Replace(self, text, replaceChar='*'):
+        result = None
+        for index, s in self._scan(text):
+            if result is None:
+                result = list(text)
+            i = self._first[s]
+            start = index + 1 - (self._offsets[i + 1] - self._offsets[i])
+            for j in range(start, index + 1):
+                result[j] = replaceChar
+        return text if result is None else ''.join(result)
@@ -4,18 +4,22 @@ import os
 import uuid
 from uuid import getnode as get_mac
 
-import requests
 
 import plugins
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from common.log import logger
+from common import http_client
+from common.token_cache import get_token_cache
 from plugins import *
 
 """利用百度UNIT实现智能对话
     如果命中意图，返回意图对应的回复，否则返回继续交付给下个插件处理
 """
 
+# access_token无效或已过期的错误码
+TOKEN_ERROR_CODES = (110, 111)
+
 
 @plugins.register(
     name="BDunit",
@@ -35,7 +39,8 @@ class BDunit(Plugin):
             self.service_id = conf["service_id"]
             self.api_key = conf["api_key"]
             self.secret_key = conf["secret_key"]
-            self.access_token = self.get_token()
+            self.token_cache = get_token_cache("bdunit:{}".format(self.api_key), self._request_token)
+            self.get_token()
             self.handlers[Event.ON_HANDLE_CONTEXT] = self.on_handle_context
             logger.info("[BDunit] inited")
         except Exception as e:
@@ -64,21 +69,41 @@ class BDunit(Plugin):
         help_text = "本插件会处理询问实时日期时间，天气，数学运算等问题，这些技能由您的百度智能对话UNIT决定\n"
         return help_text
 
+    def _post_unit(self, url, body):
+        """调用UNIT接口，access_token被提前吊销时刷新后重试一次，失败返回 None"""
+        def request(token):
+            headers = {"Content-Type": "application/json"}
+            response = http_client.post(url + "?access_token=" + str(token), json=body, headers=headers)
+            return json.loads(response.text)
+
+        try:
+            return self.token_cache.request(request, lambda res: res.get("error_code") in TOKEN_ERROR_CODES)
+        except Exception:
+            return None
+
     def get_token(self):
-        """获取访问百度UUNIT 的access_token
+        """获取访问百度UUNIT 的access_token，使用缓存，临近过期时自动刷新
+        Returns:
+            string: access_token
+        """
+        return self.token_cache.get()
+
+    def _request_token(self):
+        """请求百度UUNIT 的access_token
         #param api_key: UNIT apk_key
         #param secret_key: UNIT secret_key
         Returns:
-            string: access_token
+            (access_token, expires_in)
         """
         url = "https://aip.baidubce.com/oauth/2.0/token?client_id={}&client_secret={}&grant_type=client_credentials".format(self.api_key, self.secret_key)
         payload = ""
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
 
-        response = requests.request("POST", url, headers=headers, data=payload)
+        response = http_client.request("POST", url, headers=headers, data=payload)
 
         # print(response.text)
-        return response.json()["access_token"]
+        res = response.json()
+        return res["access_token"], res.get("expires_in")
 
     def getUnit(self, query):
         """
@@ -87,7 +112,7 @@ class BDunit(Plugin):
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
 
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat?access_token=" + self.access_token
+        url = "https://aip.baidubce.com/rpc/2.0/unit/service/v3/chat"
         request = {
             "query": query,
             "user_id": str(get_mac())[:32],
@@ -100,12 +125,7 @@ class BDunit(Plugin):
             "session_id": str(uuid.uuid1()),
             "request": request,
         }
-        try:
-            headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
-            return json.loads(response.text)
-        except Exception:
-            return None
+        return self._post_unit(url, body)
 
     def getUnit2(self, query):
         """
@@ -114,7 +134,7 @@ class BDunit(Plugin):
         :param query: 用户的指令字符串
         :returns: UNIT 解析结果。如果解析失败，返回 None
         """
-        url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat?access_token=" + self.access_token
+        url = "https://aip.baidubce.com/rpc/2.0/unit/service/chat"
         request = {"query": query, "user_id": str(get_mac())[:32]}
         body = {
             "log_id": str(uuid.uuid1()),
@@ -123,12 +143,7 @@ class BDunit(Plugin):
             "session_id": str(uuid.uuid1()),
             "request": request,
         }
-        try:
-            headers = {"Content-Type": "application/json"}
-            response = requests.post(url, json=body, headers=headers)
-            return json.loads(response.text)
-        except Exception:
-            return None
+        return self._post_unit(url, body)
 
     def getIntent(self, parsed):
         """
@@ -12,8 +12,12 @@ import plugins
 from bridge.bridge import Bridge
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
+from bot.reply_cache import get_reply_cache
 from common import const
+from common import http_client
+from common.handler_pool import handler_pools
 from config import conf, load_config, global_config
+from voice.tts_cache import get_tts_cache
 from plugins import *
 
 # 定义指令集
@@ -131,6 +135,25 @@ ADMIN_COMMANDS = {
         "alias": ["debug", "调试模式", "DEBUG"],
         "desc": "开启机器调试日志",
     },
+    "pool": {
+        "alias": ["pool", "线程池"],
+        "desc": "打印消息处理线程池和HTTP连接池状态",
+    },
+    "pstats": {
+        "alias": ["pstats", "插件耗时"],
+        "args": ["reset(可选)"],
+        "desc": "打印各插件处理事件的次数、耗时和异常，带reset参数时清空统计",
+    },
+    "rcache": {
+        "alias": ["rcache", "回复缓存"],
+        "args": ["clear(可选)"],
+        "desc": "打印回复缓存的命中率，带clear参数时清空缓存",
+    },
+    "tcache": {
+        "alias": ["tcache", "语音缓存"],
+        "args": ["clear(可选)"],
+        "desc": "打印语音合成缓存的命中率，带clear参数时清空缓存",
+    },
 }
 
 
@@ -352,6 +375,59 @@ class Godcmd(Plugin):
                             else:
                                 logger.setLevel(logging.DEBUG)
                                 ok, result = True, "DEBUG模式已开启"
+                        elif cmd == "pool":
+                            ok = True
+                            result = "线程池状态：\n"
+                            for stat in handler_pools.stats():
+                                result += "{name}: 线程 {busy}/{workers}(上限{max_workers}) 排队 {queue_depth} 完成 {completed} 失败 {failed}\n".format(**stat)
+                                result += "  排队平均{:.2f}s 最大{:.2f}s, 执行平均{:.2f}s 最大{:.2f}s\n".format(
+                                    stat["wait_avg"], stat["wait_max"], stat["run_avg"], stat["run_max"])
+                            http_stats = http_client.stats()
+                            result += "HTTP连接池：请求 {requests} 复用 {hits} 新建连接 {misses}\n".format(**http_stats)
+                            for host, stat in http_stats["hosts"].items():
+                                result += "  {}: 请求 {requests} 复用 {hits} 新建连接 {misses}\n".format(host, **stat)
+                        elif cmd == "rcache":
+                            cache = get_reply_cache()
+                            if cache is None:
+                                ok, result = False, "未开启回复缓存"
+                            elif len(args) == 1 and args[0] == "clear":
+                                cache.clear()
+                                cache.reset_stats()
+                                ok, result = True, "回复缓存已清空"
+                            else:
+                                stat = cache.stats()
+                                ok = True
+                                result = "回复缓存：条数 {size} 命中 {hits}(近似 {near_hits}) 未命中 {misses} 写入 {stores} 命中率 {:.1%}".format(
+                                    stat["hit_rate"], **stat)
+                        elif cmd == "tcache":
+                            cache = get_tts_cache()
+                            if cache is None:
+                                ok, result = False, "未开启语音合成缓存"
+                            elif len(args) == 1 and args[0] == "clear":
+                                cache.clear()
+                                cache.reset_stats()
+                                ok, result = True, "语音合成缓存已清空"
+                            else:
+                                stat = cache.stats()
+                                ok = True
+                                result = "语音合成缓存：条数 {size} 占用 {:.1f}MB 命中 {hits} 未命中 {misses} 写入 {stores} 淘汰 {evictions} 命中率 {:.1%}".format(
+                                    stat["bytes"] / 1024 / 1024, stat["hit_rate"], **stat)
+                        elif cmd == "pstats":
+                            ok = True
+                            if len(args) == 1 and args[0] == "reset":
+                                PluginManager().reset_hook_stats()
+                                result = "插件耗时统计已清空"
+                            else:
+                                result = "插件耗时统计：\n"
+                                hook_stats = sorted(PluginManager().get_hook_stats(), key=lambda item: item[2]["p99"], reverse=True)
+                                for name, event, stat in hook_stats:
+                                    if not stat["count"]:
+                                        continue
+                                    result += "{}.{}: 次数 {count} p50 {:.1f}ms p99 {:.1f}ms 最大 {:.1f}ms 异常 {exceptions} 超时 {over_budget}\n".format(
+                                        name, event.name, stat["p50"] * 1000, stat["p99"] * 1000, stat["max"] * 1000, **stat)
+                                skipped = PluginManager().skipped_hooks
+                                if skipped:
+                                    result += "已跳过：" + ", ".join("{}.{}".format(name, event.name) for name, event in skipped) + "\n"
                         elif cmd == "plist":
                             plugins = PluginManager().list_plugins()
                             ok = True
@@ -5,7 +5,11 @@ import importlib.util
 import json
 import os
 import sys
+import threading
+import time
+from collections import deque
 
+from common import metrics, tracing
 from common.log import logger
 from common.singleton import singleton
 from common.sorted_dict import SortedDict
@@ -14,6 +18,47 @@ from config import conf, write_plugin_config
 from .event import *
 
 
+class HookStats:
+    """
+    单个插件在单个事件上的耗时统计，保留最近samples_size次耗时用于计算分位数
+    """
+
+    def __init__(self, samples_size=1024):
+        self.count = 0
+        self.exceptions = 0
+        self.over_budget = 0
+        self.consecutive_over = 0  # 连续超出时间预算的次数
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = deque(maxlen=samples_size)
+
+    def record(self, cost, failed=False):
+        self.count += 1
+        self.total += cost
+        if cost > self.max:
+            self.max = cost
+        self.samples.append(cost)
+        if failed:
+            self.exceptions += 1
+
+    def percentile(self, p):
+        samples = sorted(self.samples)
+        if not samples:
+            return 0.0
+        return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "exceptions": self.exceptions,
+            "over_budget": self.over_budget,
+            "avg": self.total / self.count if self.count else 0.0,
+            "p50": self.percentile(0.5),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
 @singleton
 class PluginManager:
     def __init__(self):
@@ -23,6 +68,11 @@ class PluginManager:
         self.pconf = {}
         self.current_plugin_path = None
         self.loaded = {}
+        # 每个事件预先编排好的处理链 event -> ((name, handler, stats), ...)，只在插件开启、关闭、调整优先级或重载时重建
+        self.dispatch = {}
+        self.hook_stats = {}  # (name, event) -> HookStats
+        self.skipped_hooks = set()  # 因连续超出时间预算被暂时移出处理链的 (name, event)
+        self.dispatch_lock = threading.Lock()
 
     def register(self, name: str, desire_priority: int = 0, **kwargs):
         def wrapper(plugincls):
@@ -136,6 +186,30 @@ class PluginManager:
     def refresh_order(self):
         for event in self.listening_plugins.keys():
             self.listening_plugins[event].sort(key=lambda name: self.plugins[name].priority, reverse=True)
+        self.rebuild_dispatch()
+
+    def rebuild_dispatch(self):
+        """
+        重新生成各事件的处理链，生成后整体替换，emit_event读取到的总是完整的不可变tuple
+        """
+        with self.dispatch_lock:
+            dispatch = {}
+            for event, names in self.listening_plugins.items():
+                chain = []
+                for name in names:
+                    if name not in self.plugins or not self.plugins[name].enabled or name not in self.instances:
+                        continue
+                    if (name, event) in self.skipped_hooks:
+                        continue
+                    handler = self.instances[name].handlers.get(event)
+                    if handler is None:
+                        continue
+                    stats = self.hook_stats.get((name, event))
+                    if stats is None:
+                        stats = self.hook_stats[(name, event)] = HookStats()
+                    chain.append((name, handler, stats))
+                dispatch[event] = tuple(chain)
+            self.dispatch = dispatch
 
     def activate_plugins(self):  # 生成新开启的插件实例
         failed_plugins = []
@@ -155,7 +229,8 @@ class PluginManager:
                 for event in instance.handlers:
                     if event not in self.listening_plugins:
                         self.listening_plugins[event] = []
-                    self.listening_plugins[event].append(name)
+                    if name not in self.listening_plugins[event]:
+                        self.listening_plugins[event].append(name)
         self.refresh_order()
         return failed_plugins
 
@@ -166,6 +241,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.instances[name]
+            self.skipped_hooks = {hook for hook in self.skipped_hooks if hook[0] != name}
             self.activate_plugins()
             return True
         return False
@@ -183,17 +259,68 @@ class PluginManager:
         self.activate_plugins()
 
     def emit_event(self, e_context: EventContext, *args, **kwargs):
-        if e_context.event in self.listening_plugins:
-            for name in self.listening_plugins[e_context.event]:
-                if self.plugins[name].enabled and e_context.action == EventAction.CONTINUE:
-                    logger.debug("Plugin %s triggered by event %s" % (name, e_context.event))
-                    instance = self.instances[name]
-                    instance.handlers[e_context.event](e_context, *args, **kwargs)
-                    if e_context.is_break():
-                        e_context["breaked_by"] = name
-                        logger.debug("Plugin %s breaked event %s" % (name, e_context.event))
+        chain = self.dispatch.get(e_context.event)
+        if not chain:
+            return e_context
+        budget = conf().get("plugin_time_budget", 0)
+        for name, handler, stats in chain:
+            if e_context.action != EventAction.CONTINUE:
+                break
+            logger.debug("Plugin %s triggered by event %s", name, e_context.event)
+            start = time.perf_counter()
+            try:
+                with tracing.span("plugin", plugin=name, event=e_context.event.name):
+                    handler(e_context, *args, **kwargs)
+            except Exception:
+                stats.record(time.perf_counter() - start, failed=True)
+                raise
+            cost = time.perf_counter() - start
+            stats.record(cost)
+            metrics.observe("plugin_seconds", cost, plugin=name, event=e_context.event.name)
+            if budget:
+                self._check_budget(name, e_context.event, stats, cost, budget)
+            if e_context.is_break():
+                e_context["breaked_by"] = name
+                logger.debug("Plugin %s breaked event %s", name, e_context.event)
         return e_context
 
+    def has_handlers(self, *events):
+        """是否有已启用的插件处理其中任一事件"""
+        dispatch = self.dispatch
+        return any(dispatch.get(event) for event in events)
+
+    def _check_budget(self, name, event, stats, cost, budget):
+        """
+        插件处理超出时间预算时告警，连续超出plugin_budget_max_overruns次后暂时移出该事件的处理链，
+        重载插件或执行 #pstats reset 后恢复
+        """
+        if isinstance(budget, dict):
+            budget = budget.get(self.plugins[name].name, budget.get("default", 0))
+            if not budget:
+                return
+        if cost <= budget:
+            stats.consecutive_over = 0
+            return
+        stats.over_budget += 1
+        stats.consecutive_over += 1
+        logger.warning("Plugin %s handle event %s cost %.3fs, exceeds budget %ss" % (name, event, cost, budget))
+        max_overruns = conf().get("plugin_budget_max_overruns", 0)
+        if max_overruns and stats.consecutive_over >= max_overruns:
+            logger.error("Plugin %s exceeds budget %d times in a row, skip it on event %s" % (name, stats.consecutive_over, event))
+            self.skipped_hooks.add((name, event))
+            self.rebuild_dispatch()
+
+    def get_hook_stats(self):
+        """
+        返回 [(name, event, summary), ...]
+        """
+        return [(name, event, stats.summary()) for (name, event), stats in list(self.hook_stats.items())]
+
+    def reset_hook_stats(self):
+        self.hook_stats = {}
+        self.skipped_hooks = set()
+        self.rebuild_dispatch()
+
     def set_plugin_priority(self, name: str, priority: int):
         name = name.upper()
         if name not in self.plugins:
@@ -233,6 +360,7 @@ class PluginManager:
             rawname = self.plugins[name].name
             self.pconf["plugins"][rawname]["enabled"] = False
             self.save_config()
+            self.rebuild_dispatch()
             return True
         return True
 
@@ -331,6 +459,7 @@ class PluginManager:
                 if name in self.listening_plugins[event]:
                     self.listening_plugins[event].remove(name)
             del self.plugins[name]
+            self.rebuild_dispatch()
             del self.pconf["plugins"][rawname]
             self.loaded[dirname] = None
             self.save_config()
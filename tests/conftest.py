@@ -0,0 +1,52 @@
+import pytest
+
+from common import http_client
+from config import conf
+from tests.wecom_fake import FakeWeComApi
+
+WECOM_CONF = {
+    "wechatcom_corp_id": "ww_test_corp",
+    "wechatcomapp_secret": "test_secret",
+    "wechatcomapp_token": "test_token",
+    "wechatcomapp_aes_key": "a" * 43,
+}
+
+
+@pytest.fixture
+def set_conf():
+    """按需修改全局配置，测试结束后恢复"""
+    saved = {}
+
+    def set_conf(**kwargs):
+        for key, value in kwargs.items():
+            if key not in saved:
+                saved[key] = (key in conf(), conf().get(key))
+            conf()[key] = value
+
+    yield set_conf
+    for key, (existed, value) in saved.items():
+        if existed:
+            conf()[key] = value
+        else:
+            dict.pop(conf(), key, None)
+
+
+@pytest.fixture
+def wecom_api(monkeypatch):
+    """用模拟的企业微信接口替换http_client，不访问网络"""
+    api = FakeWeComApi()
+    monkeypatch.setattr(http_client, "get", api.get)
+    monkeypatch.setattr(http_client, "post", api.post)
+    return api
+
+
+@pytest.fixture
+def wecom_channel(wecom_api, set_conf, tmp_path):
+    """企业微信客服通道，通道是单例，每个测试前作废缓存的token，使其从当前的模拟接口重新获取"""
+    set_conf(appdata_dir=str(tmp_path), **WECOM_CONF)
+    from channel.wechatcs.wechatcomservice_channel import WechatComServiceChannel
+
+    channel = WechatComServiceChannel()
+    channel.channel_type = "wechatcom_service"
+    channel.client.token_manager.token_cache.invalidate()
+    return channel
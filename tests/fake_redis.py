@@ -0,0 +1,300 @@
+"""
+本地模拟的Redis服务(RESP2/RESP3协议)，供RedisSessionStore等依赖Redis的模块在没有真实Redis的环境中测试，不依赖外部服务：
+- 字符串: GET SET(EX/PX/NX/XX) DEL EXISTS
+- hash: HSET HGET HGETALL HDEL HLEN
+- 过期: EXPIRE TTL，时间可用advance()快进，不必真的等待
+- 其它: HELLO(RESP2/RESP3) PING ECHO SELECT CLIENT SCAN(MATCH/COUNT分页) KEYS DBSIZE FLUSHDB FLUSHALL
+每个连接一个线程，所有命令在同一把锁下执行，按命令名统计调用次数
+"""
+import fnmatch
+import socketserver
+import threading
+import time
+from collections import Counter
+
+
+class RedisError(Exception):
+    pass
+
+
+WRONGTYPE = "WRONGTYPE Operation against a key holding the wrong kind of value"
+
+
+class FakeRedisHandler(socketserver.StreamRequestHandler):
+    disable_nagle_algorithm = True  # pipeline的多个回复逐个写出，开启Nagle时每次往返会多等待一个延迟ACK
+
+    def handle(self):
+        fake = self.server.fake
+        protocol = 2  # 连接的协议版本，由HELLO切换
+        while True:
+            try:
+                args = self._read_command()
+            except (ConnectionError, ValueError):
+                return
+            if args is None:
+                return
+            try:
+                if args and args[0].upper() == b"HELLO":
+                    protocol = int(args[1]) if len(args) > 1 else protocol
+                    if protocol not in (2, 3):
+                        raise RedisError("NOPROTO unsupported protocol version")
+                    reply = {"server": "redis", "version": "7.0.0", "proto": protocol, "id": 1,
+                             "mode": "standalone", "role": "master", "modules": []}
+                else:
+                    reply = fake.execute(args)
+            except RedisError as e:
+                self.wfile.write("-{}\r\n".format(e).encode("utf-8"))
+            else:
+                self.wfile.write(encode(reply, protocol == 3))
+            self.wfile.flush()
+
+    def _read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        line = line.rstrip(b"\r\n")
+        if not line.startswith(b"*"):  # inline命令，如 telnet 中手动输入
+            return line.split()
+        args = []
+        for _ in range(int(line[1:])):
+            header = self.rfile.readline()
+            if not header.startswith(b"$"):
+                raise ValueError("invalid bulk header: {!r}".format(header))
+            size = int(header[1:])
+            args.append(self.rfile.read(size + 2)[:size])
+        return args
+
+
+class OK(object):
+    pass
+
+
+def encode(value, resp3=False) -> bytes:
+    if value is OK:
+        return b"+OK\r\n"
+    if value is None:
+        return b"_\r\n" if resp3 else b"$-1\r\n"
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        value = value.encode("utf-8")
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    if isinstance(value, dict):  # RESP3为map，RESP2展开为key、value交替的数组
+        items = [item for pair in value.items() for item in pair]
+        if resp3:
+            return b"%%%d\r\n" % len(value) + b"".join(encode(item, resp3) for item in items)
+        value = items
+    if isinstance(value, (list, tuple)):
+        return b"*%d\r\n" % len(value) + b"".join(encode(item, resp3) for item in value)
+    raise TypeError("unsupported reply type: {}".format(type(value)))
+
+
+class FakeRedisServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class FakeRedis(object):
+    def __init__(self, host="127.0.0.1", port=0):
+        self.data = {}  # key(bytes) -> bytes 或 dict
+        self.expires = {}  # key -> 过期时间(self.now())
+        self.offset = 0.0  # advance()快进的秒数
+        self.lock = threading.Lock()
+        self.stats = Counter()
+        self.server = FakeRedisServer((host, port), FakeRedisHandler)
+        self.server.fake = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "redis://{}:{}/0".format(host, port)
+
+    def now(self):
+        return time.monotonic() + self.offset
+
+    def advance(self, seconds):
+        """时间快进seconds秒，用于测试过期"""
+        with self.lock:
+            self.offset += seconds
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake_redis", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats.clear()
+
+    def keys(self, pattern="*"):
+        with self.lock:
+            return sorted(key.decode("utf-8") for key in self._keys(pattern.encode("utf-8")))
+
+    def ttl(self, key):
+        with self.lock:
+            return self._ttl(key.encode("utf-8"))
+
+    def execute(self, args):
+        if not args:
+            raise RedisError("ERR empty command")
+        name = args[0].decode("utf-8").upper()
+        handler = getattr(self, "cmd_" + name.lower(), None)
+        if handler is None:
+            raise RedisError("ERR unknown command '{}'".format(name))
+        with self.lock:
+            self.stats[name] += 1
+            return handler(*args[1:])
+
+    # 以下均在持有self.lock时调用
+    def _alive(self, key):
+        deadline = self.expires.get(key)
+        if deadline is not None and self.now() >= deadline:
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _get(self, key, kind):
+        if not self._alive(key):
+            return None
+        value = self.data[key]
+        if not isinstance(value, kind):
+            raise RedisError(WRONGTYPE)
+        return value
+
+    def _keys(self, pattern):
+        return [key for key in list(self.data) if self._alive(key) and fnmatch.fnmatchcase(key, pattern)]
+
+    def _ttl(self, key):
+        if not self._alive(key):
+            return -2
+        deadline = self.expires.get(key)
+        if deadline is None:
+            return -1
+        return max(0, int(round(deadline - self.now())))
+
+    def cmd_ping(self, *args):
+        return args[0] if args else "PONG"
+
+    def cmd_echo(self, value):
+        return value
+
+    def cmd_select(self, db):
+        return OK
+
+    def cmd_client(self, *args):
+        return OK
+
+    def cmd_get(self, key):
+        return self._get(key, bytes)
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        expires_in = None
+        i = 0
+        while i < len(options):
+            if options[i] in (b"EX", b"PX"):
+                expires_in = int(options[i + 1]) / (1000.0 if options[i] == b"PX" else 1)
+                i += 2
+            else:
+                i += 1
+        exists = self._alive(key)
+        if (b"NX" in options and exists) or (b"XX" in options and not exists):
+            return None
+        self.data[key] = value
+        self.expires.pop(key, None)
+        if expires_in is not None:
+            self.expires[key] = self.now() + expires_in
+        return OK
+
+    def cmd_del(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self._alive(key):
+                del self.data[key]
+                self.expires.pop(key, None)
+                deleted += 1
+        return deleted
+
+    def cmd_exists(self, *keys):
+        return sum(1 for key in keys if self._alive(key))
+
+    def cmd_expire(self, key, seconds):
+        if not self._alive(key):
+            return 0
+        self.expires[key] = self.now() + int(seconds)
+        return 1
+
+    def cmd_ttl(self, key):
+        return self._ttl(key)
+
+    def cmd_hset(self, key, *pairs):
+        if not pairs or len(pairs) % 2:
+            raise RedisError("ERR wrong number of arguments for 'hset' command")
+        value = self._get(key, dict)
+        if value is None:
+            value = self.data[key] = {}
+        added = 0
+        for i in range(0, len(pairs), 2):
+            if pairs[i] not in value:
+                added += 1
+            value[pairs[i]] = pairs[i + 1]
+        return added
+
+    def cmd_hget(self, key, field):
+        value = self._get(key, dict)
+        return value.get(field) if value else None
+
+    def cmd_hgetall(self, key):
+        return dict(self._get(key, dict) or {})
+
+    def cmd_hdel(self, key, *fields):
+        value = self._get(key, dict)
+        if not value:
+            return 0
+        deleted = sum(1 for field in fields if value.pop(field, None) is not None)
+        if not value:  # 与Redis一致，hash为空时删除key
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return deleted
+
+    def cmd_hlen(self, key):
+        return len(self._get(key, dict) or {})
+
+    def cmd_keys(self, pattern):
+        return sorted(self._keys(pattern))
+
+    def cmd_scan(self, cursor, *options):
+        pattern, count = b"*", 10
+        for i in range(0, len(options) - 1, 2):
+            if options[i].upper() == b"MATCH":
+                pattern = options[i + 1]
+            elif options[i].upper() == b"COUNT":
+                count = int(options[i + 1])
+        # 按key排序后以下标作为游标，遍历期间新增或删除的key可能被跳过或重复，与Redis的语义一致
+        keys = sorted(key for key in list(self.data) if self._alive(key))
+        start = int(cursor)
+        batch = keys[start:start + count]
+        next_cursor = start + count if start + count < len(keys) else 0
+        return [str(next_cursor), [key for key in batch if fnmatch.fnmatchcase(key, pattern)]]
+
+    def cmd_dbsize(self):
+        return len(self._keys(b"*"))
+
+    def cmd_flushdb(self, *args):
+        self.data.clear()
+        self.expires.clear()
+        return OK
+
+    cmd_flushall = cmd_flushdb
@@ -0,0 +1,125 @@
+import random
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from channel.wechatcs.kf_sync import KfMsgSync
+
+KFIDS = ("wk_kf_a", "wk_kf_b", "wk_kf_c")
+MAX_AGE = 600
+PAGE_SIZE = 7
+
+
+class Recorder(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = defaultdict(list)
+
+    def __call__(self, msg):
+        with self.lock:
+            self.received[msg["open_kfid"]].append(msg["msgid"])
+
+    def all_msgids(self):
+        with self.lock:
+            return [msgid for msgids in self.received.values() for msgid in msgids]
+
+
+@pytest.fixture
+def new_sync(wecom_channel, wecom_api, tmp_path):
+    """用通道的sync_msg拉取消息(经过模拟的kf/sync_msg接口)，同一个测试中新建的KfMsgSync共用cursor文件，相当于重启"""
+    wecom_api.page_size = PAGE_SIZE
+    wecom_api.sync_latency = 0.002
+    cursor_path = str(tmp_path / "wechatcs_cursors.json")
+
+    def new_sync(on_message):
+        return KfMsgSync(wecom_channel.sync_msg, on_message, cursor_path, max_age=MAX_AGE)
+
+    return new_sync
+
+
+def _skip_history(sync, wecom_api):
+    for open_kfid in KFIDS:
+        wecom_api.add(open_kfid, PAGE_SIZE * 2 + 3, age=MAX_AGE * 2)
+        sync.request(open_kfid, "token")
+
+
+def test_history_older_than_max_age_is_skipped(new_sync, wecom_api):
+    recorder = Recorder()
+    sync = new_sync(recorder)
+    _skip_history(sync, wecom_api)
+
+    assert recorder.all_msgids() == []
+    assert sync.get_stats()["skipped"] == len(KFIDS) * (PAGE_SIZE * 2 + 3)
+    # 翻页拉取，每页都带着同一个access_token
+    assert {token for api, token in wecom_api.calls if api == "kf/sync_msg"} == {"token1"}
+
+
+def test_concurrent_callbacks_deliver_each_message_once_and_in_order(new_sync, wecom_api):
+    recorder = Recorder()
+    sync = new_sync(recorder)
+    _skip_history(sync, wecom_api)
+
+    callbacks = 300
+    expected = defaultdict(list)
+    rng = random.Random(7)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        futures = []
+        # 每追加一批消息就发出一次回调，与真实接口的通知方式一致
+        for i in range(callbacks):
+            open_kfid = rng.choice(KFIDS)
+            expected[open_kfid] += wecom_api.add(open_kfid, rng.randint(1, PAGE_SIZE * 2))
+            futures.append(executor.submit(sync.request, open_kfid, "token{}".format(i)))
+        for future in futures:
+            future.result()
+
+    for open_kfid in KFIDS:
+        assert recorder.received[open_kfid] == expected[open_kfid]
+    stats = sync.get_stats()
+    assert stats["coalesced"] > 0
+    assert stats["runs"] < callbacks + len(KFIDS)
+
+
+def test_sync_error_keeps_cursor_for_next_callback(new_sync, wecom_api):
+    recorder = Recorder()
+    sync = new_sync(recorder)
+    _skip_history(sync, wecom_api)
+
+    new_msgids = wecom_api.add(KFIDS[0], 3)
+    wecom_api.fail_next = 1
+    sync.request(KFIDS[0], "token")
+    assert recorder.all_msgids() == []
+    sync.request(KFIDS[0], "token")
+    assert recorder.received[KFIDS[0]] == new_msgids
+
+
+def test_cursor_survives_restart(new_sync, wecom_api):
+    recorder = Recorder()
+    sync = new_sync(recorder)
+    _skip_history(sync, wecom_api)
+    delivered = wecom_api.add(KFIDS[0], 2)
+    sync.request(KFIDS[0], "token")
+    assert recorder.received[KFIDS[0]] == delivered
+
+    restarted = Recorder()
+    sync = new_sync(restarted)
+    new_msgids = {open_kfid: wecom_api.add(open_kfid, PAGE_SIZE + 1) for open_kfid in KFIDS}
+    for open_kfid in KFIDS:
+        sync.request(open_kfid, "token")
+
+    assert dict(restarted.received) == new_msgids
+
+
+def test_callback_produces_context_for_customer_text(new_sync, wecom_channel, wecom_api, set_conf, monkeypatch):
+    from channel.wechatcs.wechatcomservice_channel import Query
+
+    set_conf(single_chat_prefix=[""])
+    produced = []
+    monkeypatch.setattr(wecom_channel, "produce", produced.append)
+    monkeypatch.setattr(wecom_channel, "kf_sync", new_sync(wecom_channel.handle_kf_message))
+    msgids = wecom_api.add(KFIDS[0], 2)
+
+    Query().produce(wecom_channel, "token", KFIDS[0])
+
+    assert [(context.content, context["receiver"]) for context in produced] == [(msgid, "wm_user") for msgid in msgids]
@@ -0,0 +1,113 @@
+import pytest
+
+from bot import session_store
+from bot.session_manager import Session, SessionManager
+from bot.session_store import RedisSessionStore
+from tests.fake_redis import FakeRedis
+
+pytest.importorskip("redis")  # 可选依赖，见requirements-optional.txt
+
+EXPIRES_IN = 60
+PREFIX = "cow:session:"
+MAX_MESSAGES = 5
+ITEMS = [(seq, {"role": "user", "content": "消息{}".format(seq)}) for seq in range(12)]
+
+
+class CountSession(Session):
+    """按条数裁剪的会话，不依赖tokenizer"""
+
+    def discard_exceeding(self, max_tokens=None, cur_tokens=None):
+        while len(self.messages) > MAX_MESSAGES:
+            self.messages.pop(1)
+        return len(self.messages)
+
+    def num_message_tokens(self, message):
+        return 1
+
+
+@pytest.fixture
+def fake():
+    fake = FakeRedis()
+    fake.start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture
+def store(fake, monkeypatch):
+    store = RedisSessionStore(fake.url, expires_in_seconds=EXPIRES_IN, prefix=PREFIX)
+    # SessionManager通过get_session_store()取得共享存储
+    monkeypatch.setattr(session_store, "_store", store)
+    return store
+
+
+def test_messages_are_loaded_in_numeric_seq_order(store):
+    assert store.load("ns", "u1") is None
+
+    store.save_meta("ns", "u1", {"system_prompt": "你是助手"})
+    store.append("ns", "u1", ITEMS[:6])
+    store.append("ns", "u1", ITEMS[6:])
+    assert store.load("ns", "u1") == ({"system_prompt": "你是助手"}, ITEMS)
+
+    store.remove("ns", "u1", [0, 1, 2])
+    assert store.load("ns", "u1")[1] == ITEMS[3:]
+
+
+def test_every_write_refreshes_expiry_of_both_keys(fake, store):
+    key = PREFIX + "ns:u1"
+    store.save_meta("ns", "u1", {"system_prompt": ""})
+    store.append("ns", "u1", ITEMS[:2])
+    assert fake.ttl(key + ":meta") == EXPIRES_IN and fake.ttl(key + ":msgs") == EXPIRES_IN
+
+    fake.advance(EXPIRES_IN - 10)
+    store.append("ns", "u1", [(12, {"role": "assistant", "content": "回复"})])
+    assert fake.ttl(key + ":meta") == EXPIRES_IN
+    fake.advance(EXPIRES_IN - 10)
+    assert store.load("ns", "u1") is not None
+    fake.advance(11)
+    assert store.load("ns", "u1") is None
+    assert fake.keys(key + "*") == []
+
+
+def test_delete_and_clear_only_remove_their_own_keys(fake, store):
+    for session_id in ("u1", "u2"):
+        store.save_meta("ns", session_id, {"system_prompt": ""})
+        store.append("ns", session_id, ITEMS[:2])
+    store.delete("ns", "u1")
+    assert store.load("ns", "u1") is None and store.load("ns", "u2") is not None
+
+    # 1400个key，超过clear中单次SCAN(500)和单次DELETE(500)的数量
+    for i in range(700):
+        store.save_meta("big", "s{}".format(i), {"system_prompt": ""})
+        store.append("big", "s{}".format(i), ITEMS[:1])
+    store.save_meta("bigger", "s0", {"system_prompt": ""})  # 前缀相同的其它namespace不应被清理
+    store.clear("big")
+
+    assert fake.keys(PREFIX + "big:*") == []
+    assert store.load("bigger", "s0") is not None and store.load("ns", "u2") is not None
+
+
+def test_session_manager_round_trip(fake, store):
+    manager = SessionManager(CountSession)
+    for turn in range(6):
+        manager.session_query("问题{}".format(turn), "u3")
+        manager.session_reply("回答{}".format(turn), "u3")
+    assert len(manager.sessions["u3"].messages) == MAX_MESSAGES
+
+    # 进程内已缓存的会话不再读取redis，一轮对话只增量写入和删除
+    fake.reset_stats()
+    manager.session_query("问题6", "u3")
+    stats = fake.get_stats()
+    assert "GET" not in stats and "HGETALL" not in stats
+    assert stats.get("HSET") == 1 and stats.get("HDEL") == 1
+    expected = [dict(message) for message in manager.sessions["u3"].messages]
+
+    # 模拟重启：进程内缓存为空，从存储加载，被裁剪的消息已从redis删除
+    reloaded = SessionManager(CountSession)
+    assert reloaded.build_session("u3").messages == expected
+    assert len(store.load("CountSession", "u3")[1]) == MAX_MESSAGES
+
+    reloaded.session_reply("回答6", "u3")
+    assert store.load("CountSession", "u3")[1][-1][1] == {"role": "assistant", "content": "回答6"}
+    reloaded.clear_session("u3")
+    assert fake.keys(PREFIX + "CountSession:u3:*") == []
@@ -0,0 +1,54 @@
+import pytest
+
+from bot.reply_cache import CacheKey, MemoryReplyCacheBackend, ReplyCache
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+from common import http_client
+from tests.wecom_fake import FakeResponse
+
+
+@pytest.fixture
+def cache():
+    return ReplyCache(MemoryReplyCacheBackend(ttl=60, max_size=10))
+
+
+def test_failed_text_reply_is_returned_but_not_cached(cache):
+    key = CacheKey("scope", "今天天气怎么样")
+    reply = Reply(ReplyType.TEXT, "提问太快啦，请休息一下再问我吧", failed=True)
+
+    assert cache.put(key, reply) is reply
+    assert cache.get(key) is None
+
+    cache.put(key, Reply(ReplyType.TEXT, "晴"))
+    assert cache.get(key).content == "晴"
+
+
+@pytest.mark.parametrize("response, failed", [
+    (FakeResponse({"choices": [{"message": {"content": "晴"}}], "usage": {"total_tokens": 10}}), False),
+    (FakeResponse({"choices": [{"message": {"content": "访问超出限流"}}], "usage": {"total_tokens": 0}, "code": 429}), True),
+    (FakeResponse({"error": {"message": "rate limit", "type": "rate_limit"}}, 429), True),
+])
+def test_linkai_flags_failure_replies(monkeypatch, set_conf, response, failed):
+    set_conf(linkai_api_key="test_key", linkai_app_code=None)
+    monkeypatch.setattr(http_client, "post", lambda *args, **kwargs: response)
+    from bot.linkai.link_ai_bot import LinkAIBot
+
+    context = Context(ContextType.TEXT, "今天天气怎么样")
+    context.kwargs = {"session_id": "user"}
+    reply = LinkAIBot().reply("今天天气怎么样", context)
+
+    assert reply.type == ReplyType.TEXT
+    assert reply.failed is failed
+
+
+def test_dify_error_reply_is_text_flagged_as_failed(monkeypatch, set_conf):
+    set_conf(channel_type="wechatcom_app", error_reply="我暂时遇到了一些问题，请您稍后重试~")
+    from bot.dify.dify_bot import DifyBot
+
+    bot = DifyBot()
+    monkeypatch.setattr(bot, "_reply", lambda query, session, context: (None, "[DIFY] Exception: timeout"))
+    context = Context(ContextType.TEXT, "今天天气怎么样")
+    context.kwargs = {"session_id": "user"}
+    reply = bot.reply("今天天气怎么样", context)
+
+    assert (reply.type, reply.content, reply.failed) == (ReplyType.TEXT, "我暂时遇到了一些问题，请您稍后重试~", True)
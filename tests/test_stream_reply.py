@@ -0,0 +1,109 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType, StreamReply
+from channel.chat_channel import ChatChannel
+from config import snapshot
+from plugins import Event, EventAction, PluginManager
+
+
+class SentenceChannel(ChatChannel):
+    STREAM_MODE = "sentence"
+    NOT_SUPPORT_REPLYTYPE = []
+
+    def __init__(self):
+        # 不启动消费线程，直接调用_handle_in_scope
+        self.channel_type = "test"
+        self.sent = []
+
+    def send(self, reply: Reply, context: Context):
+        self.sent.append(reply.content)
+
+
+@pytest.fixture
+def channel(monkeypatch, set_conf):
+    set_conf(single_chat_reply_prefix="", single_chat_reply_suffix="", stream_sentence_min_chars=2)
+    channel = SentenceChannel()
+    deltas = ["第一句。", "第二句敏感。", "第三句。"]
+    monkeypatch.setattr(channel, "_generate_reply", lambda context: StreamReply(iter(deltas)))
+    return channel
+
+
+@pytest.fixture
+def dispatch(monkeypatch):
+    """替换插件处理链，测试结束后恢复"""
+    manager = PluginManager()
+    monkeypatch.setattr(manager, "dispatch", {})
+    return manager.dispatch
+
+
+def _context():
+    context = Context(ContextType.TEXT, "你好")
+    context.kwargs = {"stream": True, "session_id": "user", "receiver": "user"}
+    return context
+
+
+def _ban(e_context):
+    reply = e_context["reply"]
+    if reply.type == ReplyType.TEXT and "敏感" in reply.content:
+        e_context["reply"] = None
+        e_context.action = EventAction.BREAK_PASS
+
+
+def test_stream_reply_is_sent_by_sentence(channel, dispatch):
+    channel._handle_in_scope(_context())
+
+    assert channel.sent == ["第一句。", "第二句敏感。", "第三句。"]
+
+
+@pytest.mark.parametrize("event", [Event.ON_DECORATE_REPLY, Event.ON_SEND_REPLY])
+def test_outbound_plugin_sees_reply_before_anything_is_sent(channel, dispatch, event):
+    seen = []
+
+    def handler(e_context):
+        seen.append(e_context["reply"].content)
+        _ban(e_context)
+
+    dispatch[event] = (("BANWORDS", handler, SimpleNamespace(record=lambda *args, **kwargs: None)),)
+    channel._handle_in_scope(_context())
+
+    assert seen == ["第一句。第二句敏感。第三句。"]
+    assert channel.sent == []
+
+
+def test_reply_uses_config_snapshot_taken_with_context(channel, dispatch, set_conf):
+    set_conf(single_chat_reply_prefix="[旧]", single_chat_reply_suffix="[/旧]")
+    stream_context = _context()
+    stream_context["config"] = snapshot()
+    plain_context = _context()
+    plain_context["config"] = snapshot()
+    del plain_context["stream"]
+    # 消息处理过程中配置被修改，本条消息的回复仍使用构造context时的配置
+    set_conf(single_chat_reply_prefix="[新]", single_chat_reply_suffix="[/新]", stream_sentence_min_chars=100)
+
+    channel._handle_in_scope(stream_context)
+    channel._handle_in_scope(plain_context)
+
+    assert channel.sent == [
+        "[旧]第一句。", "第二句敏感。", "第三句。", "[/旧]",
+        "[旧]第一句。第二句敏感。第三句。[/旧]",
+    ]
+
+
+def test_feishu_text_context_enables_stream(set_conf):
+    set_conf(stream_reply=True, group_name_white_list=[], single_chat_prefix=[""])
+    from channel.feishu.feishu_channel import FeishuController
+    from channel.feishu.feishu_message import FeishuMessage
+
+    event = {
+        "message": {"message_id": "om_1", "create_time": "0", "message_type": "text", "content": json.dumps({"text": "你好"})},
+        "sender": {"sender_id": {"open_id": "ou_user"}},
+    }
+    msg = FeishuMessage(event)
+    context = FeishuController()._compose_context(msg.ctype, msg.content, isgroup=False, msg=msg, no_need_at=True)
+
+    assert context.type == ContextType.TEXT
+    assert context["stream"] is True
@@ -0,0 +1,97 @@
+from types import SimpleNamespace
+
+import pytest
+
+from common import token_cache
+from common.token_cache import TokenCache
+
+
+class Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(token_cache, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return clock
+
+
+class Fetcher(object):
+    def __init__(self, expires_in=7200):
+        self.expires_in = expires_in
+        self.count = 0
+        self.fail = False
+
+    def __call__(self):
+        if self.fail:
+            return None, 0
+        self.count += 1
+        return "token{}".format(self.count), self.expires_in
+
+
+def test_expired_token_is_not_returned_when_refresh_fails(clock):
+    fetcher = Fetcher(expires_in=60)
+    cache = TokenCache("test", fetcher)
+    assert cache.get() == "token1"
+
+    fetcher.fail = True
+    clock.now += 61
+    assert cache.get() is None
+
+    fetcher.fail = False
+    assert cache.get() == "token2"
+
+
+def test_short_lived_token_does_not_change_refresh_ahead(clock, monkeypatch):
+    fetcher = Fetcher(expires_in=120)
+    cache = TokenCache("test", fetcher, refresh_ahead=300)
+    background = []
+    monkeypatch.setattr(cache, "_refresh_in_background", lambda: background.append(clock.now))
+
+    assert cache.get() == "token1"
+    assert cache.refresh_ahead == 300
+    clock.now += 59
+    cache.get()
+    assert background == []
+    clock.now += 2  # 有效期过半后在后台刷新
+    cache.get()
+    assert len(background) == 1
+
+    # 之后签发的长有效期token仍按配置的refresh_ahead提前刷新
+    fetcher.expires_in = 7200
+    cache.invalidate()
+    background.clear()
+    assert cache.get() == "token2"
+    clock.now += 7200 - 301
+    cache.get()
+    assert background == []
+    clock.now += 2
+    cache.get()
+    assert len(background) == 1
+
+
+def test_request_invalidates_rejected_token_and_retries_once(clock):
+    cache = TokenCache("test", Fetcher())
+    cache.get()
+    calls = []
+
+    def request(token):
+        calls.append(token)
+        return {"errcode": 42001}
+
+    assert cache.request(request, lambda res: res["errcode"] == 42001) == {"errcode": 42001}
+    assert calls == ["token1", "token2"]
+
+
+def test_invalidate_keeps_token_refreshed_by_another_request(clock):
+    cache = TokenCache("test", Fetcher())
+    cache.get()
+    cache.invalidate()
+    assert cache.get() == "token2"
+    cache.invalidate("token1")  # 另一个请求拿着旧token失败，不应作废新token
+    assert cache.get() == "token2"
@@ -0,0 +1,40 @@
+from types import SimpleNamespace
+
+from bridge.context import Context, ContextType
+from bridge.reply import Reply, ReplyType
+
+
+def _context(external_userid="wm_user", open_kfid="wk_kf"):
+    context = Context(ContextType.TEXT, "你好")
+    context.kwargs = {"msg": SimpleNamespace(external_userid=external_userid, open_kfid=open_kfid), "receiver": external_userid}
+    return context
+
+
+def test_send_text_uses_shared_token(wecom_channel, wecom_api):
+    wecom_channel.send(Reply(ReplyType.TEXT, "第一条"), _context())
+    wecom_channel.send(Reply(ReplyType.TEXT, "第二条"), _context())
+
+    assert wecom_api.token_requests == 1
+    assert [(token, data["text"]["content"]) for token, data in wecom_api.sent] == [("token1", "第一条"), ("token1", "第二条")]
+    assert wecom_api.sent[0][1]["touser"] == "wm_user" and wecom_api.sent[0][1]["open_kfid"] == "wk_kf"
+
+
+def test_send_refreshes_revoked_token_and_retries_once(wecom_channel, wecom_api):
+    wecom_channel.send(Reply(ReplyType.TEXT, "第一条"), _context())
+    wecom_api.revoke()
+    wecom_channel.send(Reply(ReplyType.TEXT, "第二条"), _context())
+
+    assert wecom_api.calls == [("kf/send_msg", "token1"), ("kf/send_msg", "token1"), ("kf/send_msg", "token2")]
+    assert [(token, data["text"]["content"]) for token, data in wecom_api.sent] == [("token1", "第一条"), ("token2", "第二条")]
+
+
+def test_wechatpy_client_reads_token_from_shared_cache(wecom_channel, wecom_api):
+    response = wecom_channel.send_text_message("wm_user", "wk_kf", "你好")
+
+    assert response["errcode"] == 0
+    assert wecom_channel.client.access_token == "token1"
+    wecom_api.revoke()
+    # wechatpy在token失效重试时调用fetch_access_token，需要拿到新token并写入session
+    assert wecom_channel.client.fetch_access_token() == "token2"
+    assert wecom_channel.client.session.get(wecom_channel.client.access_token_key) == "token2"
+    assert wecom_channel.client.access_token == "token2"
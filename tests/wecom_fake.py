@@ -0,0 +1,113 @@
+"""
+模拟的企业微信接口，替换common.http_client的get/post，不访问网络：
+- cgi-bin/gettoken: 每次调用签发一个新的access_token(token1、token2...)，之前签发的仍然有效，直到revoke()
+- cgi-bin/kf/send_msg: 记录发送的消息
+- cgi-bin/kf/sync_msg: 每个open_kfid的消息按顺序追加(add)，cursor是下一条消息的下标，
+  单页最多返回min(limit, page_size)条，后面还有消息时has_more为1
+token不是有效token时返回errcode 42001，与真实接口一样
+"""
+import threading
+import time
+from collections import defaultdict
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeResponse(object):
+    def __init__(self, data, status_code=200):
+        self.data = data
+        self.status_code = status_code
+
+    def json(self):
+        return self.data
+
+
+class FakeWeComApi(object):
+    def __init__(self, page_size=7, sync_latency=0.0):
+        self.lock = threading.Lock()
+        self.issued = 0
+        self.valid_tokens = set()
+        self.token_requests = 0
+        self.sent = []  # (access_token, data)
+        self.calls = []  # (api, access_token)
+        self.page_size = page_size
+        self.sync_latency = sync_latency  # sync_msg的耗时，让并发的回调有机会重叠
+        self.messages = defaultdict(list)  # open_kfid -> 待拉取的消息
+        self.seq = 0
+        self.fail_next = 0  # 接下来sync_msg返回错误的次数
+
+    def revoke(self):
+        """吊销所有已签发的token，模拟在管理后台重置secret或token被提前作废"""
+        with self.lock:
+            self.valid_tokens.clear()
+
+    def get(self, url, **kwargs):
+        path, query = self._parse(url)
+        if path.endswith("/cgi-bin/gettoken"):
+            with self.lock:
+                self.token_requests += 1
+                self.issued += 1
+                token = "token{}".format(self.issued)
+                self.valid_tokens.add(token)
+            return FakeResponse({"errcode": 0, "errmsg": "ok", "access_token": token, "expires_in": 7200})
+        return FakeResponse({"errcode": 404, "errmsg": "not found"}, 404)
+
+    def post(self, url, json=None, **kwargs):
+        path, query = self._parse(url)
+        api = path.rsplit("/cgi-bin/", 1)[-1]
+        access_token = query.get("access_token", [""])[0]
+        with self.lock:
+            self.calls.append((api, access_token))
+            if access_token not in self.valid_tokens:
+                return FakeResponse({"errcode": 42001, "errmsg": "access_token expired"})
+        handler = getattr(self, "api_" + api.replace("/", "_"), None)
+        if handler is None:
+            return FakeResponse({"errcode": 404, "errmsg": "not found"}, 404)
+        return FakeResponse(handler(access_token, json or {}))
+
+    def api_kf_send_msg(self, access_token, data):
+        with self.lock:
+            self.sent.append((access_token, data))
+        return {"errcode": 0, "errmsg": "ok", "msgid": "sent{}".format(len(self.sent))}
+
+    def add(self, open_kfid, count, age=0):
+        """追加count条客户发送的文本消息，返回它们的msgid；age为消息已发出的秒数"""
+        with self.lock:
+            msgids = []
+            for _ in range(count):
+                self.seq += 1
+                msgid = "msg{}".format(self.seq)
+                self.messages[open_kfid].append({
+                    "msgid": msgid,
+                    "open_kfid": open_kfid,
+                    "external_userid": "wm_user",
+                    "send_time": int(time.time() - age),
+                    "origin": 3,
+                    "msgtype": "text",
+                    "text": {"content": msgid},
+                })
+                msgids.append(msgid)
+            return msgids
+
+    def api_kf_sync_msg(self, access_token, data):
+        time.sleep(self.sync_latency)
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return {"errcode": 95007, "errmsg": "invalid msg token"}
+            cursor = data.get("cursor")
+            start = int(cursor) if cursor else 0
+            messages = self.messages[data["open_kfid"]]
+            page = messages[start:start + min(data.get("limit", 1000), self.page_size)]
+            end = start + len(page)
+            return {
+                "errcode": 0,
+                "errmsg": "ok",
+                "next_cursor": str(end),
+                "has_more": 1 if end < len(messages) else 0,
+                "msg_list": [dict(msg) for msg in page],
+            }
+
+    @staticmethod
+    def _parse(url):
+        parsed = urlparse(url)
+        return parsed.path, parse_qs(parsed.query)
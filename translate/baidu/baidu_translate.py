@@ -3,7 +3,7 @@
 import random
 from hashlib import md5
 
-import requests
+from common import http_client
 
 from config import conf
 from translate.translator import Translator
@@ -31,7 +31,7 @@ class BaiduTranslator(Translator):
 
         retry_cnt = 3
         while retry_cnt:
-            r = requests.post(self.url, params=payload, headers=headers)
+            r = http_client.post(self.url, params=payload, headers=headers)
             result = r.json()
             errcode = result.get("error_code", "52000")
             if errcode != "52000":
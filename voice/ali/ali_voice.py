@@ -16,7 +16,7 @@ import time
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from voice.audio_convert import get_pcm_from_wav
-from voice.voice import Voice
+from voice.voice import Voice, voice_name
 from voice.ali.ali_api import AliyunTokenGenerator, speech_to_text_aliyun, text_to_speech_aliyun
 from config import conf
 
@@ -42,6 +42,9 @@ class AliVoice(Voice):
         except Exception as e:
             logger.warn("AliVoice init failed: %s, ignore " % e)
 
+    def tts_cache_params(self):
+        return self.api_url_text_to_voice, self.app_key
+
     def textToVoice(self, text):
         """
         将文本转换为语音文件。
@@ -71,7 +74,7 @@ class AliVoice(Voice):
         """
         # 提取有效的token
         token_id = self.get_valid_token()
-        logger.debug("[Ali] voice file name={}".format(voice_file))
+        logger.debug("[Ali] voice file name={}".format(voice_name(voice_file)))
         pcm = get_pcm_from_wav(voice_file)
         text = speech_to_text_aliyun(self.api_url_voice_to_text, pcm, self.app_key, token_id)
         if text:
@@ -1,7 +1,14 @@
+import io
+import os
 import shutil
+import threading
 import wave
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from common.log import logger
+from common.tmp_dir import track_tmp
+from config import conf
 
 try:
     import pysilk
@@ -11,6 +18,8 @@ except ImportError:
 from pydub import AudioSegment
 
 sil_supports = [8000, 12000, 16000, 24000, 32000, 44100, 48000]  # slk转wav时，支持的采样率
+ASR_SAMPLE_RATE = 16000  # 语音识别统一使用 16k 单声道 pcm_s16le，百度、阿里、讯飞均支持
+SILK_FORMATS = ("sil", "silk", "slk")
 
 
 def find_closest_sil_supports(sample_rate):
@@ -33,11 +42,94 @@ def get_pcm_from_wav(wav_path):
     """
     从 wav 文件中读取 pcm
 
-    :param wav_path: wav 文件路径
+    :param wav_path: wav 文件路径，也可以是内存中的wav(bytes或文件对象)
     :returns: pcm 数据
     """
-    wav = wave.open(wav_path, "rb")
-    return wav.readframes(wav.getnframes())
+    if isinstance(wav_path, (bytes, bytearray)):
+        wav_path = io.BytesIO(wav_path)
+    elif not isinstance(wav_path, str):
+        wav_path.seek(0)
+    with wave.open(wav_path, "rb") as wav:
+        return wav.readframes(wav.getnframes())
+
+
+def audio_format(path):
+    """按文件后缀返回格式，如 mp3、silk，没有后缀返回None"""
+    ext = os.path.splitext(path)[1]
+    return ext[1:].lower() if ext else None
+
+
+def decode_to_pcm(data: bytes, fmt=None, rate: int = ASR_SAMPLE_RATE) -> bytes:
+    """
+    在内存中把任意格式的音频解码为单声道 pcm_s16le，并重采样到rate
+
+    :param data: 音频文件内容
+    :param fmt: 音频格式，如 mp3、amr、silk，为None时由ffmpeg识别
+    """
+    if fmt in SILK_FORMATS:
+        # pysilk可以直接按目标采样率解码，输出即为单声道 pcm_s16le
+        return pysilk.decode(data, sample_rate=rate)
+    audio = AudioSegment.from_file(io.BytesIO(data), format=fmt)
+    audio = audio.set_frame_rate(rate).set_channels(1).set_sample_width(2)
+    return audio.raw_data
+
+
+def pcm_to_wav(pcm: bytes, rate: int = ASR_SAMPLE_RATE) -> bytes:
+    """为单声道 pcm_s16le 数据加上wav头"""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def any_to_wav_bytes(data: bytes, fmt=None, rate: int = ASR_SAMPLE_RATE) -> bytes:
+    """
+    把任意格式的音频内容转为语音识别使用的 16k 单声道wav内容，全程不落盘
+    """
+    return pcm_to_wav(decode_to_pcm(data, fmt, rate), rate)
+
+
+_convert_pool = None
+_convert_pool_lock = threading.Lock()
+
+
+def get_convert_pool():
+    """
+    返回音频编解码使用的进程池，voice_convert_processes 为0时返回None，在当前线程中转换
+    silk编解码和重采样是纯CPU计算，放在线程中会占住GIL拖慢其它消息的处理
+    """
+    global _convert_pool
+    processes = conf().get("voice_convert_processes", 2)
+    if not processes or processes <= 0:
+        return None
+    if _convert_pool is None:
+        with _convert_pool_lock:
+            if _convert_pool is None:
+                _convert_pool = ProcessPoolExecutor(max_workers=processes)
+    return _convert_pool
+
+
+def convert_in_pool(func, *args):
+    """
+    在进程池中执行转换函数并等待结果，func和参数需要可以pickle(模块级函数、bytes、路径)
+    进程池不可用时在当前线程中执行
+    """
+    global _convert_pool
+    pool = get_convert_pool()
+    if pool is None:
+        return func(*args)
+    try:
+        return pool.submit(func, *args).result(timeout=conf().get("voice_convert_timeout", 60))
+    except BrokenProcessPool as e:
+        # 子进程异常退出后进程池不能再使用，丢弃后下次重建
+        logger.warning("[audio_convert] convert pool broken, convert in current thread: {}".format(e))
+        with _convert_pool_lock:
+            if _convert_pool is pool:
+                _convert_pool = None
+        return func(*args)
 
 
 def any_to_mp3(any_path, mp3_path):
@@ -61,12 +153,12 @@ def any_to_wav(any_path, wav_path):
     if any_path.endswith(".wav"):
         shutil.copy2(any_path, wav_path)
         return
-    if any_path.endswith(".sil") or any_path.endswith(".silk") or any_path.endswith(".slk"):
-        return sil_to_wav(any_path, wav_path)
-    audio = AudioSegment.from_file(any_path)
-    audio.set_frame_rate(8000)    # 百度语音转写支持8000采样率, pcm_s16le, 单通道语音识别
-    audio.set_channels(1)
-    audio.export(wav_path, format="wav", codec='pcm_s16le')
+    with open(any_path, "rb") as f:
+        data = f.read()
+    # 16k 单声道 pcm_s16le，之前set_frame_rate/set_channels的返回值被丢弃，上传的是原始采样率的音频
+    wav_data = any_to_wav_bytes(data, audio_format(any_path))
+    with open(wav_path, "wb") as f:
+        f.write(wav_data)
 
 
 def any_to_sil(any_path, sil_path):
@@ -129,7 +221,7 @@ def split_audio(file_path, max_segment_length_ms=60000):
     format = file_path[file_path.rindex(".") + 1 :]
     files = []
     for i, segment in enumerate(segments):
-        path = f"{file_prefix}_{i+1}" + f".{format}"
+        path = track_tmp(f"{file_prefix}_{i+1}" + f".{format}")
         segment.export(path, format=format)
         files.append(path)
     return audio_length_ms, files
@@ -12,7 +12,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
-from voice.voice import Voice
+from voice.voice import Voice, voice_name, voice_path
 
 """
 Azure voice
@@ -57,11 +57,13 @@ class AzureVoice(Voice):
             logger.warn("AzureVoice init failed: %s, ignore " % e)
 
     def voiceToText(self, voice_file):
-        audio_config = speechsdk.AudioConfig(filename=voice_file)
-        speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
-        result = speech_recognizer.recognize_once()
+        # Azure SDK只接受文件路径，内存音频写入临时文件
+        with voice_path(voice_file) as path:
+            audio_config = speechsdk.AudioConfig(filename=path)
+            speech_recognizer = speechsdk.SpeechRecognizer(speech_config=self.speech_config, audio_config=audio_config)
+            result = speech_recognizer.recognize_once()
         if result.reason == speechsdk.ResultReason.RecognizedSpeech:
-            logger.info("[Azure] voiceToText voice file name={} text={}".format(voice_file, result.text))
+            logger.info("[Azure] voiceToText voice file name={} text={}".format(voice_name(voice_file), result.text))
             reply = Reply(ReplyType.TEXT, result.text)
         else:
             cancel_details = result.cancellation_details
@@ -69,6 +71,10 @@ class AzureVoice(Voice):
             reply = Reply(ReplyType.ERROR, "抱歉，语音识别失败")
         return reply
 
+    def tts_cache_params(self):
+        # 开启auto_detect时按语言选择音色，整个配置都会影响结果
+        return self.config
+
     def textToVoice(self, text):
         if self.config.get("auto_detect"):
             lang = classify(text)[0]
@@ -80,8 +86,7 @@ class AzureVoice(Voice):
                 self.speech_config.speech_synthesis_voice_name = self.config["speech_synthesis_voice_name"]
         else:
             self.speech_config.speech_synthesis_voice_name = self.config["speech_synthesis_voice_name"]
-        # Avoid the same filename under multithreading
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".wav"
+        fileName = TmpDir().new_file(".wav", prefix="reply-")
         audio_config = speechsdk.AudioConfig(filename=fileName)
         speech_synthesizer = speechsdk.SpeechSynthesizer(speech_config=self.speech_config, audio_config=audio_config)
         result = speech_synthesizer.speak_text(text)
@@ -12,7 +12,7 @@ from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
 from voice.audio_convert import get_pcm_from_wav
-from voice.voice import Voice
+from voice.voice import Voice, voice_name
 
 """
     百度的语音识别API.
@@ -60,7 +60,7 @@ class BaiduVoice(Voice):
 
     def voiceToText(self, voice_file):
         # 识别本地文件
-        logger.debug("[Baidu] voice file name={}".format(voice_file))
+        logger.debug("[Baidu] voice file name={}".format(voice_name(voice_file)))
         pcm = get_pcm_from_wav(voice_file)
         res = self.client.asr(pcm, "pcm", 16000, {"dev_pid": self.dev_id})
         if res["err_no"] == 0:
@@ -74,6 +74,9 @@ class BaiduVoice(Voice):
             reply = Reply(ReplyType.ERROR, "百度语音识别出错了；{0}".format(res["err_msg"]))
         return reply
 
+    def tts_cache_params(self):
+        return self.lang, self.ctp, self.spd, self.pit, self.vol, self.per
+
     def textToVoice(self, text):
         result = self.client.synthesis(
             text,
@@ -82,8 +85,7 @@ class BaiduVoice(Voice):
             {"spd": self.spd, "pit": self.pit, "vol": self.vol, "per": self.per},
         )
         if not isinstance(result, dict):
-            # Avoid the same filename under multithreading
-            fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+            fileName = TmpDir().new_file(".mp3", prefix="reply-")
             with open(fileName, "wb") as f:
                 f.write(result)
             logger.info("[Baidu] textToVoice text={} voice file name={}".format(text, fileName))
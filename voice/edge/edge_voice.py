@@ -34,6 +34,9 @@ class EdgeVoice(Voice):
         '''
         self.voice = "zh-CN-YunjianNeural"
 
+    def tts_cache_params(self):
+        return self.voice
+
     def voiceToText(self, voice_file):
         pass
 
@@ -42,7 +45,7 @@ class EdgeVoice(Voice):
         await communicate.save(fileName)
 
     def textToVoice(self, text):
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+        fileName = TmpDir().new_file(".mp3", prefix="reply-")
 
         asyncio.run(self.gen_voice(text, fileName))
 
@@ -20,13 +20,16 @@ class ElevenLabsVoice(Voice):
     def voiceToText(self, voice_file):
         pass
 
+    def tts_cache_params(self):
+        return name, "eleven_multilingual_v2"
+
     def textToVoice(self, text):
         audio = client.generate(
             text=text,
             voice=name,
             model='eleven_multilingual_v2'
         )
-        fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+        fileName = TmpDir().new_file(".mp3", prefix="reply-")
         save(audio, fileName)
         logger.info("[ElevenLabs] textToVoice text={} voice file name={}".format(text, fileName))
         return Reply(ReplyType.VOICE, fileName)
\ No newline at end of file
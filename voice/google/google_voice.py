@@ -10,7 +10,7 @@ from gtts import gTTS
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
-from voice.voice import Voice
+from voice.voice import Voice, open_voice, voice_name
 
 
 class GoogleVoice(Voice):
@@ -20,11 +20,11 @@ class GoogleVoice(Voice):
         pass
 
     def voiceToText(self, voice_file):
-        with speech_recognition.AudioFile(voice_file) as source:
+        with speech_recognition.AudioFile(open_voice(voice_file)) as source:
             audio = self.recognizer.record(source)
         try:
             text = self.recognizer.recognize_google(audio, language="zh-CN")
-            logger.info("[Google] voiceToText text={} voice file name={}".format(text, voice_file))
+            logger.info("[Google] voiceToText text={} voice file name={}".format(text, voice_name(voice_file)))
             reply = Reply(ReplyType.TEXT, text)
         except speech_recognition.UnknownValueError:
             reply = Reply(ReplyType.ERROR, "抱歉，我听不懂")
@@ -35,8 +35,7 @@ class GoogleVoice(Voice):
 
     def textToVoice(self, text):
         try:
-            # Avoid the same filename under multithreading
-            mp3File = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+            mp3File = TmpDir().new_file(".mp3", prefix="reply-")
             tts = gTTS(text=text, lang="zh")
             tts.save(mp3File)
             logger.info("[Google] textToVoice text={} voice file name={}".format(text, mp3File))
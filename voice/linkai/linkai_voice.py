@@ -2,13 +2,14 @@
 google voice service
 """
 import random
-import requests
 from voice import audio_convert
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
-from voice.voice import Voice
+from voice.voice import Voice, voice_bytes, voice_name
 from common import const
+from common import http_client
+from common.tmp_dir import TmpDir
 import os
 import datetime
 
@@ -17,28 +18,27 @@ class LinkAIVoice(Voice):
         pass
 
     def voiceToText(self, voice_file):
-        logger.debug("[LinkVoice] voice file name={}".format(voice_file))
+        logger.debug("[LinkVoice] voice file name={}".format(voice_name(voice_file)))
         try:
             url = conf().get("linkai_api_base", "https://api.link-ai.tech") + "/v1/audio/transcriptions"
             headers = {"Authorization": "Bearer " + conf().get("linkai_api_key")}
             model = None
             if not conf().get("text_to_voice") or conf().get("voice_to_text") == "openai":
                 model = const.WHISPER_1
-            if voice_file.endswith(".amr"):
+            if isinstance(voice_file, str) and voice_file.endswith(".amr"):
                 try:
                     mp3_file = os.path.splitext(voice_file)[0] + ".mp3"
                     audio_convert.any_to_mp3(voice_file, mp3_file)
                     voice_file = mp3_file
                 except Exception as e:
                     logger.warn(f"[LinkVoice] amr file transfer failed, directly send amr voice file: {format(e)}")
-            file = open(voice_file, "rb")
             file_body = {
-                "file": file
+                "file": (os.path.basename(voice_name(voice_file)), voice_bytes(voice_file))
             }
             data = {
                 "model": model
             }
-            res = requests.post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
+            res = http_client.post(url, files=file_body, headers=headers, data=data, timeout=(5, 60))
             if res.status_code == 200:
                 text = res.json().get("text")
             else:
@@ -46,7 +46,7 @@ class LinkAIVoice(Voice):
                 logger.error(f"[LinkVoice] voiceToText error, status_code={res.status_code}, msg={res_json.get('message')}")
                 return None
             reply = Reply(ReplyType.TEXT, text)
-            logger.info(f"[LinkVoice] voiceToText success, text={text}, file name={voice_file}")
+            logger.info(f"[LinkVoice] voiceToText success, text={text}, file name={voice_name(voice_file)}")
         except Exception as e:
             logger.error(e)
             return None
@@ -65,9 +65,9 @@ class LinkAIVoice(Voice):
                 "voice": conf().get("tts_voice_id"),
                 "app_code": conf().get("linkai_app_code")
             }
-            res = requests.post(url, headers=headers, json=data, timeout=(5, 120))
+            res = http_client.post(url, headers=headers, json=data, timeout=(5, 120))
             if res.status_code == 200:
-                tmp_file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
+                tmp_file_name = TmpDir().new_file(".mp3", prefix="reply-")
                 with open(tmp_file_name, 'wb') as f:
                     f.write(res.content)
                 reply = Reply(ReplyType.VOICE, tmp_file_name)
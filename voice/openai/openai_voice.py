@@ -2,15 +2,17 @@
 google voice service
 """
 import json
+import os
 
 import openai
 
 from bridge.reply import Reply, ReplyType
 from common.log import logger
 from config import conf
-from voice.voice import Voice
-import requests
+from voice.voice import Voice, voice_bytes, voice_name
 from common import const
+from common import http_client
+from common.tmp_dir import TmpDir
 import datetime, random
 
 class OpenaiVoice(Voice):
@@ -19,9 +21,8 @@ class OpenaiVoice(Voice):
         openai.api_base = conf().get("open_ai_api_base") or "https://api.openai.com/v1"
 
     def voiceToText(self, voice_file):
-        logger.debug("[Openai] voice file name={}".format(voice_file))
+        logger.debug("[Openai] voice file name={}".format(voice_name(voice_file)))
         try:
-            file = open(voice_file, "rb")
             api_base = conf().get("open_ai_api_base") or "https://api.openai.com/v1"
             url = f'{api_base}/audio/transcriptions'
             headers = {
@@ -29,16 +30,17 @@ class OpenaiVoice(Voice):
                 # 'Content-Type': 'multipart/form-data' # 加了会报错，不知道什么原因
             }
             files = {
-                "file": file,
+                # 文件名的后缀用于服务端识别音频格式
+                "file": (os.path.basename(voice_name(voice_file)), voice_bytes(voice_file)),
             }
             data = {
                 "model": "whisper-1",
             }
-            response = requests.post(url, headers=headers, files=files, data=data)
+            response = http_client.post(url, headers=headers, files=files, data=data)
             response_data = response.json()
             text = response_data['text']
             reply = Reply(ReplyType.TEXT, text)
-            logger.info("[Openai] voiceToText text={} voice file name={}".format(text, voice_file))
+            logger.info("[Openai] voiceToText text={} voice file name={}".format(text, voice_name(voice_file)))
         except Exception as e:
             reply = Reply(ReplyType.ERROR, "我暂时还无法听清您的语音，请稍后再试吧~")
         finally:
@@ -58,8 +60,8 @@ class OpenaiVoice(Voice):
                 'input': text,
                 'voice': conf().get("tts_voice_id") or "alloy"
             }
-            response = requests.post(url, headers=headers, json=data)
-            file_name = "tmp/" + datetime.datetime.now().strftime('%Y%m%d%H%M%S') + str(random.randint(0, 1000)) + ".mp3"
+            response = http_client.post(url, headers=headers, json=data)
+            file_name = TmpDir().new_file(".mp3", prefix="reply-")
             logger.debug(f"[OPENAI] text_to_Voice file_name={file_name}, input={text}")
             with open(file_name, 'wb') as f:
                 f.write(response.content)
@@ -32,11 +32,13 @@ class PyttsVoice(Voice):
             # TODO: check if this is work on win32
             self.engine.startLoop(useDriverLoop=False)
 
+    def tts_cache_params(self):
+        return self.engine.getProperty("voice"), self.engine.getProperty("rate")
+
     def textToVoice(self, text):
         try:
-            # Avoid the same filename under multithreading
-            wavFileName = "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".wav"
-            wavFile = TmpDir().path() + wavFileName
+            wavFile = TmpDir().new_file(".wav", prefix="reply-")
+            wavFileName = os.path.basename(wavFile)
             logger.info("[Pytts] textToVoice text={} voice file name={}".format(text, wavFile))
 
             self.engine.save_to_file(text, wavFile)
@@ -0,0 +1,286 @@
+"""
+语音合成缓存
+固定的欢迎语、关注回复和重复的回复每次都要重新合成，这里按 (引擎, 引擎参数(音色、模型等), 规范化后的文本) 缓存合成好的音频文件，
+通道转换后的格式(amr、silk、mp3)按源音频内容的hash缓存，同一段语音不必重复编码。
+缓存文件保存在磁盘上，按最近使用淘汰，总大小不超过 tts_cache_max_size，重启后继续使用
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import unicodedata
+import uuid
+from collections import OrderedDict
+
+from bridge.reply import Reply, ReplyType
+from common import event_loop, tracing
+from common.log import logger
+from common.tmp_dir import TmpDir, track_tmp
+from config import conf, get_appdata_dir
+
+INDEX_FILE = "index.json"
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def make_key(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def file_digest(path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class TtsCache(object):
+    """
+    index 按最近使用排序，key -> {"ext": 后缀, "size": 字节数, "meta": 附加信息}
+    命中时把缓存文件复制一份到临时目录返回，通道发送后删除的是副本，缓存文件不受影响
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        os.makedirs(path, exist_ok=True)
+        self._load_index()
+
+    def _file(self, key, ext):
+        return os.path.join(self.path, key + ext)
+
+    def _load_index(self):
+        index_path = os.path.join(self.path, INDEX_FILE)
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            entries = []
+        except Exception as e:
+            logger.warning("[TtsCache] load index failed, start with empty cache: {}".format(e))
+            entries = []
+        for key, entry in entries:
+            if os.path.exists(self._file(key, entry["ext"])):
+                self.index[key] = entry
+                self.total_bytes += entry["size"]
+        self._evict()
+
+    def _save_index(self):
+        """只在写入和淘汰时保存，命中只调整内存中的顺序，重启后的淘汰顺序是近似的"""
+        index_path = os.path.join(self.path, INDEX_FILE)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(list(self.index.items()), f, ensure_ascii=False)
+        os.replace(tmp_path, index_path)
+
+    def _evict(self):
+        while self.index and self.total_bytes > self.max_bytes:
+            key, entry = self.index.popitem(last=False)
+            self.total_bytes -= entry["size"]
+            self.evictions += 1
+            try:
+                os.remove(self._file(key, entry["ext"]))
+            except OSError:
+                pass
+
+    def get(self, key, dst_path=None):
+        """
+        命中时把缓存文件复制到dst_path(默认为临时目录下的新文件)，返回 (文件路径, meta)，未命中返回None
+        """
+        with self.lock:
+            entry = self.index.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.index.move_to_end(key)
+        if dst_path is None:
+            dst_path = TmpDir().new_file(entry["ext"], prefix="reply-")
+        try:
+            shutil.copyfile(self._file(key, entry["ext"]), dst_path)
+        except OSError:  # 复制时被其它线程淘汰
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        return dst_path, entry.get("meta")
+
+    def put(self, key, src_path, meta=None):
+        """复制src_path到缓存目录，超过单个文件上限(总容量)的不缓存"""
+        size = os.path.getsize(src_path)
+        if size == 0 or size > self.max_bytes:
+            return
+        ext = os.path.splitext(src_path)[1]
+        tmp_path = os.path.join(self.path, key + ".tmp-" + uuid.uuid4().hex[:8])
+        shutil.copyfile(src_path, tmp_path)
+        os.replace(tmp_path, self._file(key, ext))
+        with self.lock:
+            old = self.index.pop(key, None)
+            if old is not None:
+                self.total_bytes -= old["size"]
+                if old["ext"] != ext:
+                    try:
+                        os.remove(self._file(key, old["ext"]))
+                    except OSError:
+                        pass
+            self.index[key] = {"ext": ext, "size": size, "meta": meta}
+            self.total_bytes += size
+            self.stores += 1
+            self._evict()
+            self._save_index()
+
+    def voice_key(self, voice, engine, text):
+        return make_key("tts", engine, voice.tts_cache_params(), normalize_text(text))
+
+    def synthesize(self, voice, engine, text) -> Reply:
+        """先查缓存，未命中时调用引擎合成并写入缓存"""
+        key = self.voice_key(voice, engine, text)
+        cached = self.get(key)
+        if cached:
+            logger.debug("[TtsCache] hit, text={}".format(text))
+            return Reply(ReplyType.VOICE, cached[0])
+        reply = voice.textToVoice(text)
+        self._store_reply(key, reply)
+        return reply
+
+    async def synthesize_async(self, voice, engine, text) -> Reply:
+        key = self.voice_key(voice, engine, text)
+        cached = await event_loop.run_sync(self.get, key)
+        if cached:
+            logger.debug("[TtsCache] hit, text={}".format(text))
+            return Reply(ReplyType.VOICE, cached[0])
+        reply = await voice.textToVoice_async(text)
+        await event_loop.run_sync(self._store_reply, key, reply)
+        return reply
+
+    def _store_reply(self, key, reply):
+        if reply and reply.type == ReplyType.VOICE and reply.content and os.path.exists(reply.content):
+            try:
+                self.put(key, reply.content)
+            except Exception as e:
+                logger.warning("[TtsCache] store voice failed: {}".format(e))
+
+    def convert(self, src_path, dst_path, fmt, func):
+        """
+        通道发送前的格式转换，按源文件内容缓存转换结果
+        func(src_path, dst_path) 完成转换，返回值(如语音时长)需要可以json序列化，命中时原样返回
+        """
+        key = make_key("convert", fmt, file_digest(src_path))
+        cached = self.get(key, dst_path)
+        if cached:
+            return cached[1]
+        result = func(src_path, dst_path)
+        try:
+            self.put(key, dst_path, result)
+        except Exception as e:
+            logger.warning("[TtsCache] store converted voice failed: {}".format(e))
+        return result
+
+    def prewarm(self, voice, engine, phrases):
+        """合成并缓存常用语句，已缓存的跳过"""
+        count = 0
+        for text in phrases:
+            if not text:
+                continue
+            key = self.voice_key(voice, engine, text)
+            with self.lock:
+                if key in self.index:
+                    continue
+            try:
+                reply = voice.textToVoice(text)
+                self._store_reply(key, reply)
+                if reply and reply.type == ReplyType.VOICE:
+                    count += 1
+                    os.remove(reply.content)
+            except Exception as e:
+                logger.warning("[TtsCache] prewarm failed, text={}, error={}".format(text, e))
+        logger.info("[TtsCache] prewarm finished, {} phrases synthesized".format(count))
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.index),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.stores = self.evictions = 0
+
+    def clear(self):
+        with self.lock:
+            for key, entry in self.index.items():
+                try:
+                    os.remove(self._file(key, entry["ext"]))
+                except OSError:
+                    pass
+            self.index.clear()
+            self.total_bytes = 0
+            self._save_index()
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tts_cache():
+    """未开启tts_cache时返回None"""
+    global _cache
+    if not conf().get("tts_cache", False):
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                path = conf().get("tts_cache_dir") or os.path.join(get_appdata_dir(), "tts_cache")
+                max_bytes = int(conf().get("tts_cache_max_size", 200) * 1024 * 1024)
+                logger.info("[TtsCache] use tts cache: {}".format(path))
+                _cache = TtsCache(path, max_bytes)
+    return _cache
+
+
+def cached_convert(src_path, dst_path, fmt, func):
+    """未开启缓存时直接转换，转换结果登记到当前消息的临时文件作用域"""
+    track_tmp(dst_path)
+    cache = get_tts_cache()
+    with tracing.span("voice.convert", fmt=fmt):
+        if cache is None:
+            return func(src_path, dst_path)
+        return cache.convert(src_path, dst_path, fmt, func)
+
+
+def start_prewarm():
+    """启动时在后台线程中预先合成 tts_cache_prewarm 中的语句"""
+    cache = get_tts_cache()
+    phrases = conf().get("tts_cache_prewarm", [])
+    if cache is None or not phrases:
+        return
+    from bridge.bridge import Bridge
+
+    bridge = Bridge()
+
+    def run():
+        try:
+            cache.prewarm(bridge.get_bot("text_to_voice"), bridge.get_bot_type("text_to_voice"), phrases)
+        except Exception as e:
+            logger.warning("[TtsCache] prewarm failed: {}".format(e))
+
+    threading.Thread(target=run, name="tts-prewarm", daemon=True).start()
@@ -1,12 +1,21 @@
 """
 Voice service abstract class
 """
+import io
+import os
+import tempfile
+from contextlib import contextmanager
+
+from common.event_loop import run_sync
+from config import conf
 
 
 class Voice(object):
     def voiceToText(self, voice_file):
         """
         Send voice to voice service and get text
+        voice_file 可以是文件路径，也可以是内存中的音频(bytes或带name属性的BytesIO，name的后缀表示格式)，
+        各实现通过 voice_bytes/open_voice/voice_path 读取，不需要关心是哪一种
         """
         raise NotImplementedError
 
@@ -15,3 +24,67 @@ class Voice(object):
         Send text to voice service and get voice
         """
         raise NotImplementedError
+
+    def tts_cache_params(self):
+        """
+        影响合成结果的引擎参数(音色、模型等)，作为语音合成缓存key的一部分，需要可以json序列化
+        """
+        return conf().get("tts_voice_id"), conf().get("text_to_voice_model")
+
+    async def voiceToText_async(self, voice_file):
+        """
+        asyncio模式下调用，默认在线程池中执行同步的voiceToText
+        """
+        return await run_sync(self.voiceToText, voice_file)
+
+    async def textToVoice_async(self, text):
+        """
+        asyncio模式下调用，默认在线程池中执行同步的textToVoice
+        """
+        return await run_sync(self.textToVoice, text)
+
+
+def voice_name(voice):
+    """文件路径原样返回，内存音频返回其name，没有name时按wav处理"""
+    if isinstance(voice, str):
+        return voice
+    return getattr(voice, "name", None) or "voice.wav"
+
+
+def voice_bytes(voice) -> bytes:
+    """读取语音的全部内容"""
+    if isinstance(voice, str):
+        with open(voice, "rb") as f:
+            return f.read()
+    if isinstance(voice, (bytes, bytearray, memoryview)):
+        return bytes(voice)
+    return voice.getvalue()
+
+
+def open_voice(voice):
+    """返回从头开始读的文件对象，内存音频每次返回新的BytesIO，多次调用互不影响读取位置"""
+    if isinstance(voice, str):
+        return open(voice, "rb")
+    buffer = io.BytesIO(voice_bytes(voice))
+    buffer.name = voice_name(voice)
+    return buffer
+
+
+@contextmanager
+def voice_path(voice):
+    """
+    只接受文件路径的SDK使用，内存音频写入临时文件，退出时删除
+    """
+    if isinstance(voice, str):
+        yield voice
+        return
+    fd, path = tempfile.mkstemp(suffix=os.path.splitext(voice_name(voice))[1] or ".wav")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(voice_bytes(voice))
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
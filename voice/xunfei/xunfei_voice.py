@@ -25,7 +25,7 @@ from bridge.reply import Reply, ReplyType
 from common.log import logger
 from common.tmp_dir import TmpDir
 from config import conf
-from voice.voice import Voice
+from voice.voice import Voice, open_voice, voice_name
 from .xunfei_asr import xunfei_asr
 from .xunfei_tts import xunfei_tts
 from voice.audio_convert import any_to_mp3
@@ -54,7 +54,7 @@ class XunfeiVoice(Voice):
     def voiceToText(self, voice_file):
         # 识别本地文件
         try:
-            logger.debug("[Xunfei] voice file name={}".format(voice_file))
+            logger.debug("[Xunfei] voice file name={}".format(voice_name(voice_file)))
             #print("voice_file===========",voice_file)
             #print("voice_file_type===========",type(voice_file))
             #mp3_name, file_extension = os.path.splitext(voice_file)
@@ -65,7 +65,7 @@ class XunfeiVoice(Voice):
             #shutil.copy2(voice_file, 'tmp/test1.wav')
             #shutil.copy2(mp3_file, 'tmp/test1.mp3')
             #print("voice and mp3 file",voice_file,mp3_file)
-            text = xunfei_asr(self.APPID,self.APISecret,self.APIKey,self.BusinessArgsASR,voice_file)
+            text = xunfei_asr(self.APPID,self.APISecret,self.APIKey,self.BusinessArgsASR,open_voice(voice_file))
             logger.info("讯飞语音识别到了: {}".format(text))
             reply = Reply(ReplyType.TEXT, text)
         except Exception as e:
@@ -73,10 +73,12 @@ class XunfeiVoice(Voice):
             reply = Reply(ReplyType.ERROR, "讯飞语音识别出错了；{0}")
         return reply
 
+    def tts_cache_params(self):
+        return self.BusinessArgsTTS
+
     def textToVoice(self, text):
         try:
-            # Avoid the same filename under multithreading
-            fileName = TmpDir().path() + "reply-" + str(int(time.time())) + "-" + str(hash(text) & 0x7FFFFFFF) + ".mp3"
+            fileName = TmpDir().new_file(".mp3", prefix="reply-")
             return_file = xunfei_tts(self.APPID,self.APIKey,self.APISecret,self.BusinessArgsTTS,text,fileName)
             logger.info("[Xunfei] textToVoice text={} voice file name={}".format(text, fileName))
             reply = Reply(ReplyType.VOICE, fileName)